@@ -1,6 +1,14 @@
 from flask import Flask
 from config import Config
 from utils.db import init_db, mail # <-- Import mail from utils.db
+from utils.properties import init_properties, properties_cli, migrate_properties_command
+from utils.metrics import init_metrics
+from utils.query_budget import init_query_recorder
+from utils.profiler import init_profiler
+from utils.kitchen_feed import init_kitchen_feed
+from utils.uploads import init_uploads
+from utils.write_behind import init_write_behind
+from utils.startup import init_template_cache, precompile_templates_command, startup_report_command
 
 # Import blueprints
 from routes.main import main_bp
@@ -9,6 +17,18 @@ from routes.booking import booking_bp
 from routes.food import food_bp
 from routes.payment import payment_bp
 from routes.admin import admin_bp
+from routes.api import api_bp
+
+# CLI commands
+from utils.seed import seed_data_command
+from utils.indexes import create_indexes_command
+from utils.stays import migrate_booking_dates_command
+from utils.pricing import set_rate_rules_command
+from utils.bench import bench_cli
+from utils.archive import archive_command
+from utils.promos import promos_cli
+from utils.reconcile import reconcile_payments_command
+from utils.campaigns import campaigns_cli
 
 def create_app():
     """Create and configure the Flask application."""
@@ -19,6 +39,22 @@ def create_app():
     init_db(app) 
     # (mail.init_app is now handled inside init_db)
 
+    # Which hotel a request is for: /p/<code>/ prefix, then Host, then DEFAULT_PROPERTY
+    init_properties(app)
+
+    # Request latency + Mongo/SMTP/PDF telemetry, exported on /metrics
+    init_metrics(app)
+    # Round-trip budgets / N+1 detection (QUERY_RECORDER=log|raise)
+    init_query_recorder(app)
+    # Sampling profiler for flagged/sampled requests (PROFILER_ENABLED)
+    init_profiler(app)
+    init_kitchen_feed(app)
+    init_uploads(app)
+    # Batched inserts for append-only collections (contacts, reviews, audit_log)
+    init_write_behind(app)
+    # Compiled templates shared by all workers (fill with `flask precompile-templates`)
+    init_template_cache(app)
+
     # Register blueprints
     app.register_blueprint(main_bp)
     app.register_blueprint(auth_bp, url_prefix='/auth')
@@ -26,6 +62,22 @@ def create_app():
     app.register_blueprint(food_bp, url_prefix='/food')
     app.register_blueprint(payment_bp, url_prefix='/payment')
     app.register_blueprint(admin_bp, url_prefix='/admin') 
+    app.register_blueprint(api_bp, url_prefix='/api/v1')
+
+    # Register CLI commands (flask --app app <command>)
+    app.cli.add_command(seed_data_command)
+    app.cli.add_command(create_indexes_command)
+    app.cli.add_command(migrate_booking_dates_command)
+    app.cli.add_command(set_rate_rules_command)
+    app.cli.add_command(bench_cli)
+    app.cli.add_command(archive_command)
+    app.cli.add_command(promos_cli)
+    app.cli.add_command(reconcile_payments_command)
+    app.cli.add_command(campaigns_cli)
+    app.cli.add_command(properties_cli)
+    app.cli.add_command(migrate_properties_command)
+    app.cli.add_command(precompile_templates_command)
+    app.cli.add_command(startup_report_command)
 
     return app
 
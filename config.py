@@ -13,4 +13,57 @@ class Config:
     MAIL_PORT = int(os.environ.get('MAIL_PORT') or 587)
     MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS') is not None
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
-    MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
\ No newline at end of file
+    MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
+
+    # Mongo query recorder: 'log' (staging) or 'raise' (tests); off when unset
+    QUERY_RECORDER = os.environ.get('QUERY_RECORDER')
+
+    # /metrics (utils/metrics.py) answers only these client addresses/networks, or a
+    # request with `Authorization: Bearer <METRICS_TOKEN>`; everyone else gets a 404
+    METRICS_ALLOW_IPS = os.environ.get('METRICS_ALLOW_IPS') or '127.0.0.1,::1'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+    # Read routing for reports: 'secondaryPreferred' (default) or 'primary' to disable.
+    # Staleness must be >= 90s; tags like 'nodeType:ANALYTICS' pick analytics nodes.
+    ANALYTICS_READ_PREFERENCE = os.environ.get('ANALYTICS_READ_PREFERENCE') or 'secondaryPreferred'
+    ANALYTICS_MAX_STALENESS = int(os.environ.get('ANALYTICS_MAX_STALENESS') or 120)
+    ANALYTICS_READ_TAGS = os.environ.get('ANALYTICS_READ_TAGS')
+
+    # `flask archive` moves finished records older than this into *_archive.
+    # Keep it >= 365 so the occupancy report's past year stays in the hot set.
+    ARCHIVE_HORIZON_DAYS = int(os.environ.get('ARCHIVE_HORIZON_DAYS') or 365)
+
+    # Kitchen feed from the food_orders change stream (replica set) instead of the write path
+    KITCHEN_CHANGE_STREAM = os.environ.get('KITCHEN_CHANGE_STREAM') is not None
+
+    # Review image store (utils/uploads.py): 'local' (UPLOAD_DIR, default instance/blobs) or 'gridfs'
+    UPLOAD_BACKEND = os.environ.get('UPLOAD_BACKEND') or 'local'
+    UPLOAD_DIR = os.environ.get('UPLOAD_DIR')
+    UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES') or 5 * 1024 * 1024)
+
+    # Write-behind buffer for contacts / reviews / audit_log (utils/write_behind.py):
+    # flush after this many buffered documents or this many seconds, spooling to disk on failure
+    WRITE_BEHIND_MAX_DOCS = int(os.environ.get('WRITE_BEHIND_MAX_DOCS') or 500)
+    WRITE_BEHIND_MAX_DELAY = float(os.environ.get('WRITE_BEHIND_MAX_DELAY') or 1.0)
+    WRITE_BEHIND_SPOOL_DIR = os.environ.get('WRITE_BEHIND_SPOOL_DIR')
+
+    # Email campaigns (utils/campaigns.py), sent by `flask campaigns run`
+    CAMPAIGN_CONNECTIONS = int(os.environ.get('CAMPAIGN_CONNECTIONS') or 3)
+    CAMPAIGN_RATE_PER_SEC = float(os.environ.get('CAMPAIGN_RATE_PER_SEC') or 10)
+    CAMPAIGN_CHECKPOINT_EVERY = int(os.environ.get('CAMPAIGN_CHECKPOINT_EVERY') or 100)
+    CAMPAIGN_STALE_SECONDS = int(os.environ.get('CAMPAIGN_STALE_SECONDS') or 300)
+    CAMPAIGN_BASE_URL = os.environ.get('CAMPAIGN_BASE_URL') or 'http://localhost:5000'  # for unsubscribe links
+
+    # Multi-property (utils/properties.py): the hotel served when neither the
+    # /p/<code>/ path prefix nor the Host header names one
+    DEFAULT_PROPERTY = os.environ.get('DEFAULT_PROPERTY') or 'blr'
+
+    # Cold start (utils/startup.py): shared Jinja bytecode cache, boot budget for startup-report
+    JINJA_CACHE_DIR = os.environ.get('JINJA_CACHE_DIR')
+    STARTUP_BUDGET_MS = float(os.environ.get('STARTUP_BUDGET_MS') or 500)
+
+    # On-demand sampling profiler (see utils/profiler.py)
+    PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED') is not None
+    PROFILE_SAMPLE_EVERY = int(os.environ.get('PROFILE_SAMPLE_EVERY') or 0)  # 0 = only on request
+    PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP') or 50)
+    PROFILE_DIR = os.environ.get('PROFILE_DIR')
\ No newline at end of file
@@ -1,9 +1,18 @@
 import datetime
-from flask import Blueprint, render_template, session, flash, request, redirect, url_for
-from utils.db import mongo
+from flask import Blueprint, render_template, session, flash, request, redirect, url_for, current_app, send_from_directory, abort, Response, jsonify
+from utils.db import mongo, analytics_db
 from functools import wraps
 from bson.objectid import ObjectId
 import re # <-- 1. IMPORT REGEX
+from utils.profiler import list_profiles, profile_dir, make_profile_token
+from utils.occupancy import occupancy_report
+from utils.properties import current_property, scoped
+from utils.archive import find_with_archive, archive_name, with_archive, count_with_archive
+from utils.kitchen_feed import kitchen_feed, open_orders, format_event, KITCHEN_STATUSES
+from utils.export import EXPORTS, FORMATS, ExportError, export_query, export_cursors, export_stream
+from utils.write_behind import audit
+from utils.campaigns import create_campaign, set_campaign_status, unsubscribe_token, CAMPAIGN_TEMPLATE
+from utils.promos import promo_cache, PromoError
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -28,21 +37,26 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def paid_revenue(db, name):
+    """Sum of total_cost over this property's paid documents (archived included), computed server-side."""
+    result = list(db[name].aggregate(with_archive(name, scoped(payment_status='paid')) + [
+        {'$group': {'_id': None, 'total': {'$sum': '$total_cost'}}}
+    ]))
+    return result[0]['total'] if result else 0
+
 # --- Admin Dashboard ---
 @admin_bp.route('/dashboard')
 @admin_required
 def dashboard():
-    """Serves the admin dashboard with site-wide stats."""
-    total_users = mongo.db.users.count_documents({})
-    total_bookings = mongo.db.bookings.count_documents({})
-    total_orders = mongo.db.food_orders.count_documents({})
+    """Serves the admin dashboard with the property's stats (read from a secondary)."""
+    db = analytics_db()
+    # Guests are chain-wide; bookings and orders are the property's, archived ones included
+    total_users = db.users.estimated_document_count()
+    total_bookings = count_with_archive('bookings', scoped(), db=db)
+    total_orders = count_with_archive('food_orders', scoped(), db=db)
     
-    total_revenue_bookings = sum(b.get('total_cost', 0) for b in mongo.db.bookings.find(
-        {'payment_status': 'paid'}
-    ))
-    total_revenue_food = sum(f.get('total_cost', 0) for f in mongo.db.food_orders.find(
-        {'payment_status': 'paid'}
-    ))
+    total_revenue_bookings = paid_revenue(db, 'bookings')
+    total_revenue_food = paid_revenue(db, 'food_orders')
     total_revenue = total_revenue_bookings + total_revenue_food
     
     stats = {
@@ -52,7 +66,7 @@ def dashboard():
         'total_revenue': round(total_revenue, 0)
     }
     
-    recent_bookings = list(mongo.db.bookings.find().sort('created_at', -1).limit(5))
+    recent_bookings = list(db.bookings.find(scoped()).sort('created_at', -1).limit(5))
     
     return render_template('admin_dashboard.html', stats=stats, recent_bookings=recent_bookings)
 
@@ -61,14 +75,15 @@ def dashboard():
 @admin_required
 def manage_users():
     """Displays all users."""
-    users = list(mongo.db.users.find())
+    users = list(analytics_db().users.find())
     return render_template('admin_users.html', users=users)
 
 @admin_bp.route('/users/delete/<id>')
 @admin_required
 def delete_user(id):
     """Deletes a user."""
-    mongo.db.users.delete_one({'_id': ObjectId(id)})
+    result = mongo.db.users.delete_one({'_id': ObjectId(id)})
+    audit('delete_user', user_id=id, deleted=result.deleted_count)
     flash('User deleted successfully.', 'success')
     return redirect(url_for('admin.manage_users'))
 
@@ -81,23 +96,27 @@ def manage_bookings():
     # 2. Get the search query from the URL
     search_query = request.args.get('search_query')
     
-    query_filter = {} # Start with an empty filter
+    query_filter = scoped() # Start with the property filter
     
     if search_query:
         # 3. Create a case-insensitive regex
         regex = re.compile(f'.*{re.escape(search_query)}.*', re.IGNORECASE)
         
         # 4. Build a query to search multiple fields
-        query_filter = {
+        query_filter = scoped({
             '$or': [
                 {'user_email': regex},
                 {'room_type': regex},
                 {'booking_id': regex}
             ]
-        }
+        })
     
-    # 5. Find bookings using the filter (it's empty if no search)
-    bookings = list(mongo.db.bookings.find(query_filter).sort('created_at', -1))
+    # 5. Find bookings using the filter (it's empty if no search).
+    # Searches also cover archived bookings; the plain listing is the hot set only.
+    if search_query:
+        bookings = find_with_archive('bookings', query_filter, sort=[('created_at', -1)], db=analytics_db())
+    else:
+        bookings = list(analytics_db().bookings.find(query_filter).sort('created_at', -1))
     
     # 6. Pass the search query back to the template
     return render_template('admin_bookings.html', bookings=bookings, search_query=search_query)
@@ -107,6 +126,167 @@ def manage_bookings():
 @admin_required
 def delete_booking(booking_id_str):
     """Deletes a booking by its string UUID."""
-    mongo.db.bookings.delete_one({'booking_id': booking_id_str})
+    prop = current_property()
+    result = mongo.db.bookings.delete_one(prop.scoped(booking_id=booking_id_str))
+    if not result.deleted_count:
+        result = mongo.db[archive_name('bookings')].delete_one(prop.scoped(booking_id=booking_id_str))
+    audit('delete_booking', booking_id=booking_id_str, deleted=result.deleted_count)
+    prop.occupancy_model.mark_stale()
     flash('Booking deleted successfully.', 'success')
-    return redirect(url_for('admin.manage_bookings'))
\ No newline at end of file
+    return redirect(url_for('admin.manage_bookings'))
+
+
+# --- Exports ---
+@admin_bp.route('/export')
+@admin_required
+def export():
+    """Streams bookings / food_orders / payments as CSV or NDJSON (see utils/export.py)."""
+    kind = request.args.get('kind', 'bookings')
+    fmt = request.args.get('format', 'csv')
+    if kind not in EXPORTS or fmt not in FORMATS:
+        abort(404)
+    try:
+        query = scoped(export_query(kind, request.args))
+    except ExportError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('admin.manage_bookings'))
+    except ValueError:
+        flash('Dates must be in YYYY-MM-DD format.', 'error')
+        return redirect(url_for('admin.manage_bookings'))
+
+    gzip = request.args.get('gzip') == '1'
+    cursors = export_cursors(analytics_db(), kind, query,
+                             include_archive=request.args.get('include_archive') == '1')
+    filename = f"{current_property().code}-{kind}-{datetime.date.today().isoformat()}.{fmt}" + ('.gz' if gzip else '')
+    return Response(export_stream(cursors, kind, fmt, gzip),
+                    mimetype='application/gzip' if gzip else FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"',
+                             'X-Accel-Buffering': 'no'})
+
+
+# --- Occupancy ---
+@admin_bp.route('/occupancy')
+@admin_required
+def occupancy():
+    """Per-room-type occupancy heatmap and 90-night pace forecast."""
+    past = request.args.get('view') == 'past'
+    report = occupancy_report(current_property().occupancy_model, past=past)
+    return render_template('admin_occupancy.html', report=report, past=past)
+
+
+# --- Kitchen Display ---
+@admin_bp.route('/kitchen')
+@admin_required
+def kitchen():
+    """Live queue of open food orders (fed by /admin/kitchen/stream)."""
+    return render_template('admin_kitchen.html', statuses=KITCHEN_STATUSES)
+
+
+@admin_bp.route('/kitchen/stream')
+@admin_required
+def kitchen_stream():
+    """Server-sent events: a snapshot (or the missed events on reconnect), then live updates."""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    code = current_property().code
+    q, missed = kitchen_feed.subscribe(last_event_id, code)
+    if missed is None:
+        # Subscribed before reading, so nothing published meanwhile is lost
+        try:
+            initial = [format_event(None, 'snapshot', open_orders(code))]
+        except Exception:
+            kitchen_feed.unsubscribe(q)
+            raise
+    else:
+        initial = [format_event(*item) for item in missed]
+    return Response(kitchen_feed.stream(q, initial), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@admin_bp.route('/kitchen/orders/<order_id>', methods=['POST'])
+@admin_required
+def kitchen_order_status(order_id):
+    """Moves a food order along the kitchen workflow."""
+    status = request.form.get('status')
+    if status not in KITCHEN_STATUSES:
+        return jsonify({'error': 'Unknown status.'}), 400
+    prop = current_property()
+    result = mongo.db.food_orders.update_one(prop.scoped(order_id=order_id), {'$set': {'kitchen_status': status}})
+    if not result.matched_count:
+        return jsonify({'error': 'Order not found.'}), 404
+    kitchen_feed.orders_updated([order_id], {'kitchen_status': status}, prop.code)
+    return jsonify({'order_id': order_id, 'kitchen_status': status})
+
+
+# --- Email Campaigns ---
+@admin_bp.route('/campaigns', methods=['GET', 'POST'])
+@admin_required
+def campaigns():
+    """Queues campaigns and shows their progress; `flask campaigns run` does the sending."""
+    if request.method == 'POST':
+        subject = request.form.get('subject', '').strip()
+        if not subject:
+            flash('A campaign needs a subject.', 'error')
+            return redirect(url_for('admin.campaigns'))
+        try:
+            campaign_id = create_campaign(subject, request.form.get('promo_code'), session.get('user_email'))
+        except PromoError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('admin.campaigns'))
+        audit('create_campaign', campaign_id=campaign_id, subject=subject)
+        flash('Campaign queued.', 'success')
+        return redirect(url_for('admin.campaigns'))
+    campaigns = list(mongo.db.campaigns.find({}, {'errors': {'$slice': -1}}).sort('created_at', -1).limit(50))
+    return render_template('admin_campaigns.html', campaigns=campaigns, promo_codes=promo_cache.active_codes())
+
+
+@admin_bp.route('/campaigns/<campaign_id>/status', methods=['POST'])
+@admin_required
+def campaign_status(campaign_id):
+    """Pause (the runner stops at its next checkpoint) or re-queue a campaign."""
+    status = request.form.get('status')
+    if status == 'paused':
+        changed = set_campaign_status(campaign_id, 'paused', ['queued', 'running'])
+    elif status == 'queued':
+        changed = set_campaign_status(campaign_id, 'queued', ['paused', 'failed'])
+    else:
+        abort(400)
+    if changed:
+        audit('campaign_status', campaign_id=campaign_id, status=status)
+        flash(f'Campaign {status}.', 'success')
+    else:
+        flash('The campaign has moved on; nothing changed.', 'warning')
+    return redirect(url_for('admin.campaigns'))
+
+
+@admin_bp.route('/campaigns/<campaign_id>/preview')
+@admin_required
+def campaign_preview(campaign_id):
+    """The campaign email as the signed-in admin would receive it."""
+    campaign = mongo.db.campaigns.find_one({'_id': ObjectId(campaign_id)}, {'template': 1, 'promo_code': 1})
+    if not campaign:
+        abort(404)
+    promo = promo_cache.get(campaign['promo_code']) if campaign.get('promo_code') else None
+    return render_template(campaign.get('template') or CAMPAIGN_TEMPLATE, username=session.get('username'),
+                           promo=promo,
+                           unsubscribe_url=url_for('main.unsubscribe', token=unsubscribe_token(session['user_email']),
+                                                   _external=True))
+
+
+# --- Request Profiles ---
+@admin_bp.route('/profiles')
+@admin_required
+def profiles():
+    """Lists the most recent request profiles (newest first)."""
+    return render_template('admin_profiles.html',
+                           profiles=list_profiles(profile_dir(current_app)),
+                           enabled=current_app.config.get('PROFILER_ENABLED'),
+                           token=make_profile_token(current_app.config['SECRET_KEY']))
+
+
+@admin_bp.route('/profiles/<name>')
+@admin_required
+def download_profile(name):
+    """Downloads one collapsed-stack profile file."""
+    if not name.endswith('.folded'):
+        abort(404)
+    return send_from_directory(profile_dir(current_app), name, as_attachment=True, mimetype='text/plain')
@@ -0,0 +1,186 @@
+import datetime
+import gzip
+from functools import wraps
+from flask import Blueprint, request, session, jsonify
+from utils.db import mongo
+from utils.pagination import paginate, InvalidCursor
+from utils.query_budget import query_budget
+from utils.archive import find_one_with_archive, paginate_with_archive
+from utils.properties import scoped
+
+api_bp = Blueprint('api', __name__)
+
+# --- /api/v1: JSON for the mobile app ---
+# Same session login as the website. Every read returns only the fields the
+# app shows (Mongo projections), lists are keyset-paginated with an opaque
+# ?cursor=, responses carry a weak ETag so unchanged data comes back as an
+# empty 304, and bodies over GZIP_MIN_BYTES are gzipped when the client allows.
+# Everything is scoped to the request's property (host or /p/<code>/api/v1).
+# Guest history lists include archived records (two round trips per page).
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+GZIP_MIN_BYTES = 512
+NEWEST_FIRST = [('created_at', -1), ('_id', -1)]
+
+BOOKING_FIELDS = {
+    'booking_id': 1, 'room_type': 1, 'room_number': 1, 'check_in': 1, 'check_out': 1,
+    'guests': 1, 'total_cost': 1, 'status': 1, 'payment_status': 1, 'created_at': 1
+}
+FOOD_ORDER_FIELDS = {
+    'order_id': 1, 'items': 1, 'total_cost': 1, 'room_number': 1, 'payment_status': 1, 'created_at': 1
+}
+PAYMENT_FIELDS = {
+    'order_id': 1, 'payment_id': 1, 'amount': 1, 'original_amount': 1, 'discount_applied': 1,
+    'promo_code': 1, 'payment_method': 1, 'booking_ids': 1, 'food_order_ids': 1, 'status': 1,
+    'created_at': 1
+}
+REVIEW_FIELDS = {
+    'username': 1, 'rating': 1, 'review_type': 1, 'comment': 1, 'image_file': 1, 'image_blob': 1,
+    'created_at': 1
+}
+
+
+def api_login_required(f):
+    """Like login_required, but answers 401 JSON instead of redirecting to the login page."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_email' not in session:
+            return jsonify({'error': 'Authentication required.'}), 401
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def _serialize(doc):
+    """Drops _id and turns datetimes into ISO-8601 UTC strings."""
+    out = {}
+    for key, value in doc.items():
+        if key == '_id':
+            continue
+        if isinstance(value, datetime.datetime):
+            if value.tzinfo is None:
+                value = value.replace(tzinfo=datetime.timezone.utc)
+            value = value.isoformat()
+        out[key] = value
+    return out
+
+
+def _limit():
+    try:
+        return max(1, min(int(request.args.get('limit', DEFAULT_LIMIT)), MAX_LIMIT))
+    except ValueError:
+        return DEFAULT_LIMIT
+
+
+def _page(collection, query, projection):
+    docs, next_cursor = paginate(collection, query, NEWEST_FIRST, projection=projection,
+                                 limit=_limit(), cursor=request.args.get('cursor'))
+    return jsonify({'data': [_serialize(d) for d in docs], 'next_cursor': next_cursor})
+
+
+def _history_page(name, query, projection):
+    """_page over a collection and its archive (utils/archive.py), merged."""
+    docs, next_cursor = paginate_with_archive(name, query, NEWEST_FIRST, projection=projection,
+                                              limit=_limit(), cursor=request.args.get('cursor'))
+    return jsonify({'data': [_serialize(d) for d in docs], 'next_cursor': next_cursor})
+
+
+@api_bp.errorhandler(InvalidCursor)
+def invalid_cursor(e):
+    return jsonify({'error': 'Invalid cursor.'}), 400
+
+
+@api_bp.after_request
+def conditional_and_compressed(response):
+    """ETag/If-None-Match on successful GETs, then gzip when it pays off."""
+    if request.method != 'GET' or response.status_code != 200 or response.direct_passthrough:
+        return response
+    # Weak ETag over the uncompressed body, so it also matches the gzipped variant
+    response.add_etag(weak=True)
+    response = response.make_conditional(request)
+    if response.status_code == 304:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if (len(body) >= GZIP_MIN_BYTES and 'gzip' in request.accept_encodings
+            and 'Content-Encoding' not in response.headers):
+        response.set_data(gzip.compress(body, compresslevel=5))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+# --- Bookings ---
+@api_bp.route('/bookings')
+@api_login_required
+@query_budget(2)
+def bookings():
+    return _history_page('bookings', scoped(user_email=session['user_email']), BOOKING_FIELDS)
+
+
+@api_bp.route('/bookings/<booking_id>')
+@api_login_required
+@query_budget(2)
+def booking_detail(booking_id):
+    booking, _ = find_one_with_archive(
+        'bookings', scoped(booking_id=booking_id, user_email=session['user_email']), BOOKING_FIELDS)
+    if not booking:
+        return jsonify({'error': 'Booking not found.'}), 404
+    return jsonify(_serialize(booking))
+
+
+# --- Billing ---
+@api_bp.route('/billing')
+@api_login_required
+@query_budget(2)
+def billing():
+    user_email = session['user_email']
+    unpaid_bookings = [_serialize(b) for b in mongo.db.bookings.find(scoped({
+        'user_email': user_email, 'payment_status': 'unpaid', 'status': 'active'
+    }), BOOKING_FIELDS)]
+    unpaid_food_orders = [_serialize(f) for f in mongo.db.food_orders.find(scoped({
+        'user_email': user_email, 'payment_status': 'unpaid'
+    }), FOOD_ORDER_FIELDS)]
+    total_booking_cost = sum(b['total_cost'] for b in unpaid_bookings)
+    total_food_cost = sum(f['total_cost'] for f in unpaid_food_orders)
+    return jsonify({
+        'bookings': unpaid_bookings,
+        'food_orders': unpaid_food_orders,
+        'total_booking_cost': total_booking_cost,
+        'total_food_cost': total_food_cost,
+        'grand_total': total_booking_cost + total_food_cost
+    })
+
+
+# --- Food Orders ---
+@api_bp.route('/food_orders')
+@api_login_required
+@query_budget(2)
+def food_orders():
+    return _history_page('food_orders', scoped(user_email=session['user_email']), FOOD_ORDER_FIELDS)
+
+
+# --- Payments ---
+@api_bp.route('/payments')
+@api_login_required
+@query_budget(2)
+def payments():
+    return _history_page('payments', scoped(user_email=session['user_email']), PAYMENT_FIELDS)
+
+
+@api_bp.route('/payments/<order_id>')
+@api_login_required
+@query_budget(2)
+def payment_detail(order_id):
+    payment, _ = find_one_with_archive(
+        'payments', scoped(order_id=order_id, user_email=session['user_email']), PAYMENT_FIELDS)
+    if not payment:
+        return jsonify({'error': 'Payment not found.'}), 404
+    return jsonify(_serialize(payment))
+
+
+# --- Reviews (public) ---
+@api_bp.route('/reviews')
+@query_budget(1)
+def reviews():
+    return _page(mongo.db.reviews, scoped(), REVIEW_FIELDS)
@@ -3,6 +3,7 @@ from flask import Blueprint, render_template, request, redirect, url_for, sessio
 from flask import current_app # <-- 1. Import current_app
 from werkzeug.security import generate_password_hash, check_password_hash
 from utils.db import mongo, mail # <-- 2. No more 'serializer' import
+from utils.write_behind import audit
 from flask_mail import Message
 from itsdangerous import URLSafeTimedSerializer # <-- 3. Import the tool
 
@@ -54,9 +55,11 @@ def login():
             session['username'] = user['username']
             if user.get('is_admin', False):
                 session['is_admin'] = True
+            audit('login', actor=email)
             flash('Login successful! Welcome back.', 'success')
             return redirect(url_for('main.dashboard'))
         else:
+            audit('login_failed', actor=email)
             flash('Invalid email or password. Please try again.', 'error')
             return redirect(url_for('auth.login'))
 
@@ -138,6 +141,7 @@ def reset_password_token(token):
             {'email': email},
             {'$set': {'password': hashed_password}}
         )
+        audit('password_reset', actor=email)
         
         flash('Your password has been reset! You can now login.', 'success')
         return redirect(url_for('auth.login'))
@@ -1,35 +1,43 @@
 import datetime
 import uuid
 import random
+import time
 from flask_mail import Message
 from utils.db import mail 
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify
-from utils.db import mongo
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify, abort
+from utils.db import mongo, analytics_db
 from routes.main import login_required
 from bson.objectid import ObjectId 
+from pymongo.errors import OperationFailure, PyMongoError
+from utils.query_budget import query_budget
+from utils.archive import paginate_with_archive, with_archive
+from utils.pagination import InvalidCursor
+from utils.stays import day_string, overlapping_bookings
+from utils.promos import promo_cache, PromoError
+from utils.properties import current_property, scoped
 
 booking_bp = Blueprint('booking', __name__)
 
-# Room data
-room_types = {
-    'Standard Single': {'price': 1500, 'description': 'A cozy room for a single traveler.'},
-    'Standard Double': {'price': 2500, 'description': 'Comfortable room with a double bed.'},
-    'Deluxe Double': {'price': 5000, 'description': 'Spacious room with luxury amenities.'},
-    'Suite': {'price': 8000, 'description': 'A large suite with a separate living area.'},
-    'Presidential Suite': {'price': 15000, 'description': 'The ultimate in luxury and space.'}
-}
+# Room catalog, nightly rates, occupancy and the My Bookings analytics cache
+# are per property: current_property().room_types / .price_calendar /
+# .occupancy_model / .analytics_cache (see utils/properties.py)
+
+MAX_GROUP_ROOMS = 60
+# session key: wall-clock time of the guest's last booking change (see _bookings_changed)
+BOOKINGS_CHANGED_KEY = 'bookings_changed_at'
 
-# Promo Codes
-PROMO_CODES = {
-    'SAKKATH': 10,  # 10% discount
-    'BOMBAAT': 20,  # 20% discount
-    'WELCOME': 5    # 5% discount
+BOOKINGS_PAGE_SIZE = 20
+BOOKINGS_SORT = [('created_at', -1), ('_id', -1)]
+BOOKING_TABLE_FIELDS = {
+    'booking_id': 1, 'room_type': 1, 'room_number': 1, 'check_in': 1, 'check_out': 1,
+    'total_cost': 1, 'status': 1, 'payment_status': 1, 'created_at': 1
 }
 
 @booking_bp.route('/rooms', methods=['GET', 'POST'])
 @login_required
 def rooms():
     """Handles new room booking with Email Confirmation."""
+    prop = current_property()
     if request.method == 'POST':
         try:
             room_type = request.form['room_type']
@@ -48,18 +56,20 @@ def rooms():
                 flash('Check-out date must be after check-in date.', 'error')
                 return redirect(url_for('booking.rooms'))
             
-            num_days = (check_out - check_in).days
-            price_per_night = room_types[room_type]['price']
-            total_cost = num_days * price_per_night
+            total_cost = prop.price_calendar.quote(room_type, check_in.date().toordinal(),
+                                                   check_out.date().toordinal())
             room_number = random.randint(101, 250)
 
             booking_doc = {
+                'property': prop.code,
                 'user_email': session['user_email'],
                 'booking_id': uuid.uuid4().hex, 
                 'room_type': room_type,
                 'room_number': room_number,
                 'check_in': check_in_str,
                 'check_out': check_out_str,
+                'check_in_day': check_in.date().toordinal(),
+                'check_out_day': check_out.date().toordinal(),
                 'guests': guests,
                 'total_cost': float(total_cost),
                 'status': 'active',
@@ -67,6 +77,7 @@ def rooms():
                 'created_at': datetime.datetime.now(datetime.timezone.utc)
             }
             mongo.db.bookings.insert_one(booking_doc)
+            _bookings_changed(prop, session['user_email'])
 
             # Send Email
             try:
@@ -91,51 +102,110 @@ def rooms():
             flash(f'An error occurred: {e}', 'error')
             return redirect(url_for('booking.rooms'))
 
-    return render_template('rooms.html', room_types=room_types)
+    return render_template('rooms.html', room_types=prop.room_types,
+                           from_prices=prop.price_calendar.from_prices())
+
+@booking_bp.route('/quote')
+@login_required
+def quote():
+    """Price of a stay: ?room_type=&check_in=&check_out= (YYYY-MM-DD)."""
+    room_type = request.args.get('room_type', '')
+    try:
+        check_in_day = datetime.date.fromisoformat(request.args.get('check_in', '')).toordinal()
+        check_out_day = datetime.date.fromisoformat(request.args.get('check_out', '')).toordinal()
+    except ValueError:
+        return jsonify({'error': 'Dates must be YYYY-MM-DD.'}), 400
+    prop = current_property()
+    if room_type not in prop.room_types or check_out_day <= check_in_day:
+        return jsonify({'error': 'Invalid room type or dates.'}), 400
+
+    nightly = prop.price_calendar.nightly(room_type, check_in_day, check_out_day)
+    return jsonify({'total': float(nightly.sum()), 'nightly': nightly.tolist()})
 
 @booking_bp.route('/my_bookings')
 @login_required
+# One keyset page each from bookings and bookings_archive
+@query_budget(2)
 def my_bookings():
-    """Displays all bookings with ANALYTICS DATA."""
+    """Displays one page of bookings; the charts load from my_bookings_analytics."""
     user_email = session['user_email']
-    bookings = list(mongo.db.bookings.find({'user_email': user_email}).sort('created_at', -1))
-    
-    dates_map = {}
-    for b in bookings:
-        date_str = b['check_in'] 
-        cost = b['total_cost']
-        if date_str in dates_map:
-            dates_map[date_str] += cost
-        else:
-            dates_map[date_str] = cost
-            
-    sorted_dates = sorted(dates_map.keys())
-    spending_values = [dates_map[d] for d in sorted_dates]
-    
-    room_counts = {}
-    for b in bookings:
-        rtype = b['room_type']
-        room_counts[rtype] = room_counts.get(rtype, 0) + 1
-        
-    room_labels = list(room_counts.keys())
-    room_values = list(room_counts.values())
-
-    return render_template('my_bookings.html', 
+    try:
+        bookings, next_cursor = paginate_with_archive(
+            'bookings',
+            scoped(user_email=user_email),
+            BOOKINGS_SORT,
+            projection=BOOKING_TABLE_FIELDS,
+            limit=BOOKINGS_PAGE_SIZE,
+            cursor=request.args.get('cursor')
+        )
+    except InvalidCursor:
+        abort(400)
+    return render_template('my_bookings.html',
                            bookings=bookings,
-                           chart_dates=sorted_dates,
-                           chart_spending=spending_values,
-                           chart_rooms=room_labels,
-                           chart_room_counts=room_values)
+                           next_cursor=next_cursor,
+                           is_first_page=not request.args.get('cursor'))
+
+def _bookings_changed(prop, user_email):
+    """
+    Drops the guest's cached charts and records the change in their session, so
+    every worker recomputes them from the primary until a secondary has caught up.
+    """
+    prop.analytics_cache.invalidate(user_email)
+    session[BOOKINGS_CHANGED_KEY] = time.time()
+
+@booking_bp.route('/my_bookings/analytics')
+@login_required
+@query_budget(1)
+def my_bookings_analytics():
+    """Spending-by-date and room-type series for the My Bookings charts."""
+    user_email = session['user_email']
+    prop = current_property()
+    changed_at = session.get(BOOKINGS_CHANGED_KEY, 0)
+    cached = prop.analytics_cache.get(user_email)
+    if cached is not None and cached[0] >= changed_at:
+        data = cached[1]
+    else:
+        computed_at = time.time()
+        # Right after their own change a lagging secondary could miss it: read the primary
+        recent = computed_at - changed_at < prop.analytics_cache.ttl
+        db = mongo.db if recent else analytics_db()
+        # Archived (settled, past) stays are part of the history too
+        history = with_archive('bookings', prop.scoped(user_email=user_email))
+        result = next(db.bookings.aggregate(history + [
+            {'$facet': {
+                'spending': [
+                    {'$group': {'_id': '$check_in', 'total': {'$sum': '$total_cost'}}},
+                    {'$sort': {'_id': 1}}
+                ],
+                'rooms': [
+                    {'$group': {'_id': '$room_type', 'count': {'$sum': 1}}},
+                    {'$sort': {'count': -1}}
+                ]
+            }}
+        ]))
+        data = {
+            'dates': [row['_id'] for row in result['spending']],
+            'spending': [row['total'] for row in result['spending']],
+            'rooms': [row['_id'] for row in result['rooms']],
+            'room_counts': [row['count'] for row in result['rooms']]
+        }
+        prop.analytics_cache.set(user_email, (computed_at, data))
+    response = jsonify(data)
+    response.headers['Cache-Control'] = 'private, max-age=60'
+    return response
 
 @booking_bp.route('/cancel/<booking_id_str>')
 @login_required
 def cancel_booking(booking_id_str):
     user_email = session['user_email']
+    prop = current_property()
     result = mongo.db.bookings.update_one(
-        {'booking_id': booking_id_str, 'user_email': user_email},
+        prop.scoped({'booking_id': booking_id_str, 'user_email': user_email}),
         {'$set': {'status': 'cancelled'}}
     )
     if result.modified_count > 0:
+        _bookings_changed(prop, user_email)
+        prop.occupancy_model.mark_stale()
         flash('Booking cancelled successfully.', 'success')
     else:
         flash('Could not find or cancel booking.', 'error')
@@ -143,19 +213,20 @@ def cancel_booking(booking_id_str):
 
 @booking_bp.route('/billing')
 @login_required
+@query_budget(2)
 def billing():
     user_email = session['user_email']
     
-    unpaid_bookings = list(mongo.db.bookings.find({
+    unpaid_bookings = list(mongo.db.bookings.find(scoped({
         'user_email': user_email,
         'payment_status': 'unpaid',
         'status': 'active' 
-    }))
+    })))
     
-    unpaid_food_orders = list(mongo.db.food_orders.find({
+    unpaid_food_orders = list(mongo.db.food_orders.find(scoped({
         'user_email': user_email,
         'payment_status': 'unpaid'
-    }))
+    })))
 
     total_booking_cost = sum(b['total_cost'] for b in unpaid_bookings)
     total_food_cost = sum(f['total_cost'] for f in unpaid_food_orders)
@@ -171,34 +242,165 @@ def billing():
 @booking_bp.route('/get_booked_dates/<room_type>')
 @login_required
 def get_booked_dates(room_type):
-    booked_dates = set()
-    bookings = mongo.db.bookings.find({
-        'room_type': room_type,
-        'status': 'active'
-    })
+    """Booked nights for a room type; ?start=&end= (YYYY-MM-DD) limit it to a window."""
+    start_day, end_day = 1, datetime.date.max.toordinal()
+    try:
+        if request.args.get('start'):
+            start_day = datetime.date.fromisoformat(request.args['start']).toordinal()
+        if request.args.get('end'):
+            end_day = datetime.date.fromisoformat(request.args['end']).toordinal()
+    except ValueError:
+        return jsonify({'error': 'Dates must be YYYY-MM-DD.'}), 400
 
+    booked_days = set()
+    bookings = overlapping_bookings(room_type, start_day, end_day, projection={
+        'check_in_day': 1, 'check_out_day': 1
+    }, property_code=current_property().code)
     for booking in bookings:
-        try:
-            start_date = datetime.datetime.strptime(booking['check_in'], '%Y-%m-%d')
-            end_date = datetime.datetime.strptime(booking['check_out'], '%Y-%m-%d')
-            
-            current_date = start_date
-            while current_date < end_date:
-                booked_dates.add(current_date.strftime('%Y-%m-%d'))
-                current_date += datetime.timedelta(days=1)
-        except Exception as e:
-            print(f"Error processing booking {booking['_id']}: {e}")
-            
-    return jsonify(list(booked_dates))
+        booked_days.update(range(max(booking['check_in_day'], start_day),
+                                 min(booking['check_out_day'], end_day)))
+
+    # Format each distinct night once, not once per booking-night
+    return jsonify([day_string(day) for day in sorted(booked_days)])
 
 @booking_bp.route('/apply_promo', methods=['POST'])
 @login_required
 def apply_promo():
     data = request.get_json()
     code = data.get('code', '').upper()
-    
-    if code in PROMO_CODES:
-        discount_percent = PROMO_CODES[code]
-        return jsonify({'valid': True, 'discount_percent': discount_percent})
-    else:
-        return jsonify({'valid': False})
\ No newline at end of file
+
+    # Served from the per-process promo cache; the real check happens at payment
+    try:
+        promo = promo_cache.validate(code)
+    except PromoError as e:
+        return jsonify({'valid': False, 'message': str(e)})
+    return jsonify({'valid': True, 'discount_percent': promo['percent']})
+
+# --- Group Bookings ---
+def _build_group_bookings(payload, user_email, group_id, prop):
+    """Validates and prices every room of a group request. Returns (docs, error)."""
+    rooms_requested = payload.get('rooms') or []
+    if not isinstance(rooms_requested, list) or not all(isinstance(r, dict) for r in rooms_requested):
+        return None, 'rooms must be a list of room objects.'
+    counts = []
+    for i, r in enumerate(rooms_requested, start=1):
+        try:
+            count = int(r.get('count', 1))
+        except (TypeError, ValueError):
+            return None, 'Each room entry needs a numeric count.'
+        if count < 1:
+            return None, f'Room {i}: count must be at least 1.'
+        counts.append(count)
+    total_rooms = sum(counts)
+    if total_rooms < 1 or total_rooms > MAX_GROUP_ROOMS:
+        return None, f'A group booking must have between 1 and {MAX_GROUP_ROOMS} rooms.'
+
+    today = datetime.date.today()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    room_numbers = random.sample(range(101, 251), total_rooms)
+    docs = []
+    for i, (r, count) in enumerate(zip(rooms_requested, counts), start=1):
+        room_type = r.get('room_type')
+        if room_type not in prop.room_types:
+            return None, f'Room {i}: unknown room type {room_type!r}.'
+        try:
+            check_in = datetime.date.fromisoformat(r.get('check_in', ''))
+            check_out = datetime.date.fromisoformat(r.get('check_out', ''))
+            guests = int(r.get('guests', 1))
+        except (TypeError, ValueError):
+            return None, f'Room {i}: dates must be YYYY-MM-DD and guests a number.'
+        if check_in < today:
+            return None, f'Room {i}: check-in date cannot be in the past.'
+        if check_out <= check_in:
+            return None, f'Room {i}: check-out date must be after check-in date.'
+        if guests < 1:
+            return None, f'Room {i}: at least one guest is required.'
+
+        total_cost = prop.price_calendar.quote(room_type, check_in.toordinal(), check_out.toordinal())
+        for _ in range(count):
+            docs.append({
+                'property': prop.code,
+                'user_email': user_email,
+                'booking_id': uuid.uuid4().hex,
+                'group_id': group_id,
+                'room_type': room_type,
+                'room_number': room_numbers[len(docs)],
+                'check_in': check_in.isoformat(),
+                'check_out': check_out.isoformat(),
+                'check_in_day': check_in.toordinal(),
+                'check_out_day': check_out.toordinal(),
+                'guests': guests,
+                'total_cost': total_cost,
+                'status': 'active',
+                'payment_status': 'unpaid',
+                'created_at': now
+            })
+    return docs, None
+
+def _insert_group(docs, group_id):
+    """Writes all bookings of a group or none of them."""
+    try:
+        with mongo.cx.start_session() as s:
+            s.with_transaction(lambda s: mongo.db.bookings.insert_many(docs, session=s))
+        return
+    except OperationFailure as e:
+        if e.code != 20:  # IllegalOperation: standalone server, no transactions
+            raise
+    # Without transactions: one insert_many, undone if any document failed
+    try:
+        mongo.db.bookings.insert_many(docs)
+    except PyMongoError:
+        mongo.db.bookings.delete_many({'group_id': group_id})
+        raise
+
+@booking_bp.route('/group', methods=['POST'])
+@login_required
+def group_booking():
+    """
+    Books many rooms in one request. JSON body:
+    {"group_name": "...", "rooms": [{"room_type", "check_in", "check_out", "guests", "count"}]}
+    """
+    payload = request.get_json(silent=True) or {}
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'Expected a JSON object.'}), 400
+    user_email = session['user_email']
+    prop = current_property()
+    group_id = uuid.uuid4().hex
+
+    docs, error = _build_group_bookings(payload, user_email, group_id, prop)
+    if error:
+        return jsonify({'error': error}), 400
+
+    try:
+        _insert_group(docs, group_id)
+    except PyMongoError as e:
+        return jsonify({'error': f'Group booking failed, nothing was booked: {e}'}), 500
+    _bookings_changed(prop, user_email)
+
+    grand_total = sum(d['total_cost'] for d in docs)
+    email_sent = True
+    try:
+        msg = Message(
+            subject="Group Booking Confirmation - Hotel Bombaat",
+            sender=('Hotel Bombaat', 'your-email@gmail.com'),
+            recipients=[user_email]
+        )
+        msg.html = render_template(
+            'email_group_confirmation.html',
+            username=session['username'],
+            group_name=payload.get('group_name') or 'Your group',
+            bookings=docs,
+            grand_total=grand_total
+        )
+        mail.send(msg)
+    except Exception as e:
+        email_sent = False
+        print(f"Failed to send group booking email: {e}")
+
+    return jsonify({
+        'group_id': group_id,
+        'booking_ids': [d['booking_id'] for d in docs],
+        'rooms': len(docs),
+        'total': grand_total,
+        'email_sent': email_sent
+    }), 201
@@ -5,44 +5,27 @@ from utils.db import mail
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash
 from utils.db import mongo
 from routes.main import login_required
+from utils.kitchen_feed import kitchen_feed
+from utils.properties import current_property
 
 food_bp = Blueprint('food', __name__)
 
-# Menu data
-menu = {
-    'North Indian': [
-        {'name': 'Butter Chicken', 'price': 450, 'description': 'Creamy chicken curry.'},
-        {'name': 'Dal Makhani', 'price': 300, 'description': 'Black lentils and kidney beans.'},
-        {'name': 'Paneer Tikka', 'price': 350, 'description': 'Marinated cheese cubes.'},
-    ],
-    'South Indian': [
-        {'name': 'Masala Dosa', 'price': 150, 'description': 'Crispy crepe with potato filling.'},
-        {'name': 'Idli Sambar', 'price': 100, 'description': 'Steamed rice cakes.'},
-    ],
-    'Chinese': [
-        {'name': 'Hakka Noodles', 'price': 250, 'description': 'Stir-fried noodles.'},
-        {'name': 'Manchurian', 'price': 280, 'description': 'Fried vegetable balls.'},
-    ],
-    'Continental': [
-        {'name': 'Veg Au Gratin', 'price': 400, 'description': 'Baked vegetables with cheese.'},
-        {'name': 'Grilled Chicken', 'price': 500, 'description': 'Served with mashed potatoes.'},
-    ],
-    'Desserts': [
-        {'name': 'Gulab Jamun', 'price': 120, 'description': 'Sweet milk solids balls.'},
-        {'name': 'Chocolate Brownie', 'price': 200, 'description': 'With ice cream.'},
-    ],
-    'Beverages': [
-        {'name': 'Masala Chai', 'price': 50, 'description': 'Spiced Indian tea.'},
-        {'name': 'Fresh Lime Soda', 'price': 80, 'description': 'Sweet or salted.'},
-    ]
-}
+# The menu is per property: current_property().menu (see utils/properties.py).
+# A cart belongs to the property it was filled at (session['cart_property']).
+
+
+def _cart_for(prop):
+    """Starts an empty cart when there is none, or it was filled at another property."""
+    if 'cart' not in session or session.get('cart_property', prop.code) != prop.code:
+        session['cart'] = []
+        session['cart_total'] = 0.0
+        session['cart_property'] = prop.code
 
 @food_bp.route('/', methods=['GET', 'POST'])
 @login_required
 def order():
-    if 'cart' not in session:
-        session['cart'] = [] 
-        session['cart_total'] = 0.0
+    prop = current_property()
+    _cart_for(prop)
 
     if request.method == 'POST':
         room_number_str = request.form['room_number']
@@ -56,25 +39,28 @@ def order():
             
         try:
             room_number = int(room_number_str)
-            booking = mongo.db.bookings.find_one({
+            booking = mongo.db.bookings.find_one(prop.scoped({
                 'user_email': session['user_email'],
                 'room_number': room_number,
                 'status': 'active'
-            })
+            }))
             if not booking:
                 flash(f'You do not have an active booking for room {room_number}.', 'error')
                 return redirect(url_for('food.order'))
 
             order_doc = {
+                'property': prop.code,
                 'user_email': session['user_email'],
                 'order_id': uuid.uuid4().hex,
                 'items': session['cart'],
                 'total_cost': session['cart_total'],
                 'room_number': room_number,
                 'payment_status': 'unpaid',
+                'kitchen_status': 'new',
                 'created_at': datetime.datetime.now(datetime.timezone.utc)
             }
             mongo.db.food_orders.insert_one(order_doc)
+            kitchen_feed.order_created(order_doc)
             
             # Send Food Email
             try:
@@ -94,6 +80,7 @@ def order():
 
             session.pop('cart', None)
             session.pop('cart_total', None)
+            session.pop('cart_property', None)
 
             flash('Order placed successfully! Email sent. Proceed to billing.', 'success')
             return redirect(url_for('booking.billing'))
@@ -102,17 +89,14 @@ def order():
              flash('Invalid room number.', 'error')
              return redirect(url_for('food.order'))
 
-    return render_template('food.html', menu=menu, cart=session.get('cart'), total=session.get('cart_total'))
+    return render_template('food.html', menu=prop.menu, cart=session.get('cart'), total=session.get('cart_total'))
 
 @food_bp.route('/add_to_cart', methods=['POST'])
 @login_required
 def add_to_cart():
     item_name = request.form['name']
     item_price = float(request.form['price'])
-    
-    if 'cart' not in session:
-        session['cart'] = []
-        session['cart_total'] = 0.0
+    _cart_for(current_property())
 
     found = False
     for item in session['cart']:
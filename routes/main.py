@@ -1,13 +1,19 @@
 import datetime
-import os
-import uuid
-from flask import Blueprint, render_template, session, flash, request, redirect, url_for, jsonify, current_app
+from flask import Blueprint, render_template, session, flash, request, redirect, url_for, jsonify, current_app, abort
 from utils.db import mongo
+from utils.query_budget import query_budget
+from utils.promos import promo_cache
+from utils.uploads import store_upload, release_blob, blob_response, UploadRejected, DIGEST_RE, MIMETYPES
+from utils.write_behind import write_behind, audit
+from utils.campaigns import unsubscribe_email
+from utils.properties import current_property, scoped
+from utils.archive import with_archive, count_with_archive
 from functools import wraps
-from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
 
 main_bp = Blueprint('main', __name__)
 
+# Legacy uploads (before the blob store) are still served from here
 UPLOAD_FOLDER = 'static/uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
@@ -24,6 +30,14 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def paid_total(name, user_email):
+    """Sums total_cost of a guest's paid documents at this property, archived ones included, in one round trip."""
+    paid = scoped(user_email=user_email, payment_status='paid')
+    result = list(mongo.db[name].aggregate(with_archive(name, paid) + [
+        {'$group': {'_id': None, 'total': {'$sum': '$total_cost'}}}
+    ]))
+    return result[0]['total'] if result else 0
+
 # --- Static Routes ---
 @main_bp.route('/')
 def index():
@@ -36,24 +50,21 @@ def gallery():
 # --- Dashboard ---
 @main_bp.route('/dashboard')
 @login_required
+@query_budget(5)
 def dashboard():
     user_email = session['user_email']
     user = mongo.db.users.find_one({'email': user_email})
     loyalty_points = user.get('loyalty_points', 0)
 
-    active_bookings = mongo.db.bookings.count_documents({
+    active_bookings = mongo.db.bookings.count_documents(scoped({
         'user_email': user_email,
         'status': 'active'
-    })
-    food_orders_count = mongo.db.food_orders.count_documents({
+    }))
+    food_orders_count = count_with_archive('food_orders', scoped({
         'user_email': user_email
-    })
-    total_spent_bookings = sum(b.get('total_cost', 0) for b in mongo.db.bookings.find(
-        {'user_email': user_email, 'payment_status': 'paid'}
-    ))
-    total_spent_food = sum(f.get('total_cost', 0) for f in mongo.db.food_orders.find(
-        {'user_email': user_email, 'payment_status': 'paid'}
-    ))
+    }))
+    total_spent_bookings = paid_total('bookings', user_email)
+    total_spent_food = paid_total('food_orders', user_email)
     total_spent = total_spent_bookings + total_spent_food
 
     stats = {
@@ -72,41 +83,74 @@ def reviews():
             flash('You must be logged in to submit a review.', 'warning')
             return redirect(url_for('auth.login'))
 
-        image_filename = None
-        if 'review_image' in request.files:
-            file = request.files['review_image']
+        # Reject oversized bodies from Content-Length before anything is read
+        max_image = current_app.config['UPLOAD_MAX_BYTES']
+        request.max_content_length = max_image + 64 * 1024
+        try:
+            rating = int(request.form['rating'])
+            review_type = request.form['review_type']
+            comment = request.form['comment']
+        except RequestEntityTooLarge:
+            flash(f'That photo is too large (max {max_image // (1024 * 1024)} MB).', 'error')
+            return redirect(url_for('main.reviews'))
+        except (KeyError, ValueError):
+            flash('Please fill in a rating, a review type and a comment.', 'error')
+            return redirect(url_for('main.reviews'))
+        image_blob = None
+        try:
+            file = request.files.get('review_image')
             if file and file.filename != '' and allowed_file(file.filename):
-                
-                original_name = secure_filename(file.filename)
-                unique_name = f"{uuid.uuid4().hex}_{original_name}"
-                
-                save_folder = os.path.join(current_app.root_path, UPLOAD_FOLDER)
-                full_save_path = os.path.join(save_folder, unique_name)
-
-                os.makedirs(save_folder, exist_ok=True)
-                file.save(full_save_path)
-                image_filename = unique_name
-
-        mongo.db.reviews.insert_one({
-            'user_email': session['user_email'],
-            'username': session['username'],
-            'rating': int(request.form['rating']),
-            'review_type': request.form['review_type'],
-            'comment': request.form['comment'],
-            'image_file': image_filename,
-            'created_at': datetime.datetime.now(datetime.timezone.utc)
-        })
+                image_blob = store_upload(file)
+        except RequestEntityTooLarge:
+            flash(f'That photo is too large (max {max_image // (1024 * 1024)} MB).', 'error')
+            return redirect(url_for('main.reviews'))
+        except UploadRejected as e:
+            flash(str(e), 'error')
+            return redirect(url_for('main.reviews'))
+
+        # Append-only: written by the write-behind flusher, not on the request path
+        try:
+            write_behind.add('reviews', {
+                'property': current_property().code,
+                'user_email': session['user_email'],
+                'username': session['username'],
+                'rating': rating,
+                'review_type': review_type,
+                'comment': comment,
+                'image_file': None,
+                'image_blob': image_blob,
+                'created_at': datetime.datetime.now(datetime.timezone.utc)
+            })
+        except Exception:
+            # No review will point at the photo: give back the reference store_upload took
+            if image_blob:
+                release_blob(image_blob)
+            raise
         flash('Thank you for your review!', 'success')
         return redirect(url_for('main.reviews'))
     
-    all_reviews = list(mongo.db.reviews.find().sort('created_at', -1))
+    # Reviews still in the write-behind buffer are the newest; show them so a guest sees their own
+    code = current_property().code
+    pending = [r for r in write_behind.pending('reviews') if r.get('property') == code]
+    stored = list(mongo.db.reviews.find(scoped()).sort('created_at', -1))
+    # A flush between the two reads puts a review in both lists
+    stored_ids = {r['_id'] for r in stored}
+    all_reviews = [r for r in pending[::-1] if r['_id'] not in stored_ids] + stored
     return render_template('reviews.html', reviews=all_reviews)
 
+@main_bp.route('/media/<digest>.<ext>')
+def review_image(digest, ext):
+    """Content-addressed review photo; immutable, so browsers and CDNs keep it for a year."""
+    if not DIGEST_RE.match(digest) or ext not in MIMETYPES:
+        abort(404)
+    return blob_response(request, digest, ext)
+
 # --- Contact Form ---
 @main_bp.route('/contact', methods=['GET', 'POST'])
 def contact():
     if request.method == 'POST':
-        mongo.db.contacts.insert_one({
+        write_behind.add('contacts', {
+            'property': current_property().code,
             'name': request.form['name'],
             'email': request.form['email'],
             'subject': request.form['subject'],
@@ -117,6 +161,18 @@ def contact():
         return redirect(url_for('main.contact'))
     return render_template('contact.html')
 
+# --- Campaign unsubscribe (link in every campaign email) ---
+@main_bp.route('/unsubscribe/<token>')
+def unsubscribe(token):
+    email = unsubscribe_email(token)
+    if email is None:
+        flash('That unsubscribe link is not valid.', 'error')
+        return redirect(url_for('main.index'))
+    mongo.db.users.update_one({'email': email}, {'$set': {'marketing_opt_out': True}})
+    audit('unsubscribe', actor=email)
+    flash('You have been unsubscribed from our offers emails.', 'success')
+    return redirect(url_for('main.index'))
+
 # --- Admin Maker ---
 @main_bp.route('/make-me-admin-12345')
 @login_required
@@ -228,7 +284,11 @@ def chatbot():
 
     # --- 7. OFFERS & FUN ---
     elif 'offer' in user_msg or 'discount' in user_msg or 'promo' in user_msg:
-        bot_reply = "Yes! You can use code **'SAKKATH'** for 10% off or **'BOMBAAT'** for 20% off on the billing page."
+        offers = ' or '.join(f"**'{code}'** for {percent:g}% off" for code, percent in promo_cache.active_codes()[:2])
+        if offers:
+            bot_reply = f"Yes! You can use code {offers} on the billing page."
+        else:
+            bot_reply = "There are no promo codes running right now, but keep an eye on your email for offers!"
 
     elif 'thank' in user_msg or 'dhanyavadagalu' in user_msg:
         bot_reply = "You're welcome! (ನಿಮಗೆ ಸ್ವಾಗತ - Nimage Swagata). Is there anything else I can help you with?"
@@ -1,37 +1,43 @@
 import datetime
 import uuid
 import io
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
+import time
 from flask import send_file, Blueprint, render_template, request, redirect, url_for, session, flash
 from utils.db import mongo
 from routes.main import login_required
+from utils.metrics import PDF_RENDER_LATENCY
+from utils.query_budget import query_budget
+from utils.archive import find_one_with_archive, find_by_ids_with_archive
+from utils.kitchen_feed import kitchen_feed
+from utils.promos import redeem_promo, release_promo, PromoError
+from utils.write_behind import audit
+from utils.properties import current_property, scoped
 
 payment_bp = Blueprint('payment', __name__)
 
-# Re-define Promo Codes here (or import from config/booking)
-PROMO_CODES = {
-    'SAKKATH': 10, 
-    'BOMBAAT': 20,
-    'WELCOME': 5
-}
 
 @payment_bp.route('/process', methods=['POST'])
 @login_required
+# 6 round trips, plus up to 4 to redeem a promo code: the cache's version check
+# and reload, the per-guest claim and the code's claim. The failure paths (undo
+# the per-guest claim and re-read the code, or release both claims when the
+# payment insert fails) stop short of the later writes, so 10 is the worst case.
+@query_budget(10)
 def process_payment():
     user_email = session['user_email']
     payment_method = request.form['payment_method']
     promo_code = request.form.get('promo_code', '').upper() # Get code from hidden input
+    prop = current_property()
     
-    unpaid_bookings = list(mongo.db.bookings.find({
+    unpaid_bookings = list(mongo.db.bookings.find(prop.scoped({
         'user_email': user_email,
         'payment_status': 'unpaid',
         'status': 'active'
-    }))
-    unpaid_food_orders = list(mongo.db.food_orders.find({
+    })))
+    unpaid_food_orders = list(mongo.db.food_orders.find(prop.scoped({
         'user_email': user_email,
         'payment_status': 'unpaid'
-    }))
+    })))
 
     if not unpaid_bookings and not unpaid_food_orders:
         flash('No pending payments found.', 'info')
@@ -42,12 +48,16 @@ def process_payment():
     total_food_cost = sum(f['total_cost'] for f in unpaid_food_orders)
     original_total = total_booking_cost + total_food_cost
     
-    # 2. Apply Discount (Server-Side Verification)
+    # 2. Apply Discount (Server-Side Verification): claims one use of the code atomically
     discount_amount = 0
-    if promo_code and promo_code in PROMO_CODES:
-        percent = PROMO_CODES[promo_code]
-        discount_amount = (original_total * percent) / 100
-        
+    if promo_code:
+        try:
+            promo = redeem_promo(promo_code, user_email)
+        except PromoError as e:
+            flash(f'{e} Your payment was not taken.', 'error')
+            return redirect(url_for('booking.billing'))
+        discount_amount = (original_total * promo['percent']) / 100
+
     final_amount = original_total - discount_amount
 
     payment_id = uuid.uuid4().hex
@@ -57,6 +67,7 @@ def process_payment():
     food_order_ids_paid = [f['order_id'] for f in unpaid_food_orders]
 
     payment_doc = {
+        'property': prop.code,
         'user_email': user_email,
         'payment_id': payment_id,
         'order_id': internal_order_id, 
@@ -70,7 +81,12 @@ def process_payment():
         'status': 'success',
         'created_at': datetime.datetime.now(datetime.timezone.utc)
     }
-    mongo.db.payments.insert_one(payment_doc)
+    try:
+        mongo.db.payments.insert_one(payment_doc)
+    except Exception:
+        if promo_code:
+            release_promo(promo_code, user_email)
+        raise
 
     if booking_ids_paid:
         mongo.db.bookings.update_many(
@@ -83,6 +99,10 @@ def process_payment():
             {'order_id': {'$in': food_order_ids_paid}},
             {'$set': {'payment_status': 'paid'}}
         )
+        kitchen_feed.orders_updated(food_order_ids_paid, {'payment_status': 'paid'}, prop.code)
+
+    audit('payment', order_id=internal_order_id, amount=final_amount, promo_code=promo_code,
+          booking_ids=booking_ids_paid, food_order_ids=food_order_ids_paid)
 
     # Loyalty Points (Based on Final Amount)
     points_earned = int(final_amount / 100)
@@ -96,11 +116,12 @@ def process_payment():
 
 @payment_bp.route('/confirmation/<order_id>')
 @login_required
+@query_budget(2)
 def confirmation(order_id):
-    payment_details = mongo.db.payments.find_one({
+    payment_details, _ = find_one_with_archive('payments', scoped({
         'order_id': order_id,
         'user_email': session['user_email']
-    })
+    }))
     
     if not payment_details:
         flash('Payment confirmation not found.', 'error')
@@ -110,25 +131,43 @@ def confirmation(order_id):
 
 @payment_bp.route('/download_invoice/<order_id>')
 @login_required
+# 3 round trips for recent invoices; old ones fall through to the archives
+@query_budget(6)
 def download_invoice(order_id):
     """Generates PDF with Discount Details."""
-    payment = mongo.db.payments.find_one({
+    prop = current_property()
+    payment, archived = find_one_with_archive('payments', prop.scoped({
         'order_id': order_id,
         'user_email': session['user_email']
-    })
+    }))
     
     if not payment:
         flash('Invoice not found.', 'error')
         return redirect(url_for('main.dashboard'))
 
+    # Fetch line items up front so the render timing below is ReportLab only
+    bookings = []
+    if 'booking_ids' in payment:
+        bookings = find_by_ids_with_archive('bookings', 'booking_id', payment['booking_ids'],
+                                            archive_first=archived)
+    orders = []
+    if 'food_order_ids' in payment:
+        orders = find_by_ids_with_archive('food_orders', 'order_id', payment['food_order_ids'],
+                                          archive_first=archived)
+
+    # ReportLab is imported here, on first invoice, rather than at worker boot
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    render_started = time.perf_counter()
     buffer = io.BytesIO()
     c = canvas.Canvas(buffer, pagesize=letter)
     width, height = letter
 
     c.setFont("Helvetica-Bold", 24)
-    c.drawString(50, height - 50, "Hotel Bombaat")
+    c.drawString(50, height - 50, prop.name)
     c.setFont("Helvetica", 12)
-    c.drawString(50, height - 70, "Bengaluru, Karnataka, India")
+    c.drawString(50, height - 70, prop.doc.get('address', ''))
     c.line(50, height - 100, width - 50, height - 100)
     
     c.setFont("Helvetica-Bold", 16)
@@ -146,21 +185,17 @@ def download_invoice(order_id):
     
     c.setFont("Helvetica", 12)
     # (Item listing code same as before...)
-    if 'booking_ids' in payment:
-        bookings = mongo.db.bookings.find({'booking_id': {'$in': payment['booking_ids']}})
-        for b in bookings:
-            desc = f"Room Booking: {b['room_type']}"
-            c.drawString(50, y, desc)
-            c.drawString(400, y, f"{b['total_cost']:.2f}")
-            y -= 20
+    for b in bookings:
+        desc = f"Room Booking: {b['room_type']}"
+        c.drawString(50, y, desc)
+        c.drawString(400, y, f"{b['total_cost']:.2f}")
+        y -= 20
 
-    if 'food_order_ids' in payment:
-        orders = mongo.db.food_orders.find({'order_id': {'$in': payment['food_order_ids']}})
-        for f in orders:
-            desc = f"Food Order #{f['order_id'][:8]}"
-            c.drawString(50, y, desc)
-            c.drawString(400, y, f"{f['total_cost']:.2f}")
-            y -= 20
+    for f in orders:
+        desc = f"Food Order #{f['order_id'][:8]}"
+        c.drawString(50, y, desc)
+        c.drawString(400, y, f"{f['total_cost']:.2f}")
+        y -= 20
             
     c.line(50, y - 10, width - 50, y - 10)
     y -= 30
@@ -183,5 +218,6 @@ def download_invoice(order_id):
     
     c.showPage()
     c.save()
+    PDF_RENDER_LATENCY.observe(time.perf_counter() - render_started)
     buffer.seek(0)
     return send_file(buffer, as_attachment=True, download_name=f"Invoice_{order_id}.pdf", mimetype='application/pdf')
\ No newline at end of file
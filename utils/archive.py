@@ -0,0 +1,180 @@
+import datetime
+
+import click
+from flask.cli import with_appcontext
+from pymongo import DeleteOne
+from pymongo.errors import BulkWriteError
+
+from utils.db import mongo
+from utils.pagination import after_cursor, encode_cursor
+
+# --- Hot/cold archival ---
+# Finished records older than the horizon move from bookings / food_orders /
+# payments into <name>_archive, so the hot collections (and their indexes)
+# only hold what day-to-day pages touch. Each batch copies documents with
+# their original _id and then deletes them from the hot collection; a batch
+# interrupted between the two steps is simply redone on the next run (the
+# duplicate inserts are ignored), so the job is safe to stop and restart.
+# The delete only removes a document if it is still exactly the copy that was
+# archived; one updated in between (paid, cancelled) stays hot, its stale copy
+# is dropped from the archive, and a later run moves it if it still qualifies.
+#
+# Read paths that need history use the *_with_archive helpers below: single
+# lookups (invoices, payment confirmation, API detail) query the hot
+# collection first and only touch the archive on a miss; lists (My Bookings,
+# the API lists, admin search) merge both; totals and charts aggregate over
+# both with $unionWith in one round trip.
+
+ARCHIVE_SUFFIX = '_archive'
+DUPLICATE_KEY = 11000
+
+
+def archive_name(name):
+    return name + ARCHIVE_SUFFIX
+
+
+def archive_policies(horizon_days, today=None):
+    """collection -> filter selecting documents that are finished and past the horizon."""
+    today = today or datetime.date.today()
+    horizon_day = today.toordinal() - horizon_days
+    horizon = datetime.datetime.combine(today - datetime.timedelta(days=horizon_days),
+                                        datetime.time.min, tzinfo=datetime.timezone.utc)
+    return {
+        # Checked out and settled, or cancelled, before the horizon
+        'bookings': {'$or': [
+            {'check_out_day': {'$lt': horizon_day}, 'payment_status': 'paid'},
+            {'status': 'cancelled', 'created_at': {'$lt': horizon}}
+        ]},
+        'food_orders': {'payment_status': 'paid', 'created_at': {'$lt': horizon}},
+        'payments': {'status': 'success', 'created_at': {'$lt': horizon}},
+    }
+
+
+def archive_collection(db, name, query, batch_size=1000, echo=None):
+    """Moves documents matching `query` from `name` to its archive, batch by batch."""
+    hot, cold = db[name], db[archive_name(name)]
+    moved, last_id = 0, None
+    now = datetime.datetime.now(datetime.timezone.utc)
+    while True:
+        batch_query = dict(query, _id={'$gt': last_id}) if last_id is not None else query
+        docs = list(hot.find(batch_query).sort('_id', 1).limit(batch_size))
+        if not docs:
+            break
+        # Delete filters match every field as read, so a concurrent update wins
+        deletes = [DeleteOne(dict(doc)) for doc in docs]
+        for doc in docs:
+            doc['archived_at'] = now
+        try:
+            cold.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # Already copied by an earlier, interrupted run
+            if any(err['code'] != DUPLICATE_KEY for err in e.details['writeErrors']):
+                raise
+        ids = [d['_id'] for d in docs]
+        deleted = hot.bulk_write(deletes, ordered=False).deleted_count
+        if deleted < len(ids):
+            # Changed since the copy: keep the hot version, drop the stale archived one
+            changed = [d['_id'] for d in hot.find({'_id': {'$in': ids}}, {'_id': 1})]
+            cold.delete_many({'_id': {'$in': changed}})
+        moved += deleted
+        last_id = ids[-1]
+        if echo:
+            echo(f'... {name}: {moved:,} archived')
+    return moved
+
+
+# --- Fall-through reads ---
+def find_one_with_archive(name, query, projection=None):
+    """find_one on the hot collection, then on the archive. Returns (doc, archived)."""
+    doc = mongo.db[name].find_one(query, projection)
+    if doc is not None:
+        return doc, False
+    doc = mongo.db[archive_name(name)].find_one(query, projection)
+    return doc, doc is not None
+
+
+def find_by_ids_with_archive(name, field, ids, projection=None, archive_first=False):
+    """
+    Documents whose `field` is in `ids`, from the hot collection and/or the
+    archive. The second collection is only queried for ids the first lacked;
+    `archive_first` starts with the archive (e.g. items of an archived payment).
+    """
+    collections = [mongo.db[name], mongo.db[archive_name(name)]]
+    if archive_first:
+        collections.reverse()
+    found, missing = [], list(ids)
+    for collection in collections:
+        if not missing:
+            break
+        docs = list(collection.find({field: {'$in': missing}}, projection))
+        found.extend(docs)
+        seen = {d[field] for d in docs}
+        missing = [i for i in missing if i not in seen]
+    return found
+
+
+def find_with_archive(name, query, projection=None, sort=None, limit=0, db=None):
+    """Hot and archived documents matching `query`, merged (hot first unless sorted)."""
+    db = db if db is not None else mongo.db
+    results = []
+    for collection in (db[name], db[archive_name(name)]):
+        cursor = collection.find(query, projection)
+        if sort:
+            cursor = cursor.sort(sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        results.extend(cursor)
+    if sort:
+        for field, direction in reversed(sort):
+            results.sort(key=lambda d: (d.get(field) is not None, d.get(field)), reverse=direction < 0)
+    return results[:limit] if limit else results
+
+
+def paginate_with_archive(name, query, sort, projection=None, limit=20, cursor=None, db=None):
+    """
+    utils.pagination.paginate over the hot collection and its archive together:
+    one keyset page from each, merged. Two round trips; same (docs, next_cursor).
+    """
+    db = db if db is not None else mongo.db
+    query = after_cursor(query, sort, cursor)
+    docs = []
+    for collection in (db[name], db[archive_name(name)]):
+        docs.extend(collection.find(query, projection).sort(sort).limit(limit + 1))
+    for field, direction in reversed(sort):
+        docs.sort(key=lambda d: d[field], reverse=direction < 0)
+    if len(docs) > limit:
+        docs = docs[:limit]
+        return docs, encode_cursor(docs[-1], sort)
+    return docs, None
+
+
+def with_archive(name, match):
+    """Pipeline head: `match` over the hot collection plus its archive ($unionWith, MongoDB 4.4+)."""
+    return [{'$match': match},
+            {'$unionWith': {'coll': archive_name(name), 'pipeline': [{'$match': match}]}}]
+
+
+def count_with_archive(name, query, db=None):
+    """count_documents over the hot collection and its archive, in one round trip."""
+    db = db if db is not None else mongo.db
+    result = list(db[name].aggregate(with_archive(name, query) + [{'$count': 'n'}]))
+    return result[0]['n'] if result else 0
+
+
+@click.command('archive')
+@click.option('--horizon-days', default=None, type=int,
+              help='Archive records finished more than this many days ago (default ARCHIVE_HORIZON_DAYS).')
+@click.option('--batch-size', default=1000, show_default=True)
+@click.option('--collection', 'only', type=click.Choice(['bookings', 'food_orders', 'payments']),
+              help='Archive a single collection.')
+@with_appcontext
+def archive_command(horizon_days, batch_size, only):
+    """Move finished bookings, food orders and payments into archive collections."""
+    from flask import current_app
+    if horizon_days is None:
+        horizon_days = current_app.config.get('ARCHIVE_HORIZON_DAYS', 365)
+    for name, query in archive_policies(horizon_days).items():
+        if only and name != only:
+            continue
+        moved = archive_collection(mongo.db, name, query, batch_size, echo=click.echo)
+        click.echo(f'{name}: {moved:,} archived')
@@ -0,0 +1,258 @@
+import datetime
+import statistics
+import threading
+import time
+import uuid
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from pymongo.read_preferences import ReadPreference
+
+from utils.db import mongo, analytics_db
+from utils.indexes import ensure_indexes
+from utils.occupancy import OccupancyModel
+from utils.properties import DEFAULT_ROOM_TYPES, scope_to, scoped
+from utils.stays import overlap_query
+
+# --- Benchmarks against the configured database ---
+# Run through the Flask test client, so routing, sessions, templates and Mongo
+# round trips are all included. Outgoing mail is suppressed; documents created
+# by a run are removed afterwards.
+
+
+def _bench_client(app, email):
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s['user_email'] = email
+        s['username'] = 'Benchmark'
+    return client
+
+
+@click.group('bench')
+def bench_cli():
+    """Benchmarks that run against the configured MongoDB."""
+
+
+@bench_cli.command('group-booking')
+@click.option('--rooms', default=40, show_default=True, help='Rooms in the group.')
+@click.option('--room-type', default='Standard Double', show_default=True)
+@with_appcontext
+def bench_group_booking(rooms, room_type):
+    """Group booking endpoint vs the same rooms booked one by one."""
+    app = current_app._get_current_object()
+    app.extensions['mail'].suppress = True
+    email = f'bench-{uuid.uuid4().hex[:8]}@example.com'
+    client = _bench_client(app, email)
+    check_in = datetime.date.today() + datetime.timedelta(days=30)
+    check_out = check_in + datetime.timedelta(days=2)
+
+    try:
+        # One-by-one: POST /booking/rooms, then follow the redirect to billing
+        started = time.perf_counter()
+        for _ in range(rooms):
+            client.post('/booking/rooms', data={
+                'room_type': room_type, 'check_in': check_in.isoformat(),
+                'check_out': check_out.isoformat(), 'guests': 2
+            }, follow_redirects=True)
+        singles = time.perf_counter() - started
+
+        started = time.perf_counter()
+        response = client.post('/booking/group', json={'group_name': 'Benchmark', 'rooms': [{
+            'room_type': room_type, 'check_in': check_in.isoformat(),
+            'check_out': check_out.isoformat(), 'guests': 2, 'count': rooms
+        }]})
+        group = time.perf_counter() - started
+        if response.status_code != 201:
+            raise click.ClickException(f'Group booking failed: {response.get_json()}')
+    finally:
+        mongo.db.bookings.delete_many({'user_email': email})
+
+    click.echo(f'{rooms} single bookings: {singles * 1000:8.1f} ms  ({rooms / singles:7.1f} rooms/s)')
+    click.echo(f'1 group booking:     {group * 1000:8.1f} ms  ({rooms / group:7.1f} rooms/s)')
+    click.echo(f'Speed-up: {singles / group:.1f}x (mail suppressed in both runs)')
+
+
+def _checkout_reads(db, user_email):
+    """The primary reads/writes process_payment makes, without changing any data."""
+    db.bookings.find_one(scoped(user_email=user_email, payment_status='unpaid', status='active'))
+    db.food_orders.find_one(scoped(user_email=user_email, payment_status='unpaid'))
+    db.users.update_one({'email': user_email}, {'$inc': {'loyalty_points': 0}})
+
+
+def _report_queries(db):
+    """The admin dashboard / manage_bookings reads."""
+    for collection in (db.bookings, db.food_orders):
+        list(collection.aggregate([
+            {'$match': scoped(payment_status='paid')},
+            {'$group': {'_id': None, 'total': {'$sum': '$total_cost'}}}
+        ]))
+    list(db.bookings.find(scoped()).sort('created_at', -1).limit(500))
+
+
+def _run_phase(seconds, report_db, report_threads, user_emails):
+    stop = threading.Event()
+
+    def report_load():
+        while not stop.is_set():
+            _report_queries(report_db)
+
+    workers = [threading.Thread(target=report_load, daemon=True) for _ in range(report_threads)]
+    for w in workers:
+        w.start()
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    i = 0
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        _checkout_reads(mongo.db, user_emails[i % len(user_emails)])
+        latencies.append((time.perf_counter() - started) * 1000)
+        i += 1
+    stop.set()
+    for w in workers:
+        w.join()
+    latencies.sort()
+    return {
+        'n': len(latencies),
+        'p50': statistics.median(latencies),
+        'p95': latencies[int(len(latencies) * 0.95) - 1],
+        'p99': latencies[int(len(latencies) * 0.99) - 1],
+    }
+
+
+@bench_cli.command('read-routing')
+@click.option('--seconds', default=15, show_default=True, help='Duration of each phase.')
+@click.option('--report-threads', default=4, show_default=True, help='Concurrent admin report loops.')
+@with_appcontext
+def bench_read_routing(seconds, report_threads):
+    """Checkout latency with admin report load on the primary vs routed to secondaries."""
+    user_emails = [u['email'] for u in mongo.db.users.find({}, {'email': 1}).limit(1000)]
+    if not user_emails:
+        raise click.ClickException('No users found; load some with `flask seed-data` first.')
+
+    phases = [
+        ('no report load', None, 0),
+        ('reports on primary', mongo.db.with_options(read_preference=ReadPreference.PRIMARY), report_threads),
+        ('reports on secondaries', analytics_db(), report_threads),
+    ]
+    for label, report_db, threads in phases:
+        result = _run_phase(seconds, report_db, threads, user_emails)
+        click.echo(f"{label:24} n={result['n']:6}  p50={result['p50']:7.2f} ms  "
+                   f"p95={result['p95']:7.2f} ms  p99={result['p99']:7.2f} ms")
+
+
+# --- Multi-property scaling ---
+# Runs in a scratch database (<db>_bench), dropped before and after the run.
+# The same bookings are loaded for one property, then copied to N-1 more; the
+# route-shaped queries for the first property should cost the same either way
+# because every index they use starts with `property`.
+BENCH_PROPERTY_PREFIX = 'bench-'
+BENCH_DB_SUFFIX = '_bench'
+
+
+def _synthetic_bookings(code, count, today):
+    room_names = list(DEFAULT_ROOM_TYPES)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    docs = []
+    for i in range(count):
+        check_in = today - 180 + (i * 7919) % 540
+        nights = 1 + i % 4
+        docs.append({
+            'property': code,
+            'user_email': f'guest{i % max(count // 5, 1)}@bench.example.com',
+            'booking_id': uuid.uuid4().hex,
+            'room_type': room_names[i % len(room_names)],
+            'check_in_day': check_in,
+            'check_out_day': check_in + nights,
+            'check_in': datetime.date.fromordinal(check_in).isoformat(),
+            'check_out': datetime.date.fromordinal(check_in + nights).isoformat(),
+            'guests': 2,
+            'total_cost': 4000.0 * nights,
+            'status': 'cancelled' if i % 12 == 0 else 'active',
+            'payment_status': 'paid' if i % 3 else 'unpaid',
+            'created_at': now - datetime.timedelta(days=(i * 31) % 400, seconds=i),
+        })
+    return docs
+
+
+def _property_queries(code, today):
+    """(label, filter, sort, limit) for the reads My Bookings, billing, booking and occupancy make."""
+    guest = 'guest0@bench.example.com'
+    return [
+        ('my bookings page', scope_to(code, user_email=guest),
+         [('created_at', -1), ('_id', -1)], 20),
+        ('billing', scope_to(code, user_email=guest, payment_status='unpaid', status='active'),
+         None, 0),
+        ('overlap check', overlap_query('Standard Double', today + 30, today + 32, property_code=code),
+         None, 0),
+        ('occupancy $match', scope_to(code, status='active', check_in_day={'$lt': today + 365},
+                                      check_out_day={'$gt': today - 365}),
+         None, 0),
+    ]
+
+
+def _measure_properties(db, code, today, repeats):
+    rows = []
+    for label, query, sort, limit in _property_queries(code, today):
+        def run():
+            cursor = db.bookings.find(query)
+            if sort:
+                cursor = cursor.sort(sort)
+            return cursor.limit(limit)
+
+        latencies = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            list(run())
+            latencies.append((time.perf_counter() - started) * 1000)
+        stats = run().explain().get('executionStats', {})
+        rows.append((label, statistics.median(latencies), stats.get('nReturned', 0),
+                     stats.get('totalKeysExamined', 0), stats.get('totalDocsExamined', 0)))
+
+    # The full occupancy refresh (both aggregates + NumPy), from a cold model
+    latencies = []
+    for _ in range(max(repeats // 10, 1)):
+        started = time.perf_counter()
+        OccupancyModel(DEFAULT_ROOM_TYPES, code, db=db).refresh()
+        latencies.append((time.perf_counter() - started) * 1000)
+    rows.append(('occupancy refresh', statistics.median(latencies), None, None, None))
+    return rows
+
+
+@bench_cli.command('properties')
+@click.option('--properties', 'n_properties', default=10, show_default=True, help='Properties in the second phase.')
+@click.option('--bookings', default=50000, show_default=True, help='Bookings per property.')
+@click.option('--repeats', default=50, show_default=True, help='Timed runs per query.')
+@with_appcontext
+def bench_properties(n_properties, bookings, repeats):
+    """Per-property query cost with one property loaded vs many (in a scratch database)."""
+    # Never the live database: chain-wide readers (exports, reconcile) would see
+    # the synthetic bookings, and a killed run would leave them behind
+    scratch = f'{mongo.db.name}{BENCH_DB_SUFFIX}'
+    mongo.cx.drop_database(scratch)
+    db = mongo.cx[scratch]
+    ensure_indexes(db)
+    today = datetime.date.today().toordinal()
+    codes = [f'{BENCH_PROPERTY_PREFIX}{i}' for i in range(n_properties)]
+    docs = _synthetic_bookings(codes[0], bookings, today)
+    try:
+        db.bookings.insert_many(docs, ordered=False)
+        phases = [('1 property', _measure_properties(db, codes[0], today, repeats))]
+        for code in codes[1:]:
+            for i in range(0, len(docs), 5000):
+                # insert_many set _id on the originals; the copies get fresh ones
+                db.bookings.insert_many(
+                    [{**{k: v for k, v in d.items() if k != '_id'}, 'property': code}
+                     for d in docs[i:i + 5000]], ordered=False)
+        phases.append((f'{n_properties} properties', _measure_properties(db, codes[0], today, repeats)))
+    finally:
+        mongo.cx.drop_database(scratch)
+
+    for phase, rows in phases:
+        click.echo(f'-- {phase} ({bookings:,} bookings each), timings for {codes[0]}')
+        for label, p50, returned, keys, examined in rows:
+            line = f'{label:18} p50={p50:8.2f} ms'
+            if returned is not None:
+                line += f'  returned={returned:6}  keys={keys:7}  docs={examined:7}'
+            click.echo(line)
@@ -0,0 +1,44 @@
+import threading
+import time
+from collections import OrderedDict
+
+# --- Small in-process caches ---
+# Each gunicorn worker keeps its own copy, so entries also carry a TTL to bound
+# how stale a worker can be after another worker invalidates its own copy.
+
+
+class TTLCache:
+    """A bounded LRU dict whose entries expire after `ttl` seconds."""
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """Drops one key, or everything when no key is given."""
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
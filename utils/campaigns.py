@@ -0,0 +1,404 @@
+import datetime
+import queue
+import smtplib
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+import click
+from bson import ObjectId
+from flask import current_app
+from flask.cli import with_appcontext
+from flask_mail import BadHeaderError, Message
+from itsdangerous import BadSignature, URLSafeSerializer
+
+from utils.db import mongo, mail, analytics_db
+from utils.metrics import CAMPAIGN_EMAILS, SMTP_SEND_LATENCY
+from utils.promos import promo_cache, PromoError
+
+# --- Email campaigns ---
+# An admin queues a campaign (subject + optional promo code) on
+# /admin/campaigns; `flask campaigns run` sends it. Nothing is sent from a
+# request thread.
+#
+# Recipients are read in _id order, one projected page of
+# CAMPAIGN_CHECKPOINT_EVERY users at a time (keyset pagination, so no cursor
+# has to survive a multi-hour send). Each message is rendered from a Jinja
+# email template and put on a small bounded queue. CAMPAIGN_CONNECTIONS
+# sender threads drain it, each over one persistent SMTP connection. A shared
+# token bucket holds them to CAMPAIGN_RATE_PER_SEC. Memory is one page plus
+# the queue, whatever the audience size.
+#
+# After each page has been fully handed to SMTP, the last _id and the counters
+# are written to the campaign (the checkpoint), together with a heartbeat. A
+# crashed run is resumed from its checkpoint by the next `run` once the
+# heartbeat is CAMPAIGN_STALE_SECONDS old. At most one page can then be sent
+# twice. Pausing from the admin page stops the run at the next checkpoint.
+#
+# Only a refused recipient or message counts against that one guest. If the
+# server can't be reached, rejects the login or the sender, or
+# MAX_CONSECUTIVE_FAILURES sends in a row fail, the run stops instead. The
+# campaign is then marked `failed` at its last checkpoint and can be resumed
+# from the admin page.
+
+CAMPAIGN_TEMPLATE = 'email_campaign.html'
+CAMPAIGN_SENDER = ('Hotel Bombaat', 'your-email@gmail.com')
+STATUSES = ['queued', 'running', 'paused', 'done', 'failed']
+ERRORS_KEPT = 20
+
+# Guests who opted out (unsubscribe link) or have no address are skipped
+RECIPIENTS = {'email': {'$exists': True, '$ne': ''}, 'marketing_opt_out': {'$ne': True}}
+
+# A dropped connection is worth reconnecting and retrying once
+TRANSIENT_SMTP_ERRORS = (smtplib.SMTPServerDisconnected, OSError)
+# The server turned down this message or recipient; the connection is still good
+RECIPIENT_SMTP_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError, BadHeaderError)
+# Transient failures in a row (across all connections) before the run is abandoned
+MAX_CONSECUTIVE_FAILURES = 5
+
+
+class CampaignAborted(Exception):
+    """SMTP is unusable (down, bad credentials, sender refused); stop at the last checkpoint."""
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt='campaign-unsubscribe')
+
+
+def unsubscribe_token(email):
+    return _serializer().dumps(email)
+
+
+def unsubscribe_email(token):
+    """Email address from an unsubscribe token, or None if it was tampered with."""
+    try:
+        return _serializer().loads(token)
+    except BadSignature:
+        return None
+
+
+def recipient_pages(db, after=None, page_size=100):
+    """Pages of {_id, email, username} recipients after the `after` _id."""
+    while True:
+        query = dict(RECIPIENTS)
+        if after is not None:
+            query['_id'] = {'$gt': after}
+        page = list(db.users.find(query, {'email': 1, 'username': 1}).sort('_id', 1).limit(page_size))
+        if not page:
+            return
+        yield page
+        after = page[-1]['_id']
+
+
+def create_campaign(subject, promo_code=None, created_by=None):
+    """Queues a campaign to every opted-in guest. Raises PromoError for an unusable code."""
+    if promo_code:
+        promo_code = promo_code.strip().upper()
+        promo_cache.validate(promo_code)
+    doc = {
+        'subject': subject,
+        'template': CAMPAIGN_TEMPLATE,
+        'promo_code': promo_code or None,
+        'status': 'queued',
+        'audience': analytics_db().users.count_documents(RECIPIENTS),
+        'sent': 0,
+        'failed': 0,
+        'errors': [],
+        'checkpoint': None,
+        'created_by': created_by,
+        'created_at': _now(),
+    }
+    return mongo.db.campaigns.insert_one(doc).inserted_id
+
+
+def set_campaign_status(campaign_id, status, from_statuses):
+    result = mongo.db.campaigns.update_one({'_id': ObjectId(campaign_id), 'status': {'$in': from_statuses}},
+                                           {'$set': {'status': status}})
+    return result.modified_count == 1
+
+
+def claim_campaign(campaign_id=None, stale_seconds=300):
+    """
+    Atomically takes a queued campaign (or a running one whose runner stopped
+    sending heartbeats) and returns it, or None.
+    """
+    now = _now()
+    query = {'$or': [{'status': 'queued'},
+                     {'status': 'running', 'heartbeat': {'$lt': now - datetime.timedelta(seconds=stale_seconds)}}]}
+    if campaign_id:
+        query['_id'] = ObjectId(campaign_id)
+    return mongo.db.campaigns.find_one_and_update(
+        query,
+        {'$set': {'status': 'running', 'runner': uuid.uuid4().hex, 'heartbeat': now},
+         '$min': {'started_at': now}},
+        sort=[('created_at', 1)],
+        return_document=True,
+    )
+
+
+class RateLimiter:
+    """Token bucket shared by the sender threads."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class CampaignSender:
+    """Sender threads, each holding one SMTP connection open for the whole run."""
+
+    def __init__(self, app, connections, rate):
+        self.app = app
+        self.limiter = RateLimiter(rate, burst=connections)
+        self.queue = queue.Queue(maxsize=connections * 4)
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.errors = []
+        self.fatal = None
+        self._consecutive_failures = 0
+        self.threads = [threading.Thread(target=self._run, name=f'campaign-smtp-{n}', daemon=True)
+                        for n in range(connections)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, message):
+        # Never block for good on a full queue: stop as soon as sending has been abandoned
+        while True:
+            if self.fatal is not None:
+                raise CampaignAborted(self.fatal)
+            try:
+                self.queue.put(message, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def drain(self, check=True):
+        """
+        Waits for every submitted message; returns (sent, failed, errors) since the
+        last drain. Raises CampaignAborted if sending was abandoned (unless not `check`).
+        """
+        self.queue.join()
+        if check and self.fatal is not None:
+            raise CampaignAborted(self.fatal)
+        with self._lock:
+            counts = (self.sent, self.failed, self.errors)
+            self.sent, self.failed, self.errors = 0, 0, []
+        return counts
+
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def _abort(self, error):
+        with self._lock:
+            if self.fatal is None:
+                detail = str(error) if isinstance(error, CampaignAborted) else f'{type(error).__name__}: {error}'
+                self.fatal = detail[:200]
+
+    def _record(self, message, error=None):
+        with self._lock:
+            if error is None:
+                self.sent += 1
+                self._consecutive_failures = 0
+            else:
+                self.failed += 1
+                self.errors.append({'to': message.recipients[0], 'error': str(error)[:200], 'at': _now()})
+        CAMPAIGN_EMAILS.inc('sent' if error is None else 'failed')
+
+    def _run(self):
+        with self.app.app_context():
+            connection = None
+            while True:
+                message = self.queue.get()
+                if message is None:
+                    self.queue.task_done()
+                    break
+                try:
+                    # After an abort the rest of the queue is discarded, not sent;
+                    # it is re-sent from the checkpoint when the campaign resumes
+                    if self.fatal is None:
+                        self.limiter.acquire()
+                        connection = self._send(connection, message)
+                except Exception as e:
+                    # A dead thread would leave submit()/drain() waiting forever
+                    self._abort(e)
+                finally:
+                    self.queue.task_done()
+            _close(connection)
+
+    def _connect(self):
+        try:
+            return mail.connect().__enter__()
+        except (smtplib.SMTPException, OSError) as e:
+            # Unreachable server, rejected HELO or login: every recipient would fail the same way
+            raise CampaignAborted(f'{type(e).__name__}: {e}') from e
+
+    def _send(self, connection, message):
+        """Sends over `connection` (reconnecting once if it dropped); returns the connection to keep."""
+        for attempt in (1, 2):
+            try:
+                if connection is None:
+                    connection = self._connect()
+                with SMTP_SEND_LATENCY.time():
+                    connection.send(message)
+                self._record(message)
+                return connection
+            except RECIPIENT_SMTP_ERRORS as e:
+                self._record(message, e)
+                return connection
+            except TRANSIENT_SMTP_ERRORS as e:
+                _close(connection)
+                connection = None
+                if attempt == 2:
+                    with self._lock:
+                        self._consecutive_failures += 1
+                        give_up = self._consecutive_failures >= MAX_CONSECUTIVE_FAILURES
+                    if give_up:
+                        raise CampaignAborted(f'{MAX_CONSECUTIVE_FAILURES} sends in a row failed: {e}') from e
+                    self._record(message, e)
+        return connection
+
+
+def _close(connection):
+    if connection is None:
+        return
+    try:
+        connection.__exit__(None, None, None)
+    except (smtplib.SMTPException, OSError):
+        pass
+
+
+def _url_adapter(app):
+    """Builds absolute links (unsubscribe) outside a request, from CAMPAIGN_BASE_URL."""
+    base = urlsplit(app.config.get('CAMPAIGN_BASE_URL') or 'http://localhost:5000')
+    return app.url_map.bind(base.netloc, script_name=base.path or '/', url_scheme=base.scheme)
+
+
+def run_campaign(campaign, connections=3, rate=10.0, page_size=100, echo=None):
+    """Sends `campaign` (already claimed) from its checkpoint. Returns its final status."""
+    app = current_app._get_current_object()
+    template = app.jinja_env.get_template(campaign['template'])
+    urls = _url_adapter(app)
+    promo = None
+    if campaign.get('promo_code'):
+        try:
+            promo = promo_cache.validate(campaign['promo_code'])
+        except PromoError:
+            promo = None  # Ended since the campaign was queued: send it without the offer
+
+    campaigns = mongo.db.campaigns
+    key = {'_id': campaign['_id'], 'runner': campaign['runner']}
+    status = 'done'
+    sender = CampaignSender(app, connections, rate)
+    try:
+        for page in recipient_pages(analytics_db(), campaign.get('checkpoint'), page_size):
+            for user in page:
+                message = Message(subject=campaign['subject'], sender=CAMPAIGN_SENDER, recipients=[user['email']])
+                message.html = template.render(
+                    username=user.get('username') or 'Guest',
+                    promo=promo,
+                    unsubscribe_url=urls.build('main.unsubscribe', {'token': unsubscribe_token(user['email'])},
+                                               force_external=True),
+                )
+                sender.submit(message)
+            sent, failed, errors = sender.drain()
+            # Checkpoint only once the whole page is through SMTP
+            update = {'$set': {'checkpoint': page[-1]['_id'], 'heartbeat': _now()},
+                      '$inc': {'sent': sent, 'failed': failed}}
+            if errors:
+                update['$push'] = {'errors': {'$each': errors, '$slice': -ERRORS_KEPT}}
+            current = campaigns.find_one_and_update(key, update, {'status': 1}, return_document=True)
+            if echo:
+                echo(f"{campaign['_id']}: +{sent} sent, +{failed} failed (checkpoint {page[-1]['_id']})")
+            if current is None:
+                # Another runner took the campaign over (we were considered dead)
+                return 'superseded'
+            if current['status'] != 'running':
+                status = current['status']
+                break
+    except Exception as e:
+        # Nothing past the last checkpoint is recorded; a resumed run starts from there
+        sender.drain(check=False)
+        campaigns.update_one(key, {'$set': {'status': 'failed', 'heartbeat': _now()},
+                                   '$push': {'errors': {'$each': [{'error': str(e)[:200], 'at': _now()}],
+                                                        '$slice': -ERRORS_KEPT}}})
+        if isinstance(e, CampaignAborted):
+            if echo:
+                echo(f"{campaign['_id']}: stopped, SMTP unusable ({e})")
+            return 'failed'
+        raise
+    finally:
+        sender.close()
+
+    if status == 'done':
+        campaigns.update_one(key, {'$set': {'status': 'done', 'finished_at': _now()}})
+    return status
+
+
+@click.group('campaigns')
+def campaigns_cli():
+    """Send and inspect email campaigns."""
+
+
+@campaigns_cli.command('list')
+@with_appcontext
+def list_command():
+    """Show campaigns with their progress."""
+    for campaign in mongo.db.campaigns.find().sort('created_at', -1):
+        click.echo(f"{campaign['_id']}  {campaign['status']:8} {campaign.get('sent', 0):>8,} sent "
+                   f"{campaign.get('failed', 0):>6,} failed / {campaign.get('audience', 0):,}  {campaign['subject']}")
+
+
+@campaigns_cli.command('run')
+@click.argument('campaign_id', required=False)
+@click.option('--connections', type=int, default=None, help='Persistent SMTP connections (CAMPAIGN_CONNECTIONS).')
+@click.option('--rate', type=float, default=None, help='Messages per second overall (CAMPAIGN_RATE_PER_SEC).')
+@click.option('--forever', is_flag=True, help='Keep polling for queued campaigns.')
+@click.option('--poll', default=30, show_default=True, help='Seconds between polls with --forever.')
+@with_appcontext
+def run_command(campaign_id, connections, rate, forever, poll):
+    """Send CAMPAIGN_ID, or every queued (or abandoned) campaign."""
+    config = current_app.config
+    connections = connections or config.get('CAMPAIGN_CONNECTIONS', 3)
+    rate = rate or config.get('CAMPAIGN_RATE_PER_SEC', 10.0)
+    page_size = config.get('CAMPAIGN_CHECKPOINT_EVERY', 100)
+    stale_seconds = config.get('CAMPAIGN_STALE_SECONDS', 300)
+    while True:
+        campaign = claim_campaign(campaign_id, stale_seconds)
+        if campaign is None:
+            if campaign_id:
+                raise click.ClickException(f'Campaign {campaign_id} is not queued (see `flask campaigns list`).')
+            if not forever:
+                click.echo('No queued campaigns.')
+                return
+            time.sleep(poll)
+            continue
+        click.echo(f"Sending {campaign['_id']} '{campaign['subject']}' from checkpoint "
+                   f"{campaign.get('checkpoint')} ({connections} connections, {rate:g}/s)")
+        status = run_campaign(campaign, connections, rate, page_size, echo=click.echo)
+        click.echo(f"{campaign['_id']}: {status}")
+        if campaign_id:
+            return
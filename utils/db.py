@@ -1,19 +1,62 @@
 from flask_pymongo import PyMongo
 from flask_mail import Mail
+from pymongo.read_preferences import ReadPreference, SecondaryPreferred
+from utils.metrics import command_listener, pool_listener, SMTP_SEND_LATENCY
+from utils.query_budget import query_recorder
+
+
+class TimedMail(Mail):
+    """flask_mail's Mail, with every send recorded in the SMTP histogram."""
+
+    def send(self, message):
+        with SMTP_SEND_LATENCY.time():
+            return super().send(message)
+
 
 # --- Create all extension instances ---
 mongo = PyMongo()
-mail = Mail()
+mail = TimedMail()
 # (The serializer is GONE from this file)
 # -------------------------------------
 
+# --- Read routing ---
+# Transactional work (checkout, booking, payment) uses mongo.db and always hits
+# the primary. Heavy reporting reads go through analytics_db(), which prefers
+# secondaries (optionally tagged analytics nodes) within a bounded staleness,
+# so admin reports don't compete with writes for the primary.
+_analytics = {}
+
+
+def analytics_db():
+    """mongo.db with the analytics read preference (ANALYTICS_READ_PREFERENCE)."""
+    db = _analytics.get('db')
+    if db is None:
+        db = _analytics['db'] = mongo.db.with_options(read_preference=_analytics['read_preference'])
+    return db
+
+
+def _analytics_read_preference(config):
+    mode = config.get('ANALYTICS_READ_PREFERENCE', 'secondaryPreferred')
+    if mode == 'primary':
+        return ReadPreference.PRIMARY
+    # e.g. 'nodeType:ANALYTICS' -> [{'nodeType': 'ANALYTICS'}, {}] (fall back to any secondary)
+    tag_sets = []
+    if config.get('ANALYTICS_READ_TAGS'):
+        tag_sets.append(dict(pair.split(':', 1) for pair in config['ANALYTICS_READ_TAGS'].split(',')))
+        tag_sets.append({})
+    return SecondaryPreferred(tag_sets=tag_sets or None,
+                              max_staleness=config.get('ANALYTICS_MAX_STALENESS', 120))
+
 def init_db(app):
     """
     Initializes all extensions with the Flask app.
     """
     
     # Initialize mongo and mail
-    mongo.init_app(app)
+    mongo.init_app(app, event_listeners=[command_listener, query_recorder, pool_listener])
     mail.init_app(app)
+
+    _analytics.clear()
+    _analytics['read_preference'] = _analytics_read_preference(app.config)
     
-    return mongo
\ No newline at end of file
+    return mongo
@@ -0,0 +1,170 @@
+import csv
+import datetime
+import io
+import itertools
+import json
+import zlib
+
+from utils.archive import archive_name
+
+# --- Streaming exports (admin) ---
+# An export is a projected cursor turned into CSV or NDJSON by a generator,
+# flushed in CHUNK_BYTES pieces, so memory is one cursor batch plus one chunk
+# whatever the row count. The header (CSV) goes out before the first query
+# round trip, which keeps time-to-first-byte independent of the collection
+# size. Cursors walk _id order: a date filter is applied while scanning
+# rather than with a sort, so no blocking in-memory sort can hold up the first
+# row. With gzip the same chunks go through one streaming gzip compressor.
+
+CHUNK_BYTES = 64 * 1024
+CURSOR_BATCH = 2000
+GZIP_LEVEL = 6
+
+EXPORTS = {
+    'bookings': {
+        'fields': ['booking_id', 'user_email', 'room_type', 'room_number', 'check_in', 'check_out',
+                   'guests', 'total_cost', 'status', 'payment_status', 'group_id', 'created_at'],
+        'filters': ['status', 'payment_status'],
+    },
+    'food_orders': {
+        'fields': ['order_id', 'user_email', 'room_number', 'items', 'total_cost', 'payment_status',
+                   'kitchen_status', 'created_at'],
+        'filters': ['payment_status', 'kitchen_status'],
+    },
+    'payments': {
+        'fields': ['order_id', 'payment_id', 'user_email', 'amount', 'original_amount',
+                   'discount_applied', 'promo_code', 'payment_method', 'booking_ids',
+                   'food_order_ids', 'status', 'created_at'],
+        'filters': ['status'],
+    },
+}
+FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+FILTERS = sorted({field for spec in EXPORTS.values() for field in spec['filters']})
+
+
+class ExportError(ValueError):
+    """A filter the export kind does not support; str() is shown to the admin."""
+
+
+def _parse_day(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def export_query(kind, args):
+    """
+    Mongo filter from request args: from / to (YYYY-MM-DD, inclusive) on
+    created_at -- or on the stay for bookings with date_by=check_in -- plus
+    equality on the kind's status fields. Raises ValueError on bad dates and
+    ExportError for a status filter the kind does not have.
+    """
+    query = {}
+    start, end = args.get('from'), args.get('to')
+    if start or end:
+        if kind == 'bookings' and args.get('date_by') == 'check_in':
+            window = {}
+            if start:
+                window['$gte'] = _parse_day(start).toordinal()
+            if end:
+                window['$lte'] = _parse_day(end).toordinal()
+            query['check_in_day'] = window
+        else:
+            window = {}
+            if start:
+                window['$gte'] = datetime.datetime.combine(_parse_day(start), datetime.time.min,
+                                                           tzinfo=datetime.timezone.utc)
+            if end:
+                window['$lt'] = datetime.datetime.combine(_parse_day(end) + datetime.timedelta(days=1),
+                                                          datetime.time.min, tzinfo=datetime.timezone.utc)
+            query['created_at'] = window
+    for field in FILTERS:
+        if not args.get(field):
+            continue
+        if field not in EXPORTS[kind]['filters']:
+            raise ExportError(f"{kind.replace('_', ' ').capitalize()} cannot be filtered by {field.replace('_', ' ')}.")
+        query[field] = args[field]
+    if query.get('kitchen_status') == 'new':
+        # Orders placed before the kitchen display have no kitchen_status; it shows them as new
+        query['kitchen_status'] = {'$in': ['new', None]}
+    return query
+
+
+def export_cursors(db, kind, query, include_archive=False):
+    """Projected, batched cursors over the hot collection (and its archive)."""
+    projection = dict.fromkeys(EXPORTS[kind]['fields'], 1)
+    projection['_id'] = 0
+    names = [kind, archive_name(kind)] if include_archive else [kind]
+    return [db[name].find(query, projection).sort('_id', 1).batch_size(CURSOR_BATCH) for name in names]
+
+
+def _cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=datetime.timezone.utc)
+        return value.isoformat()
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, separators=(',', ':'), default=str)
+    return value
+
+
+def _json_default(value):
+    if isinstance(value, datetime.datetime):
+        return _cell(value)
+    return str(value)
+
+
+def csv_chunks(docs, fields):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    for doc in docs:
+        writer.writerow([_cell(doc.get(f)) for f in fields])
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def ndjson_chunks(docs, fields):
+    # An empty first chunk lets the response start before the first query
+    yield ''
+    parts, size = [], 0
+    for doc in docs:
+        line = json.dumps({f: doc.get(f) for f in fields}, separators=(',', ':'),
+                          default=_json_default, ensure_ascii=False) + '\n'
+        parts.append(line)
+        size += len(line)
+        if size >= CHUNK_BYTES:
+            yield ''.join(parts)
+            parts, size = [], 0
+    if parts:
+        yield ''.join(parts)
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31 = gzip container
+    first = True
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if first:
+            # Flush the header chunk so the first bytes still go out before any query
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            first = False
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(cursors, kind, fmt, gzip=False):
+    """Generator of response chunks (bytes) for the given cursors."""
+    docs = itertools.chain.from_iterable(cursors)
+    fields = EXPORTS[kind]['fields']
+    chunks = csv_chunks(docs, fields) if fmt == 'csv' else ndjson_chunks(docs, fields)
+    chunks = (chunk.encode('utf-8') for chunk in chunks)
+    return gzip_chunks(chunks) if gzip else chunks
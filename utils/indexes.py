@@ -0,0 +1,104 @@
+import click
+from flask.cli import with_appcontext
+from pymongo import ASCENDING, DESCENDING
+
+from utils.db import mongo
+
+# --- Index definitions ---
+# collection -> list of (keys, options). Run `flask --app app create-indexes`
+# after deploying; create_index is a no-op for indexes that already exist.
+# Per-property collections (utils/properties.py) lead with `property`, so one
+# hotel's pages and aggregates never walk another hotel's keys. After adding
+# that prefix, `create-indexes --prune` drops the superseded unprefixed ones.
+INDEXES = {
+    'bookings': [
+        # My Bookings keyset pagination: newest first within a guest
+        ([('property', ASCENDING), ('user_email', ASCENDING),
+          ('created_at', DESCENDING), ('_id', DESCENDING)], {}),
+        # Stay overlap queries and occupancy: room type + status, then the check-in range
+        ([('property', ASCENDING), ('room_type', ASCENDING), ('status', ASCENDING),
+          ('check_in_day', ASCENDING), ('check_out_day', ASCENDING)], {}),
+        # Admin dashboard: the property's newest bookings
+        ([('property', ASCENDING), ('created_at', DESCENDING)], {}),
+        # Lookups by public id (cancel, invoices, reconcile-payments $lookup)
+        ([('booking_id', ASCENDING)], {}),
+    ],
+    'food_orders': [
+        # /api/v1/food_orders pagination
+        ([('property', ASCENDING), ('user_email', ASCENDING),
+          ('created_at', DESCENDING), ('_id', DESCENDING)], {}),
+        # Kitchen display snapshot: the property's recent orders
+        ([('property', ASCENDING), ('created_at', ASCENDING)], {}),
+        ([('order_id', ASCENDING)], {}),
+    ],
+    'payments': [
+        # /api/v1/payments pagination
+        ([('property', ASCENDING), ('user_email', ASCENDING),
+          ('created_at', DESCENDING), ('_id', DESCENDING)], {}),
+        # reconcile-payments: which payment covers a booking / food order
+        ([('booking_ids', ASCENDING)], {}),
+        ([('food_order_ids', ASCENDING)], {}),
+    ],
+    # Archives (utils/archive.py): fall-through lookups and admin search
+    'bookings_archive': [
+        ([('booking_id', ASCENDING)], {}),
+        ([('property', ASCENDING), ('user_email', ASCENDING),
+          ('created_at', DESCENDING), ('_id', DESCENDING)], {}),
+    ],
+    'food_orders_archive': [
+        ([('order_id', ASCENDING)], {}),
+    ],
+    'payments_archive': [
+        ([('order_id', ASCENDING), ('user_email', ASCENDING)], {}),
+        ([('booking_ids', ASCENDING)], {}),
+        ([('food_order_ids', ASCENDING)], {}),
+    ],
+    'reviews': [
+        # Reviews page and /api/v1/reviews, newest first within a property
+        ([('property', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)], {}),
+    ],
+    'campaigns': [
+        # `flask campaigns run` claims the oldest queued / abandoned campaign
+        ([('status', ASCENDING), ('created_at', ASCENDING)], {}),
+    ],
+    'audit_log': [
+        # Written through utils/write_behind.py; read newest first, overall or per actor
+        ([('at', DESCENDING)], {}),
+        ([('actor', ASCENDING), ('at', DESCENDING)], {}),
+    ],
+}
+
+
+def ensure_indexes(db):
+    created = []
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            created.append((collection, db[collection].create_index(keys, **options)))
+    return created
+
+
+def prune_indexes(db, keep):
+    """Drops indexes on the INDEXES collections that aren't in `keep` (never _id_)."""
+    wanted = {}
+    for collection, name in keep:
+        wanted.setdefault(collection, set()).add(name)
+    dropped = []
+    for collection in INDEXES:
+        for name in db[collection].index_information():
+            if name != '_id_' and name not in wanted.get(collection, ()):
+                db[collection].drop_index(name)
+                dropped.append((collection, name))
+    return dropped
+
+
+@click.command('create-indexes')
+@click.option('--prune', is_flag=True, help='Also drop indexes that are no longer defined here.')
+@with_appcontext
+def create_indexes_command(prune):
+    """Create the MongoDB indexes the routes rely on."""
+    created = ensure_indexes(mongo.db)
+    for collection, name in created:
+        click.echo(f'{collection}.{name}')
+    if prune:
+        for collection, name in prune_indexes(mongo.db, created):
+            click.echo(f'dropped {collection}.{name}')
@@ -0,0 +1,201 @@
+import collections
+import datetime
+import json
+import queue
+import threading
+import time
+import uuid
+
+from pymongo.errors import PyMongoError
+
+from utils.db import mongo
+from utils.properties import scope_to
+
+# --- Live kitchen feed (server-sent events) ---
+# food.order, payments and the kitchen's own status changes publish to an
+# in-process OrderFeed; every /admin/kitchen/stream connection is a subscriber
+# with its own small queue. Under the gunicorn eventlet worker (Procfile) the
+# threading/queue primitives used here are monkey-patched, so an idle
+# subscriber is a green thread parked on a queue -- a few KB each, no polling.
+#
+# Event ids are "<boot>-<seq>". A reconnecting EventSource sends the last id it
+# saw in Last-Event-ID; if that id is from this process and still in the replay
+# buffer the missed events are replayed, otherwise (restart, long outage) the
+# client gets a fresh snapshot of open orders from Mongo instead.
+#
+# Events carry the order's property and each subscriber only receives (and
+# replays) its own property's events, so one feed serves every kitchen.
+#
+# The write-path feed only sees orders written by this process. With several
+# workers or app servers set KITCHEN_CHANGE_STREAM (needs a replica set): a
+# watcher thread then publishes from the food_orders change stream instead.
+
+REPLAY_EVENTS = 1000
+SUBSCRIBER_QUEUE = 200
+KEEPALIVE_SECONDS = 15
+RETRY_MS = 3000
+OPEN_ORDER_HOURS = 12
+KITCHEN_STATUSES = ['new', 'preparing', 'ready', 'delivered']
+ORDER_FIELDS = ['order_id', 'room_number', 'items', 'total_cost', 'payment_status',
+                'kitchen_status', 'created_at']
+
+
+def order_event(doc):
+    """JSON-ready view of a food order for the kitchen screen."""
+    out = {field: doc.get(field) for field in ORDER_FIELDS}
+    out['kitchen_status'] = out['kitchen_status'] or 'new'
+    created = out['created_at']
+    if isinstance(created, datetime.datetime):
+        if created.tzinfo is None:
+            created = created.replace(tzinfo=datetime.timezone.utc)
+        out['created_at'] = created.isoformat()
+    return out
+
+
+def format_event(event_id, event, data):
+    """One SSE frame."""
+    lines = []
+    if event_id:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data, separators=(",", ":"))}')
+    return '\n'.join(lines) + '\n\n'
+
+
+class OrderFeed:
+    """In-process fan-out of kitchen events with a bounded replay buffer."""
+
+    def __init__(self, replay=REPLAY_EVENTS):
+        self.boot = uuid.uuid4().hex[:8]
+        self.source = 'write_path'
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._buffer = collections.deque(maxlen=replay)
+        self._subscribers = {}  # queue -> property code
+
+    def publish(self, event, data, property_code=None):
+        with self._lock:
+            self._seq += 1
+            item = (f'{self.boot}-{self._seq}', event, data)
+            self._buffer.append((item, property_code))
+            subscribers = [q for q, code in self._subscribers.items() if code == property_code]
+        for q in subscribers:
+            try:
+                q.put_nowait(item)
+            except queue.Full:
+                # Too slow to keep up: drop it; the browser reconnects and replays
+                self.unsubscribe(q)
+                with q.mutex:
+                    q.queue.clear()
+                q.put_nowait(None)
+
+    # Write-path hooks; no-ops when the change stream is the source
+    def order_created(self, doc):
+        if self.source == 'write_path':
+            self.publish('order', order_event(doc), doc.get('property'))
+
+    def orders_updated(self, order_ids, fields, property_code=None):
+        if self.source == 'write_path':
+            for order_id in order_ids:
+                self.publish('update', dict(fields, order_id=order_id), property_code)
+
+    def subscribe(self, last_event_id=None, property_code=None):
+        """
+        Registers a subscriber for one property's events. Returns (queue, missed
+        events), where missed is None when last_event_id cannot be replayed and
+        a snapshot is needed.
+        """
+        q = queue.Queue(maxsize=SUBSCRIBER_QUEUE)
+        with self._lock:
+            self._subscribers[q] = property_code
+            missed = self._missed(last_event_id)
+            if missed is not None:
+                missed = [item for item, code in missed if code == property_code]
+        return q, missed
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.pop(q, None)
+
+    def _missed(self, last_event_id):
+        if not last_event_id:
+            return None
+        boot, _, seq = last_event_id.partition('-')
+        if boot != self.boot or not seq.isdigit():
+            return None
+        seq = int(seq)
+        if seq > self._seq:
+            return None
+        if self._buffer:
+            oldest = int(self._buffer[0][0][0].rsplit('-', 1)[1])
+            if seq < oldest - 1:
+                return None
+        return [entry for entry in self._buffer if int(entry[0][0].rsplit('-', 1)[1]) > seq]
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def stream(self, q, initial):
+        """Generator of SSE frames: `initial` frames, then live events until the client goes away."""
+        try:
+            yield f'retry: {RETRY_MS}\n\n'
+            yield from initial
+            while True:
+                try:
+                    item = q.get(timeout=KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                if item is None:
+                    return
+                yield format_event(*item)
+        finally:
+            self.unsubscribe(q)
+
+    # --- Change stream source ---
+    def watch(self, collection):
+        """Publishes inserts/updates from a change stream, resuming after errors."""
+        resume_token = None
+        pipeline = [{'$match': {'operationType': {'$in': ['insert', 'update', 'replace']}}}]
+        while True:
+            try:
+                with collection.watch(pipeline, full_document='updateLookup',
+                                      resume_after=resume_token) as stream:
+                    for change in stream:
+                        resume_token = stream.resume_token
+                        doc = change.get('fullDocument')
+                        if not doc:
+                            continue
+                        if change['operationType'] == 'insert':
+                            self.publish('order', order_event(doc), doc.get('property'))
+                        else:
+                            fields = change.get('updateDescription', {}).get('updatedFields', {})
+                            update = {k: v for k, v in order_event(doc).items()
+                                      if k in fields or k == 'order_id'}
+                            self.publish('update', update, doc.get('property'))
+            except PyMongoError as e:
+                print(f"Kitchen change stream error, retrying: {e}")
+                time.sleep(5)
+
+
+kitchen_feed = OrderFeed()
+
+
+def open_orders(property_code):
+    """A property's orders from the last OPEN_ORDER_HOURS not delivered yet (oldest first)."""
+    since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=OPEN_ORDER_HOURS)
+    cursor = mongo.db.food_orders.find(
+        scope_to(property_code, created_at={'$gte': since}, kitchen_status={'$ne': 'delivered'}),
+        {field: 1 for field in ORDER_FIELDS}
+    ).sort('created_at', 1)
+    return [order_event(doc) for doc in cursor]
+
+
+def init_kitchen_feed(app):
+    """Switches the feed to the food_orders change stream when KITCHEN_CHANGE_STREAM is set."""
+    if not app.config.get('KITCHEN_CHANGE_STREAM') or kitchen_feed.source == 'change_stream':
+        return
+    kitchen_feed.source = 'change_stream'
+    threading.Thread(target=kitchen_feed.watch, args=(mongo.db.food_orders,),
+                     name='kitchen-change-stream', daemon=True).start()
@@ -0,0 +1,64 @@
+import base64
+
+from bson import json_util
+from bson.errors import BSONError
+
+# --- Keyset (cursor) pagination ---
+# Pages are fetched with a range filter on the sort key instead of skip(), so
+# page N costs the same index seek as page 1. The cursor handed to the client
+# is the sort-key values of the last row, base64-encoded; it is opaque to the
+# client but not signed, since it only narrows a query the user may run anyway.
+# A cursor that doesn't decode raises InvalidCursor; routes answer 400.
+
+
+class InvalidCursor(ValueError):
+    """The ?cursor= token is not one we issued."""
+
+
+def encode_cursor(doc, sort):
+    values = [doc[field] for field, _ in sort]
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Sort-key values from a cursor token, or None if it is malformed."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json_util.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError, BSONError):
+        # BSONError: well-formed JSON with a bad extended type, e.g. {"$oid": "zz"}
+        return None
+    return values if isinstance(values, list) else None
+
+
+def keyset_filter(sort, values):
+    """Filter selecting rows strictly after `values` in `sort` order."""
+    clauses = []
+    for i, (field, direction) in enumerate(sort):
+        clause = {f: v for (f, _), v in zip(sort[:i], values[:i])}
+        clause[field] = {'$lt' if direction < 0 else '$gt': values[i]}
+        clauses.append(clause)
+    return {'$or': clauses}
+
+
+def after_cursor(query, sort, cursor):
+    """`query` narrowed to the rows after `cursor` (unchanged without one); raises InvalidCursor."""
+    if not cursor:
+        return query
+    values = decode_cursor(cursor)
+    if values is None or len(values) != len(sort):
+        raise InvalidCursor(cursor)
+    return {'$and': [query, keyset_filter(sort, values)]}
+
+
+def paginate(collection, query, sort, projection=None, limit=20, cursor=None):
+    """
+    Returns (docs, next_cursor) for one page. next_cursor is None on the last page.
+    `sort` must end with a unique field (normally _id) so the order is total.
+    """
+    query = after_cursor(query, sort, cursor)
+    docs = list(collection.find(query, projection).sort(sort).limit(limit + 1))
+    if len(docs) > limit:
+        docs = docs[:limit]
+        return docs, encode_cursor(docs[-1], sort)
+    return docs, None
@@ -0,0 +1,303 @@
+import collections
+import copy
+import datetime
+import json
+import math
+import threading
+import time
+
+import click
+from flask.cli import with_appcontext
+
+from utils.db import mongo
+from utils.startup import lazy_import
+
+# Imported on first use (see utils/startup.py)
+np = lazy_import('numpy')
+
+# --- Per-night dynamic pricing ---
+# A nightly rate is base price x season (month) x weekday x occupancy tier x
+# any date-range overrides, rounded to the nearest ₹10. Rules live in the
+# rate_rules collection (one document, _id 'current'); DEFAULT_RATE_RULES are
+# used until one is saved. Rules are evaluated for a whole date range at once
+# with NumPy, and each worker keeps a price calendar per room type for
+# CALENDAR_NIGHTS from today. Quoting a stay is then a slice-and-sum, and the
+# "from ₹X" figures are a min over a slice. The calendar is rebuilt when the
+# rules change (save_rate_rules drops it immediately in this worker; other
+# workers pick the change up within CALENDAR_TTL), when the day rolls over, or
+# after CALENDAR_TTL so occupancy tiers follow new bookings.
+#
+# Each property has its own calendar. Its rules are the rate_rules document
+# with the property code as _id, falling back to the chain-wide 'current'.
+#
+# A rebuild never waits on the occupancy model. It uses whatever occupancy the
+# model already holds, or the previous calendar's while the model is
+# mid-refresh, and starts a background refresh for the next rebuild. Readers
+# take one immutable snapshot of the calendar. While a rebuild is running,
+# other requests keep quoting from the last snapshot.
+
+CALENDAR_NIGHTS = 730
+CALENDAR_TTL = 300
+FROM_PRICE_NIGHTS = 90
+# Rule multipliers must lie in (0, MAX_MULTIPLIER]
+MAX_MULTIPLIER = 10.0
+
+# One built calendar; replaced whole, never mutated
+Calendar = collections.namedtuple('Calendar', 'start_day prices rules occupancy built_at')
+
+DEFAULT_RATE_RULES = {
+    # Bengaluru peak season Oct-Jan, monsoon discount Jun-Sep
+    'season': {'1': 1.15, '2': 1.0, '3': 1.0, '4': 1.0, '5': 1.05, '6': 0.9,
+               '7': 0.85, '8': 0.9, '9': 0.95, '10': 1.1, '11': 1.15, '12': 1.25},
+    # Monday .. Sunday (Friday/Saturday nights cost more)
+    'weekday': [1.0, 1.0, 1.0, 1.0, 1.15, 1.2, 1.05],
+    # [occupancy threshold, multiplier]: applied once the night is this full
+    'occupancy': [[0.7, 1.1], [0.85, 1.25], [0.95, 1.5]],
+    # {'start': 'YYYY-MM-DD', 'end': 'YYYY-MM-DD' (exclusive), 'multiplier': x,
+    #  'room_types': [...] (optional, default all)}
+    'overrides': []
+}
+
+
+def nightly_rates(rules, base_price, room_type, start_day, nights, occupancy=None):
+    """Vector of nightly prices for [start_day, start_day + nights) given day ordinals."""
+    days = np.arange(start_day, start_day + nights)
+    # Day ordinal 1 (0001-01-01) was a Monday, so weekday = (ordinal - 1) % 7
+    weekday = (days - 1) % 7
+    # Months are looked up once per calendar month, then broadcast to the nights
+    month_starts = _month_starts(start_day, nights)
+    months = np.array([datetime.date.fromordinal(d).month for d in month_starts])
+    month_of_night = months[np.searchsorted(month_starts, days, side='right') - 1]
+
+    season = np.array([rules['season'].get(str(m), 1.0) for m in range(13)])
+    rates = base_price * season[month_of_night] * np.asarray(rules['weekday'])[weekday]
+
+    if occupancy is not None and rules.get('occupancy'):
+        tiers = sorted(rules['occupancy'])
+        thresholds = np.array([t for t, _ in tiers])
+        multipliers = np.array([1.0] + [m for _, m in tiers])
+        rates *= multipliers[np.searchsorted(thresholds, occupancy, side='right')]
+
+    for override in rules.get('overrides', []):
+        if override.get('room_types') and room_type not in override['room_types']:
+            continue
+        first = datetime.date.fromisoformat(override['start']).toordinal()
+        last = datetime.date.fromisoformat(override['end']).toordinal()
+        rates[(days >= first) & (days < last)] *= override['multiplier']
+
+    return np.round(rates / 10) * 10
+
+
+def _month_starts(start_day, nights):
+    """Ordinal of the first night of each calendar month touched by the range."""
+    first = datetime.date.fromordinal(start_day)
+    last = datetime.date.fromordinal(start_day + nights - 1)
+    starts, year, month = [], first.year, first.month
+    while (year, month) <= (last.year, last.month):
+        starts.append(datetime.date(year, month, 1).toordinal())
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return starts
+
+
+class PriceCalendar:
+    """Per-worker cache of nightly prices per room type."""
+
+    def __init__(self, room_types, occupancy_model=None, rules_id=None):
+        self.room_types = room_types
+        self.occupancy_model = occupancy_model
+        self.rules_id = rules_id
+        self._lock = threading.Lock()
+        self._calendar = None
+        self._refreshing = False
+
+    @property
+    def rules(self):
+        calendar = self._calendar
+        return calendar.rules if calendar is not None else None
+
+    def invalidate(self):
+        # Kept (expired) so concurrent readers can still quote while one request rebuilds
+        calendar = self._calendar
+        if calendar is not None:
+            self._calendar = calendar._replace(built_at=float('-inf'))
+
+    def _load_rules(self):
+        # The property's own rules if it has any, else the chain-wide ones (one round trip)
+        docs = {d['_id']: d for d in mongo.db.rate_rules.find({'_id': {'$in': [self.rules_id, 'current']}})}
+        doc = docs.get(self.rules_id) or docs.get('current')
+        rules = copy.deepcopy(DEFAULT_RATE_RULES)
+        if doc:
+            rules.update({k: v for k, v in doc.items() if k in DEFAULT_RATE_RULES})
+        return rules
+
+    def _occupancy(self, start_day, previous):
+        """Occupancy rate per room type for the calendar window, or None if unavailable."""
+        model = self.occupancy_model
+        if model is None:
+            return None
+        occupancy = model.rates(start_day, CALENDAR_NIGHTS)
+        self._refresh_occupancy_soon()
+        if occupancy is None and previous is not None and previous.start_day == start_day:
+            return previous.occupancy
+        return occupancy
+
+    def _refresh_occupancy_soon(self):
+        if self._refreshing:
+            return
+        self._refreshing = True
+        threading.Thread(target=self._refresh_occupancy, name='price-occupancy', daemon=True).start()
+
+    def _refresh_occupancy(self):
+        try:
+            self.occupancy_model.refresh()
+        except Exception as e:
+            print(f"Occupancy unavailable for pricing: {e}")
+            return
+        finally:
+            self._refreshing = False
+        calendar = self._calendar
+        if calendar is not None and calendar.occupancy is None:
+            # Built before the model had any data: price with occupancy from now on
+            self.invalidate()
+
+    def _fresh(self, calendar, today):
+        return (calendar is not None and calendar.start_day == today
+                and time.monotonic() - calendar.built_at < CALENDAR_TTL)
+
+    def _snapshot(self):
+        """The current calendar, rebuilt first if it is missing or old."""
+        today = datetime.date.today().toordinal()
+        calendar = self._calendar
+        if self._fresh(calendar, today):
+            return calendar
+        if not self._lock.acquire(blocking=False):
+            # Someone else is rebuilding: quote from the previous calendar meanwhile
+            if calendar is not None and calendar.start_day == today:
+                return calendar
+            self._lock.acquire()
+        try:
+            calendar = self._calendar
+            if self._fresh(calendar, today):
+                return calendar
+            rules = self._load_rules()
+            occupancy = self._occupancy(today, calendar)
+            prices = {
+                name: nightly_rates(rules, details['price'], name, today, CALENDAR_NIGHTS,
+                                    (occupancy or {}).get(name))
+                for name, details in self.room_types.items()
+            }
+            calendar = self._calendar = Calendar(today, prices, rules, occupancy, time.monotonic())
+            return calendar
+        finally:
+            self._lock.release()
+
+    def nightly(self, room_type, check_in_day, check_out_day):
+        """Nightly prices for a stay; nights outside the cached window are evaluated directly."""
+        calendar = self._snapshot()
+        start = check_in_day - calendar.start_day
+        end = check_out_day - calendar.start_day
+        if 0 <= start and end <= CALENDAR_NIGHTS:
+            return calendar.prices[room_type][start:end]
+        return nightly_rates(calendar.rules, self.room_types[room_type]['price'], room_type,
+                             check_in_day, check_out_day - check_in_day)
+
+    def quote(self, room_type, check_in_day, check_out_day):
+        """Total price of a stay."""
+        return float(self.nightly(room_type, check_in_day, check_out_day).sum())
+
+    def from_prices(self, nights=FROM_PRICE_NIGHTS):
+        """Cheapest nightly price per room type over the next `nights` nights."""
+        calendar = self._snapshot()
+        return {name: int(prices[:nights].min()) for name, prices in calendar.prices.items()}
+
+
+def _multiplier(value, where):
+    if (isinstance(value, bool) or not isinstance(value, (int, float))
+            or not math.isfinite(value) or not 0 < value <= MAX_MULTIPLIER):
+        raise ValueError(f'{where}: multiplier must be a number in (0, {MAX_MULTIPLIER:g}], got {value!r}')
+    return value
+
+
+def validate_rate_rules(rules):
+    """Raises ValueError unless `rules` has the shape and ranges nightly_rates relies on."""
+    if not isinstance(rules, dict):
+        raise ValueError('Rate rules must be a JSON object')
+    unknown = set(rules) - set(DEFAULT_RATE_RULES)
+    if unknown:
+        raise ValueError(f"Unknown rate rule keys: {', '.join(sorted(unknown))}")
+    if 'season' in rules:
+        season = rules['season']
+        if not isinstance(season, dict) or not set(season) <= {str(m) for m in range(1, 13)}:
+            raise ValueError("season must map month numbers '1'..'12' to multipliers")
+        for month, value in season.items():
+            _multiplier(value, f'season[{month}]')
+    if 'weekday' in rules:
+        weekday = rules['weekday']
+        if not isinstance(weekday, list) or len(weekday) != 7:
+            raise ValueError('weekday must be a list of 7 multipliers (Monday first)')
+        for i, value in enumerate(weekday):
+            _multiplier(value, f'weekday[{i}]')
+    if 'occupancy' in rules:
+        if not isinstance(rules['occupancy'], list):
+            raise ValueError('occupancy must be a list of [threshold, multiplier] pairs')
+        for i, tier in enumerate(rules['occupancy']):
+            if not isinstance(tier, list) or len(tier) != 2:
+                raise ValueError(f'occupancy[{i}] must be [threshold, multiplier]')
+            threshold, value = tier
+            if isinstance(threshold, bool) or not isinstance(threshold, (int, float)) or not 0 < threshold <= 1:
+                raise ValueError(f'occupancy[{i}]: threshold must be in (0, 1], got {threshold!r}')
+            _multiplier(value, f'occupancy[{i}]')
+    if 'overrides' in rules:
+        if not isinstance(rules['overrides'], list):
+            raise ValueError('overrides must be a list')
+        for i, override in enumerate(rules['overrides']):
+            if not isinstance(override, dict):
+                raise ValueError(f'overrides[{i}] must be an object')
+            try:
+                start = datetime.date.fromisoformat(override['start'])
+                end = datetime.date.fromisoformat(override['end'])
+            except (KeyError, TypeError, ValueError):
+                raise ValueError(f'overrides[{i}]: start and end must be YYYY-MM-DD dates') from None
+            if end <= start:
+                raise ValueError(f'overrides[{i}]: end must be after start')
+            _multiplier(override.get('multiplier'), f'overrides[{i}]')
+            room_types = override.get('room_types')
+            if room_types is not None and (not isinstance(room_types, list)
+                                           or not all(isinstance(r, str) for r in room_types)):
+                raise ValueError(f'overrides[{i}]: room_types must be a list of names')
+
+
+def save_rate_rules(rules, calendar=None, rules_id='current'):
+    """Stores new rate rules ('current' = every property without its own) and drops a cached calendar."""
+    validate_rate_rules(rules)
+    mongo.db.rate_rules.update_one(
+        {'_id': rules_id},
+        {'$set': dict(rules, updated_at=datetime.datetime.now(datetime.timezone.utc))},
+        upsert=True
+    )
+    if calendar is not None:
+        calendar.invalidate()
+
+
+@click.command('set-rate-rules')
+@click.argument('rules_file', type=click.File('r'))
+@click.option('--property', 'code', default=None, help='Rules for one property only (default: chain-wide).')
+@with_appcontext
+def set_rate_rules_command(rules_file, code):
+    """Replace the pricing rules with the JSON object in RULES_FILE."""
+    from utils.properties import properties
+    rules = json.load(rules_file)
+    try:
+        validate_rate_rules(rules)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    if code:
+        prop = properties.get(code)
+        if prop is None:
+            raise click.ClickException(f'No property {code}')
+        save_rate_rules(rules, prop.price_calendar, code)
+    else:
+        save_rate_rules(rules)
+        for prop in properties.all():
+            prop.price_calendar.invalidate()
+    click.echo(f"Saved rate rules for {code or 'all properties'}: {', '.join(sorted(rules))}")
@@ -0,0 +1,208 @@
+import datetime
+import os
+import re
+import sys
+
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+# Real OS thread + sleep, even when gunicorn's eventlet worker has monkey-patched
+# the stdlib: a green sampler would only run when the profiled request yields.
+# Resolved by init_profiler, so eventlet (~200 ms to import outside the
+# eventlet worker) is only loaded when profiling is switched on.
+_threading = None
+_time = None
+
+# --- On-demand sampling profiler ---
+# Installed as WSGI middleware only when PROFILER_ENABLED is set. A request is
+# profiled when it carries a signed token in the X-Profile header (or the
+# _profile query flag), or when it falls on the PROFILE_SAMPLE_EVERY-th
+# request. A non-profiled request costs one environ lookup, a substring test
+# on the query string and a counter decrement. Profiles are written as
+# collapsed stacks ("frame;frame;frame count"), which flamegraph.pl and
+# speedscope read directly, into a directory that keeps only the newest
+# PROFILE_KEEP files.
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_QUERY_FLAG = '_profile='
+TOKEN_SALT = 'request-profile'
+TOKEN_MAX_AGE = 3600
+
+
+def make_profile_token(secret_key):
+    """Signed token an admin sends in X-Profile (or ?_profile=) to profile a request."""
+    return URLSafeTimedSerializer(secret_key).dumps('profile', salt=TOKEN_SALT)
+
+
+def _frame_label(code):
+    filename = '/'.join(code.co_filename.replace('\\', '/').rsplit('/', 2)[-2:])
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'.replace(';', ',')
+
+
+class Sampler:
+    """Samples one thread's stack every `interval` seconds from a real OS thread."""
+
+    def __init__(self, thread_id, anchor, interval):
+        self.thread_id = thread_id
+        self.anchor = anchor
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self._stop = _threading.Event()
+        self._thread = _threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            _time.sleep(self.interval)
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            # Only keep samples whose stack runs through the profiled request's
+            # anchor frame; under eventlet other greenlets share the OS thread.
+            while frame is not None and frame is not self.anchor:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if frame is None or not stack or self._stop.is_set():
+                continue
+            key = ';'.join(reversed(stack))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+
+    def folded(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in sorted(self.stacks.items()))
+
+
+class ProfiledBody:
+    """WSGI body wrapper that keeps sampling while the server iterates it."""
+
+    def __init__(self, result, sampler, on_close):
+        self.result = result
+        self.sampler = sampler
+        self.on_close = on_close
+        self._closed = False
+
+    def __iter__(self):
+        # The request's frames are gone by now; samples are anchored on this generator
+        self.sampler.anchor = sys._getframe()
+        yield from self.result
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if hasattr(self.result, 'close'):
+                self.result.close()
+        finally:
+            self.on_close()
+
+
+class ProfilerMiddleware:
+    """WSGI middleware that wraps selected requests in a Sampler."""
+
+    def __init__(self, app, flask_app):
+        self.app = app
+        self.secret_key = flask_app.config['SECRET_KEY']
+        self.directory = profile_dir(flask_app)
+        self.keep = int(flask_app.config.get('PROFILE_KEEP', 50))
+        self.interval = float(flask_app.config.get('PROFILE_INTERVAL', 0.005))
+        self.sample_every = int(flask_app.config.get('PROFILE_SAMPLE_EVERY') or 0)
+        self._countdown = self.sample_every
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __call__(self, environ, start_response):
+        token = environ.get(PROFILE_HEADER)
+        if token is None and PROFILE_QUERY_FLAG in environ.get('QUERY_STRING', ''):
+            token = re.search(r'_profile=([^&]*)', environ['QUERY_STRING']).group(1)
+        if token is not None:
+            if not self._valid(token):
+                return self.app(environ, start_response)
+        elif not self._sampled():
+            return self.app(environ, start_response)
+        return self._profile(environ, start_response)
+
+    def _sampled(self):
+        if not self.sample_every:
+            return False
+        self._countdown -= 1
+        if self._countdown > 0:
+            return False
+        self._countdown = self.sample_every
+        return True
+
+    def _valid(self, token):
+        try:
+            URLSafeTimedSerializer(self.secret_key).loads(token, salt=TOKEN_SALT, max_age=TOKEN_MAX_AGE)
+            return True
+        except BadSignature:
+            return False
+
+    def _profile(self, environ, start_response):
+        sampler = Sampler(_threading.get_ident(), sys._getframe(), self.interval)
+        started = _time.perf_counter()
+        sampler.start()
+
+        def finish():
+            sampler.stop()
+            self._save(environ, sampler, (_time.perf_counter() - started) * 1000)
+
+        try:
+            result = self.app(environ, start_response)
+        except BaseException:
+            finish()
+            raise
+        # Passed through chunk by chunk, so exports and the kitchen SSE stream
+        # keep streaming; the sample window stays open until the server closes it
+        return ProfiledBody(result, sampler, finish)
+
+    def _save(self, environ, sampler, elapsed_ms):
+        if not sampler.samples:
+            return
+        stamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+        path = re.sub(r'[^A-Za-z0-9]+', '-', environ.get('PATH_INFO', '/')).strip('-') or 'root'
+        name = f"{stamp}_{environ.get('REQUEST_METHOD', 'GET')}_{path[:60]}_{elapsed_ms:.0f}ms.folded"
+        with open(os.path.join(self.directory, name), 'w') as fh:
+            fh.write(sampler.folded())
+        # Ring buffer: drop the oldest profiles beyond PROFILE_KEEP
+        for old in list_profiles(self.directory)[self.keep:]:
+            try:
+                os.remove(os.path.join(self.directory, old['name']))
+            except OSError:
+                pass
+
+
+def list_profiles(directory):
+    """Saved profiles, newest first."""
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for name in os.listdir(directory):
+        if not name.endswith('.folded'):
+            continue
+        stat = os.stat(os.path.join(directory, name))
+        profiles.append({
+            'name': name,
+            'size': stat.st_size,
+            'created_at': datetime.datetime.fromtimestamp(stat.st_mtime),
+        })
+    profiles.sort(key=lambda p: p['name'], reverse=True)
+    return profiles
+
+
+def profile_dir(app):
+    return app.config.get('PROFILE_DIR') or os.path.join(app.instance_path, 'profiles')
+
+
+def init_profiler(app):
+    """Wraps the WSGI app in the profiler when PROFILER_ENABLED is set."""
+    if app.config.get('PROFILER_ENABLED'):
+        global _threading, _time
+        from eventlet import patcher
+        _threading = patcher.original('threading')
+        _time = patcher.original('time')
+        app.wsgi_app = ProfilerMiddleware(app.wsgi_app, app)
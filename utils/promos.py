@@ -0,0 +1,286 @@
+import datetime
+import threading
+import time
+
+import click
+from flask.cli import with_appcontext
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from utils.db import mongo
+from utils.query_budget import record_queries
+
+# --- Promo codes ---
+# Codes live in promo_codes (_id = the code) with a percent, an optional
+# validity window (starts_at / ends_at), an optional global cap
+# (max_redemptions) and an optional per-guest cap (per_user_limit).
+# Per-guest counts live in promo_redemptions (_id '<code>:<email>').
+#
+# Validation (the billing page's Apply button) is answered from a per-process
+# cache of the whole table. The cache carries the version number stored in
+# promo_meta; every write bumps it, and each worker re-reads the version at
+# most every VERSION_CHECK_SECONDS, reloading the codes only when it moved.
+# A warm cache therefore answers without touching Mongo, at the price of a
+# code edited elsewhere looking valid here for up to that interval. That is
+# safe because redemption at payment time is decided by Mongo alone: a
+# conditional $inc that only matches while the code is active, inside its
+# window and under its caps.
+
+VERSION_CHECK_SECONDS = 30
+
+# Installed on first use so existing deployments keep their three codes
+DEFAULT_PROMOS = {
+    'SAKKATH': 10,
+    'BOMBAAT': 20,
+    'WELCOME': 5,
+}
+
+
+class PromoError(Exception):
+    """A code that cannot be applied; str() is shown to the guest."""
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _aware(value):
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+def check_promo(promo, now=None):
+    """Raises PromoError unless the (cached) promo can be used right now."""
+    now = now or _now()
+    if promo is None or not promo.get('active', True):
+        raise PromoError('Invalid promo code.')
+    starts_at, ends_at = _aware(promo.get('starts_at')), _aware(promo.get('ends_at'))
+    if starts_at and now < starts_at:
+        raise PromoError('This promo code is not active yet.')
+    if ends_at and now >= ends_at:
+        raise PromoError('This promo code has expired.')
+    cap = promo.get('max_redemptions')
+    if cap is not None and promo.get('redemptions', 0) >= cap:
+        raise PromoError('This promo code has been fully redeemed.')
+
+
+class PromoCache:
+    """Per-worker copy of promo_codes, reloaded when promo_meta's version changes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._promos = None
+        self._version = None
+        self._checked_at = 0.0
+        # Bumped under _lock by invalidate(); a load that started under an
+        # older generation may have read codes from before the write, so it
+        # is thrown away rather than installed.
+        self._generation = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._promos = None
+
+    def _read_version(self):
+        doc = mongo.db.promo_meta.find_one({'_id': 'version'})
+        return doc['v'] if doc else 0
+
+    def _load(self, version):
+        """(version, codes) for the version the caller just read."""
+        promos = {doc['_id']: doc for doc in mongo.db.promo_codes.find()}
+        if not promos:
+            # One-off bootstrap of an empty table; kept out of the request's query budget
+            with record_queries():
+                install_default_promos()
+                version = self._read_version()
+                promos = {doc['_id']: doc for doc in mongo.db.promo_codes.find()}
+        return version, promos
+
+    def _fresh(self):
+        return self._promos is not None and time.monotonic() - self._checked_at < VERSION_CHECK_SECONDS
+
+    def _ensure(self):
+        """The current codes dict; reloads it first when stale."""
+        promos = self._promos
+        if promos is not None and self._fresh():
+            return promos
+        with self._load_lock:
+            while True:
+                with self._lock:
+                    if self._fresh():
+                        return self._promos
+                    generation = self._generation
+                    promos, version = self._promos, self._version
+                # Mongo is read outside _lock so invalidate() never waits on it.
+                latest = self._read_version()
+                if promos is None or latest != version:
+                    version, promos = self._load(latest)
+                with self._lock:
+                    if generation != self._generation:
+                        continue
+                    self._promos = promos
+                    self._version = version
+                    self._checked_at = time.monotonic()
+                    return promos
+
+    def get(self, code):
+        return self._ensure().get(code)
+
+    def validate(self, code):
+        """The cached promo for `code`, or PromoError. Never writes."""
+        promo = self.get(code)
+        check_promo(promo)
+        return promo
+
+    def active_codes(self):
+        """(code, percent) for every currently usable code, best discount first."""
+        usable = []
+        for code, promo in self._ensure().items():
+            try:
+                check_promo(promo)
+            except PromoError:
+                continue
+            usable.append((code, promo['percent']))
+        return sorted(usable, key=lambda p: -p[1])
+
+
+promo_cache = PromoCache()
+
+
+def _bump_version():
+    mongo.db.promo_meta.update_one({'_id': 'version'}, {'$inc': {'v': 1}}, upsert=True)
+    promo_cache.invalidate()
+
+
+def redeem_promo(code, user_email):
+    """
+    Atomically claims one use of `code` for `user_email` and returns the promo.
+    Raises PromoError if it is unknown, outside its window or over a cap.
+    """
+    promo = promo_cache.get(code)
+    if promo is None:
+        raise PromoError('Invalid promo code.')
+
+    per_user = promo.get('per_user_limit')
+    if per_user is not None:
+        try:
+            # Matches only while under the limit; otherwise the upsert collides on _id
+            mongo.db.promo_redemptions.update_one(
+                {'_id': f'{code}:{user_email}', 'count': {'$lt': per_user}},
+                {'$inc': {'count': 1}, '$set': {'last_redeemed_at': _now()}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            raise PromoError('You have already used this promo code.')
+
+    now = _now()
+    redeemed = mongo.db.promo_codes.find_one_and_update(
+        {
+            '_id': code,
+            'active': True,
+            '$and': [
+                {'$or': [{'starts_at': None}, {'starts_at': {'$lte': now}}]},
+                {'$or': [{'ends_at': None}, {'ends_at': {'$gt': now}}]},
+                {'$or': [{'max_redemptions': None},
+                         {'$expr': {'$lt': ['$redemptions', '$max_redemptions']}}]},
+            ]
+        },
+        {'$inc': {'redemptions': 1}},
+        return_document=ReturnDocument.AFTER
+    )
+    if redeemed is None:
+        if per_user is not None:
+            mongo.db.promo_redemptions.update_one({'_id': f'{code}:{user_email}'}, {'$inc': {'count': -1}})
+        # Find out why from the live document, for the message
+        check_promo(mongo.db.promo_codes.find_one({'_id': code}), now)
+        raise PromoError('This promo code is no longer available.')
+    return redeemed
+
+
+def release_promo(code, user_email):
+    """Gives back a use claimed by redeem_promo (payment did not go through)."""
+    mongo.db.promo_codes.update_one({'_id': code, 'redemptions': {'$gt': 0}}, {'$inc': {'redemptions': -1}})
+    mongo.db.promo_redemptions.update_one(
+        {'_id': f'{code}:{user_email}', 'count': {'$gt': 0}}, {'$inc': {'count': -1}})
+
+
+def save_promo(code, percent, starts_at=None, ends_at=None, max_redemptions=None,
+               per_user_limit=None, active=True):
+    """Creates or updates a code (redemption counts are kept) and bumps the cache version."""
+    if not 0 < percent <= 100:
+        raise ValueError('percent must be between 0 and 100.')
+    mongo.db.promo_codes.update_one(
+        {'_id': code.upper()},
+        {'$set': {
+            'percent': percent, 'starts_at': starts_at, 'ends_at': ends_at,
+            'max_redemptions': max_redemptions, 'per_user_limit': per_user_limit,
+            'active': active, 'updated_at': _now()
+        }, '$setOnInsert': {'redemptions': 0}},
+        upsert=True
+    )
+    _bump_version()
+
+
+def install_default_promos():
+    """
+    Adds DEFAULT_PROMOS that do not exist yet (uncapped, no expiry). Bumps the
+    stored version only: the caller is this worker's own cache load.
+    """
+    for code, percent in DEFAULT_PROMOS.items():
+        mongo.db.promo_codes.update_one(
+            {'_id': code},
+            {'$setOnInsert': {
+                'percent': percent, 'starts_at': None, 'ends_at': None, 'max_redemptions': None,
+                'per_user_limit': None, 'active': True, 'redemptions': 0, 'updated_at': _now()
+            }},
+            upsert=True
+        )
+    mongo.db.promo_meta.update_one({'_id': 'version'}, {'$inc': {'v': 1}}, upsert=True)
+
+
+# --- CLI: flask promos ... ---
+@click.group('promos')
+def promos_cli():
+    """Manage promo codes."""
+
+
+@promos_cli.command('list')
+@with_appcontext
+def list_command():
+    """Show every code with its window, caps and redemptions."""
+    for promo in mongo.db.promo_codes.find().sort('_id', 1):
+        window = f"{promo.get('starts_at') or '-'} .. {promo.get('ends_at') or '-'}"
+        cap = promo.get('max_redemptions')
+        click.echo(f"{promo['_id']:12} {promo['percent']:>3}%  {'on ' if promo.get('active') else 'off'}  "
+                   f"{promo.get('redemptions', 0)}/{cap if cap is not None else '∞'}  "
+                   f"per guest {promo.get('per_user_limit') or '∞'}  {window}")
+
+
+@promos_cli.command('set')
+@click.argument('code')
+@click.option('--percent', type=float, required=True)
+@click.option('--starts', type=click.DateTime(), help='Valid from (UTC).')
+@click.option('--ends', type=click.DateTime(), help='Valid until (UTC, exclusive).')
+@click.option('--max-redemptions', type=int, help='Total uses allowed.')
+@click.option('--per-user', type=int, help='Uses allowed per guest.')
+@click.option('--inactive', is_flag=True, help='Create or update the code switched off.')
+@with_appcontext
+def set_command(code, percent, starts, ends, max_redemptions, per_user, inactive):
+    """Create or update CODE."""
+    save_promo(code, percent, _aware(starts), _aware(ends), max_redemptions, per_user, not inactive)
+    click.echo(f'Saved {code.upper()}')
+
+
+@promos_cli.command('disable')
+@click.argument('code')
+@with_appcontext
+def disable_command(code):
+    """Switch CODE off (its history is kept)."""
+    result = mongo.db.promo_codes.update_one({'_id': code.upper()}, {'$set': {'active': False}})
+    if not result.matched_count:
+        raise click.ClickException(f'No promo code {code.upper()}')
+    _bump_version()
+    click.echo(f'Disabled {code.upper()}')
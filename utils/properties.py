@@ -0,0 +1,328 @@
+import datetime
+import json
+import re
+import threading
+import time
+
+import click
+from flask import abort, current_app, g, has_request_context, request
+from flask.cli import with_appcontext
+
+from utils.cache import TTLCache
+from utils.db import mongo
+from utils.occupancy import OccupancyModel
+from utils.pricing import PriceCalendar
+
+# --- Properties (one document per hotel) ---
+# Every booking, food order, payment, review and contact message carries a
+# `property` code. Guests, promo codes and campaigns are shared by the whole
+# chain. Each property has its own catalog (room_types, menu) in the
+# `properties` collection. The property is resolved once per request, in this
+# order:
+#
+#   1. a /p/<code>/ path prefix: PropertyPathMiddleware moves it into
+#      SCRIPT_NAME, so routes stay unchanged and url_for keeps the prefix;
+#   2. the Host header, matched against each property's `hosts`;
+#   3. DEFAULT_PROPERTY.
+#
+# Queries add {'property': code} through scoped(), and every index on these
+# collections starts with `property` (utils/indexes.py). A property's queries
+# therefore only walk its own slice of each index, however many properties
+# share the collection. `flask bench properties` checks this.
+#
+# Per-worker state is partitioned the same way. Each Property object owns its
+# occupancy model, price calendar and My Bookings analytics cache. The
+# registry reloads the (small) properties collection every RELOAD_SECONDS and
+# only rebuilds a property whose catalog changed.
+#
+# Upgrading a single-property database: `flask migrate-properties` stamps the
+# existing documents with DEFAULT_PROPERTY. Then run `flask create-indexes
+# --prune` to build the property-prefixed indexes and drop the old ones.
+
+DEFAULT_PROPERTY = 'blr'
+RELOAD_SECONDS = 60
+PATH_PREFIX_RE = re.compile(r'^/p/([a-z0-9-]+)(/.*)?$')
+ENVIRON_KEY = 'hotel.property'
+SCOPED_COLLECTIONS = ['bookings', 'food_orders', 'payments', 'reviews', 'contacts']
+MIGRATION_ID = 'property_codes'
+
+# Catalog of the original Bengaluru hotel; new properties start from a copy
+# 'rooms' is the inventory per type (150 rooms in total, numbered 101-250)
+DEFAULT_ROOM_TYPES = {
+    'Standard Single': {'price': 1500, 'rooms': 40, 'description': 'A cozy room for a single traveler.'},
+    'Standard Double': {'price': 2500, 'rooms': 50, 'description': 'Comfortable room with a double bed.'},
+    'Deluxe Double': {'price': 5000, 'rooms': 35, 'description': 'Spacious room with luxury amenities.'},
+    'Suite': {'price': 8000, 'rooms': 20, 'description': 'A large suite with a separate living area.'},
+    'Presidential Suite': {'price': 15000, 'rooms': 5, 'description': 'The ultimate in luxury and space.'}
+}
+DEFAULT_MENU = {
+    'North Indian': [
+        {'name': 'Butter Chicken', 'price': 450, 'description': 'Creamy chicken curry.'},
+        {'name': 'Dal Makhani', 'price': 300, 'description': 'Black lentils and kidney beans.'},
+        {'name': 'Paneer Tikka', 'price': 350, 'description': 'Marinated cheese cubes.'},
+    ],
+    'South Indian': [
+        {'name': 'Masala Dosa', 'price': 150, 'description': 'Crispy crepe with potato filling.'},
+        {'name': 'Idli Sambar', 'price': 100, 'description': 'Steamed rice cakes.'},
+    ],
+    'Chinese': [
+        {'name': 'Hakka Noodles', 'price': 250, 'description': 'Stir-fried noodles.'},
+        {'name': 'Manchurian', 'price': 280, 'description': 'Fried vegetable balls.'},
+    ],
+    'Continental': [
+        {'name': 'Veg Au Gratin', 'price': 400, 'description': 'Baked vegetables with cheese.'},
+        {'name': 'Grilled Chicken', 'price': 500, 'description': 'Served with mashed potatoes.'},
+    ],
+    'Desserts': [
+        {'name': 'Gulab Jamun', 'price': 120, 'description': 'Sweet milk solids balls.'},
+        {'name': 'Chocolate Brownie', 'price': 200, 'description': 'With ice cream.'},
+    ],
+    'Beverages': [
+        {'name': 'Masala Chai', 'price': 50, 'description': 'Spiced Indian tea.'},
+        {'name': 'Fresh Lime Soda', 'price': 80, 'description': 'Sweet or salted.'},
+    ]
+}
+DEFAULT_PROPERTIES = [
+    {'_id': DEFAULT_PROPERTY, 'name': 'Hotel Bombaat', 'address': 'Bengaluru, Karnataka, India', 'hosts': [],
+     'room_types': DEFAULT_ROOM_TYPES, 'menu': DEFAULT_MENU},
+]
+
+
+def scope_to(code, query=None, **fields):
+    """`query` restricted to property `code`; the one place a property filter is built."""
+    return {'property': code, **(query or {}), **fields}
+
+
+class Property:
+    """One hotel: its catalog plus the per-worker caches built from it."""
+
+    def __init__(self, doc):
+        self.doc = doc
+        self.code = doc['_id']
+        self.name = doc.get('name') or self.code
+        self.hosts = [h.lower() for h in doc.get('hosts') or []]
+        self.room_types = doc['room_types']
+        self.menu = doc['menu']
+        # Per-guest chart series for My Bookings, dropped when the guest books or cancels
+        self.analytics_cache = TTLCache(maxsize=5000, ttl=300)
+        # Nightly occupancy per room type for the admin heatmap (see utils/occupancy.py)
+        self.occupancy_model = OccupancyModel(self.room_types, self.code)
+        # Seasonal/weekday/occupancy nightly rates (see utils/pricing.py)
+        self.price_calendar = PriceCalendar(self.room_types, self.occupancy_model, self.code)
+
+    def same_catalog(self, doc):
+        return doc['room_types'] == self.room_types and doc['menu'] == self.menu
+
+    def update(self, doc):
+        """Takes a new name / hosts without dropping the caches."""
+        self.doc = doc
+        self.name = doc.get('name') or self.code
+        self.hosts = [h.lower() for h in doc.get('hosts') or []]
+
+    def scoped(self, query=None, **fields):
+        """`query` restricted to this property."""
+        return scope_to(self.code, query, **fields)
+
+
+class PropertyRegistry:
+    """Per-worker map of property code -> Property, reloaded every RELOAD_SECONDS."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._properties = None
+        self._hosts = {}
+        self._loaded_at = 0.0
+        self.default_code = DEFAULT_PROPERTY
+
+    def invalidate(self):
+        self._loaded_at = 0.0
+
+    def _ensure(self):
+        if self._properties is not None and time.monotonic() - self._loaded_at < RELOAD_SECONDS:
+            return
+        with self._lock:
+            if self._properties is not None and time.monotonic() - self._loaded_at < RELOAD_SECONDS:
+                return
+            docs = list(mongo.db.properties.find())
+            if not docs:
+                install_default_properties()
+                docs = list(mongo.db.properties.find())
+            previous = self._properties or {}
+            properties = {}
+            for doc in docs:
+                current = previous.get(doc['_id'])
+                # Keep the warm caches unless the catalog itself changed
+                if current is not None and current.same_catalog(doc):
+                    current.update(doc)
+                    properties[doc['_id']] = current
+                else:
+                    properties[doc['_id']] = Property(doc)
+            self._hosts = {host: p for p in properties.values() for host in p.hosts}
+            self._properties = properties
+            self._loaded_at = time.monotonic()
+
+    def get(self, code):
+        self._ensure()
+        return self._properties.get(code)
+
+    def by_host(self, host):
+        self._ensure()
+        return self._hosts.get(host.lower())
+
+    def all(self):
+        self._ensure()
+        return sorted(self._properties.values(), key=lambda p: p.code)
+
+    def default(self):
+        prop = self.get(self.default_code)
+        if prop is None:
+            raise RuntimeError(f'Default property {self.default_code!r} is not in the properties collection')
+        return prop
+
+
+properties = PropertyRegistry()
+
+
+def install_default_properties():
+    for doc in DEFAULT_PROPERTIES:
+        mongo.db.properties.update_one({'_id': doc['_id']}, {'$setOnInsert': doc}, upsert=True)
+
+
+def save_property(code, name=None, address=None, hosts=None, room_types=None, menu=None):
+    """Creates or updates a property; a new one copies the default catalog unless one is given."""
+    existing = mongo.db.properties.find_one({'_id': code}) or {}
+    base = properties.get(properties.default_code) if not existing else None
+    doc = {
+        'name': name or existing.get('name') or code,
+        'address': address if address is not None else existing.get('address', ''),
+        'hosts': [h.lower() for h in hosts] if hosts is not None else existing.get('hosts', []),
+        'room_types': room_types or existing.get('room_types') or (base.room_types if base else DEFAULT_ROOM_TYPES),
+        'menu': menu or existing.get('menu') or (base.menu if base else DEFAULT_MENU),
+        'updated_at': datetime.datetime.now(datetime.timezone.utc),
+    }
+    mongo.db.properties.update_one({'_id': code}, {'$set': doc}, upsert=True)
+    properties.invalidate()
+
+
+# --- Per-request resolution ---
+class PropertyPathMiddleware:
+    """WSGI middleware: /p/<code>/rest -> SCRIPT_NAME .../p/<code>, PATH_INFO /rest."""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        match = PATH_PREFIX_RE.match(environ.get('PATH_INFO', ''))
+        if match:
+            code, rest = match.groups()
+            environ[ENVIRON_KEY] = code
+            environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + f'/p/{code}'
+            environ['PATH_INFO'] = rest or '/'
+        return self.wsgi_app(environ, start_response)
+
+
+def resolve_property():
+    """before_request: pick the request's property (path prefix, then host, then default)."""
+    code = request.environ.get(ENVIRON_KEY)
+    if code:
+        prop = properties.get(code)
+        if prop is None:
+            abort(404)
+    else:
+        prop = properties.by_host(request.host.rsplit(':', 1)[0]) or properties.default()
+    g.property = prop
+
+
+def current_property():
+    """The request's property; the default one outside requests (CLI, threads)."""
+    if has_request_context():
+        prop = g.get('property')
+        if prop is None:
+            resolve_property()
+            prop = g.property
+        return prop
+    return properties.default()
+
+
+def scoped(query=None, **fields):
+    """`query` restricted to the current property."""
+    return current_property().scoped(query, **fields)
+
+
+def init_properties(app):
+    properties.default_code = app.config.get('DEFAULT_PROPERTY') or DEFAULT_PROPERTY
+    app.wsgi_app = PropertyPathMiddleware(app.wsgi_app)
+    app.before_request(resolve_property)
+
+    @app.context_processor
+    def inject_property():
+        return {'current_property': current_property()}
+
+
+# --- Migration: stamp single-property data with the default code ---
+def migrate_property_codes(db, code, batch_size=5000, echo=None):
+    """Sets `property` on documents that lack it, in _id-ordered batches, hot and archived."""
+    from utils.archive import archive_name
+    total = 0
+    names = SCOPED_COLLECTIONS + [archive_name(n) for n in ('bookings', 'food_orders', 'payments')]
+    for name in names:
+        last_id, migrated = None, 0
+        while True:
+            id_filter = {'_id': {'$gt': last_id}} if last_id is not None else {}
+            ids = [d['_id'] for d in db[name].find(id_filter, {'_id': 1}).sort('_id', 1).limit(batch_size)]
+            if not ids:
+                break
+            result = db[name].update_many(
+                {'_id': {'$gte': ids[0], '$lte': ids[-1]}, 'property': {'$exists': False}},
+                {'$set': {'property': code}})
+            migrated += result.modified_count
+            last_id = ids[-1]
+        db.migrations.update_one({'_id': MIGRATION_ID},
+                                 {'$set': {name: migrated, 'updated_at': datetime.datetime.now(datetime.timezone.utc)}},
+                                 upsert=True)
+        if echo:
+            echo(f'{name:20} {migrated:>10,} stamped {code}')
+        total += migrated
+    return total
+
+
+@click.command('migrate-properties')
+@click.option('--property', 'code', default=None, help='Code to stamp (default DEFAULT_PROPERTY).')
+@click.option('--batch-size', default=5000, show_default=True)
+@with_appcontext
+def migrate_properties_command(code, batch_size):
+    """Tag existing bookings, food orders, payments, reviews and contacts with a property."""
+    code = code or current_app.config.get('DEFAULT_PROPERTY') or DEFAULT_PROPERTY
+    install_default_properties()
+    total = migrate_property_codes(mongo.db, code, batch_size, echo=click.echo)
+    click.echo(f'Done: {total:,} documents stamped.')
+
+
+@click.group('properties')
+def properties_cli():
+    """Manage hotel properties."""
+
+
+@properties_cli.command('list')
+@with_appcontext
+def list_command():
+    """Show every property with its hosts and catalog size."""
+    for prop in properties.all():
+        click.echo(f"{prop.code:8} {prop.name:32} rooms {sum(r.get('rooms', 1) for r in prop.room_types.values()):>5}  "
+                   f"menu {sum(len(items) for items in prop.menu.values()):>3}  hosts {', '.join(prop.hosts) or '-'}")
+
+
+@properties_cli.command('set')
+@click.argument('code')
+@click.option('--name', help='Display name (invoices, page titles).')
+@click.option('--address', help='Address line printed on invoices.')
+@click.option('--host', 'hosts', multiple=True, help='Host name served as this property (repeatable).')
+@click.option('--catalog', type=click.File('r'), help='JSON with "room_types" and/or "menu".')
+@with_appcontext
+def set_command(code, name, address, hosts, catalog):
+    """Create or update CODE (a new property copies the default catalog)."""
+    if not re.fullmatch(r'[a-z0-9-]+', code):
+        raise click.ClickException('Property codes are lowercase letters, digits and dashes.')
+    data = json.load(catalog) if catalog else {}
+    save_property(code, name, address, list(hosts) if hosts else None, data.get('room_types'), data.get('menu'))
+    click.echo(f'Saved {code}')
@@ -0,0 +1,132 @@
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import current_app, g, has_request_context, request
+from pymongo import monitoring
+
+# --- Request-scoped Mongo query recorder ---
+# Enabled with QUERY_RECORDER = 'log' (staging: warn) or 'raise' (tests: fail).
+# Every command a request sends is recorded as (command, collection, shape),
+# where the shape is the filter/pipeline with all literal values replaced by
+# '?'. At the end of the request the total is checked against the budget the
+# view declared with @query_budget(n), and shapes seen more than once are
+# reported as likely N+1 loops.
+
+# Driver/session housekeeping that is not a query round trip the view asked for
+IGNORED_COMMANDS = {'hello', 'ismaster', 'isMaster', 'ping', 'endSessions', 'saslStart',
+                    'saslContinue', 'authenticate', 'buildinfo', 'buildInfo', 'killCursors'}
+
+
+class QueryBudgetExceeded(Exception):
+    """A request used more Mongo round trips than its view allows, or repeated a query shape."""
+
+
+def query_budget(max_round_trips, allow_repeats=False):
+    """Declares the maximum number of Mongo round trips a view may make."""
+    def decorator(f):
+        f.query_budget = max_round_trips
+        f.query_allow_repeats = allow_repeats
+        return f
+    return decorator
+
+
+def _shape(value):
+    if isinstance(value, dict):
+        return '{' + ', '.join(f'{k}: {_shape(v)}' for k, v in sorted(value.items())) + '}'
+    if isinstance(value, (list, tuple)):
+        if all(not isinstance(v, (dict, list, tuple)) for v in value):
+            return '[?]'
+        return '[' + ', '.join(_shape(v) for v in value) + ']'
+    return '?'
+
+
+def query_shape(command_name, command):
+    """Collection and literal-free shape of a command document."""
+    if command_name == 'getMore':
+        return command.get('collection'), 'cursor'
+    collection = command.get(command_name)
+    if command_name == 'find':
+        return collection, _shape(command.get('filter', {}))
+    if command_name == 'aggregate':
+        return collection, _shape(command.get('pipeline', []))
+    if command_name in ('count', 'distinct'):
+        return collection, _shape(command.get('query', {}))
+    if command_name == 'findAndModify':
+        return collection, _shape(command.get('query', {}))
+    if command_name == 'update':
+        return collection, _shape([u.get('q', {}) for u in command.get('updates', [])])
+    if command_name == 'delete':
+        return collection, _shape([d.get('q', {}) for d in command.get('deletes', [])])
+    return collection, ''
+
+
+class QueryRecorder(monitoring.CommandListener):
+    """Appends each command to g.query_log while a recording is active."""
+
+    def started(self, event):
+        if event.command_name in IGNORED_COMMANDS or not has_request_context():
+            return
+        log = g.get('query_log')
+        if log is not None:
+            collection, shape = query_shape(event.command_name, event.command)
+            log.append((event.command_name, collection, shape))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+query_recorder = QueryRecorder()
+
+
+def repeated_shapes(query_log):
+    """Query shapes issued more than once (getMore batches are not counted)."""
+    counts = Counter(q for q in query_log if q[0] != 'getMore')
+    return {q: n for q, n in counts.items() if n > 1}
+
+
+@contextmanager
+def record_queries():
+    """Records Mongo commands inside the block, e.g. in a test_request_context."""
+    previous = g.get('query_log')
+    g.query_log = []
+    try:
+        yield g.query_log
+    finally:
+        g.query_log = previous
+
+
+# --- Flask wiring ---
+def _start_recording():
+    g.query_log = []
+
+
+def _check_budget(response):
+    query_log = g.pop('query_log', None)
+    view = current_app.view_functions.get(request.endpoint)
+    if query_log is None or view is None:
+        return response
+
+    problems = []
+    budget = getattr(view, 'query_budget', None)
+    if budget is not None and len(query_log) > budget:
+        problems.append(f'{len(query_log)} Mongo round trips, budget is {budget}')
+    if not getattr(view, 'query_allow_repeats', False):
+        for (command, collection, shape), count in repeated_shapes(query_log).items():
+            problems.append(f'possible N+1: {command} on {collection} {shape} ran {count} times')
+
+    if problems:
+        message = f'{request.endpoint}: ' + '; '.join(problems)
+        if current_app.config.get('QUERY_RECORDER') == 'raise':
+            raise QueryBudgetExceeded(message)
+        current_app.logger.warning(message)
+    return response
+
+
+def init_query_recorder(app):
+    """Turns the recorder on when QUERY_RECORDER is 'log' or 'raise'."""
+    if app.config.get('QUERY_RECORDER') in ('log', 'raise'):
+        app.before_request(_start_recording)
+        app.after_request(_check_budget)
@@ -0,0 +1,221 @@
+import datetime
+import json
+
+import click
+from bson import json_util
+from flask.cli import with_appcontext
+
+from utils.archive import archive_name
+from utils.db import mongo, analytics_db
+
+# --- Payment reconciliation ---
+# process_payment inserts the payment and then flips payment_status on its
+# bookings and food orders with two separate update_many calls; either can
+# fail after the payment is stored. This job checks, in one streamed pass:
+#
+#   unpaid_items   items a successful payment references that are not 'paid'
+#   missing_items  referenced ids that exist in neither the hot nor archive collection
+#   amount_drift   original_amount != sum of the items' total_cost, or
+#                  amount != original_amount - discount_applied
+#   orphaned_paid  'paid' bookings / food orders no successful payment references
+#
+# All joins run server-side ($lookup on booking_id / order_id, which are
+# indexed) and only mismatching rows leave the server, read through batched
+# cursors, so memory stays flat however many payments there are. The report
+# runs against analytics_db(); repairs are written to the primary.
+# localField/foreignField with a sub-pipeline needs MongoDB 5.0+.
+
+AMOUNT_TOLERANCE = 0.01
+
+ITEM_KINDS = {
+    # kind -> (collection, id field, payment field)
+    'booking': ('bookings', 'booking_id', 'booking_ids'),
+    'food_order': ('food_orders', 'order_id', 'food_order_ids'),
+}
+
+
+def _item_lookups(collection, id_field, payment_field, as_field):
+    """$lookup of a payment's items in the hot collection and its archive, merged into `as_field`."""
+    projection = {'$project': {'_id': 0, id_field: 1, 'payment_status': 1, 'total_cost': 1}}
+    hot, cold = f'_{as_field}_hot', f'_{as_field}_cold'
+    return [
+        {'$lookup': {'from': collection, 'localField': payment_field, 'foreignField': id_field,
+                     'pipeline': [projection], 'as': hot}},
+        {'$lookup': {'from': archive_name(collection), 'localField': payment_field, 'foreignField': id_field,
+                     'pipeline': [projection], 'as': cold}},
+        {'$set': {as_field: {'$concatArrays': [f'${hot}', f'${cold}']}}},
+        {'$unset': [hot, cold]},
+    ]
+
+
+def payment_mismatch_pipeline(since=None):
+    """Successful payments whose items or amounts do not line up, with the reasons."""
+    match = {'status': 'success'}
+    if since:
+        match['created_at'] = {'$gte': since}
+    pipeline = [
+        {'$match': match},
+        {'$project': {'order_id': 1, 'user_email': 1, 'amount': 1, 'original_amount': 1,
+                      'discount_applied': 1, 'created_at': 1,
+                      'booking_ids': {'$ifNull': ['$booking_ids', []]},
+                      'food_order_ids': {'$ifNull': ['$food_order_ids', []]}}},
+    ]
+    pipeline += _item_lookups('bookings', 'booking_id', 'booking_ids', 'bookings')
+    pipeline += _item_lookups('food_orders', 'order_id', 'food_order_ids', 'food_orders')
+    pipeline += [
+        {'$project': {
+            'order_id': 1, 'user_email': 1, 'amount': 1, 'original_amount': 1,
+            'discount_applied': 1, 'created_at': 1,
+            'unpaid_bookings': {'$map': {
+                'input': {'$filter': {'input': '$bookings', 'cond': {'$ne': ['$$this.payment_status', 'paid']}}},
+                'in': '$$this.booking_id'}},
+            'unpaid_food_orders': {'$map': {
+                'input': {'$filter': {'input': '$food_orders', 'cond': {'$ne': ['$$this.payment_status', 'paid']}}},
+                'in': '$$this.order_id'}},
+            'missing_bookings': {'$setDifference': ['$booking_ids', '$bookings.booking_id']},
+            'missing_food_orders': {'$setDifference': ['$food_order_ids', '$food_orders.order_id']},
+            'items_total': {'$add': [{'$sum': '$bookings.total_cost'}, {'$sum': '$food_orders.total_cost'}]},
+        }},
+        {'$set': {
+            'item_drift': {'$subtract': [{'$ifNull': ['$original_amount', 0]}, '$items_total']},
+            'discount_drift': {'$subtract': [
+                {'$ifNull': ['$amount', 0]},
+                {'$subtract': [{'$ifNull': ['$original_amount', 0]}, {'$ifNull': ['$discount_applied', 0]}]}
+            ]},
+        }},
+        {'$match': {'$or': [
+            {'unpaid_bookings.0': {'$exists': True}},
+            {'unpaid_food_orders.0': {'$exists': True}},
+            {'missing_bookings.0': {'$exists': True}},
+            {'missing_food_orders.0': {'$exists': True}},
+            # Missing items legitimately make the item total short; only flag drift when all were found
+            {'$expr': {'$and': [
+                {'$eq': [{'$size': '$missing_bookings'}, 0]},
+                {'$eq': [{'$size': '$missing_food_orders'}, 0]},
+                {'$gt': [{'$abs': '$item_drift'}, AMOUNT_TOLERANCE]},
+            ]}},
+            {'$expr': {'$gt': [{'$abs': '$discount_drift'}, AMOUNT_TOLERANCE]}},
+        ]}},
+    ]
+    return pipeline
+
+
+def orphaned_paid_pipeline(kind):
+    """'paid' items of `kind` that no successful payment (hot or archived) references."""
+    collection, id_field, payment_field = ITEM_KINDS[kind]
+    referenced_by = [{'$match': {'status': 'success'}}, {'$project': {'_id': 1}}, {'$limit': 1}]
+    return [
+        {'$match': {'payment_status': 'paid'}},
+        {'$project': {id_field: 1, 'user_email': 1, 'total_cost': 1, 'created_at': 1}},
+        {'$lookup': {'from': 'payments', 'localField': id_field, 'foreignField': payment_field,
+                     'pipeline': referenced_by, 'as': '_paid_by'}},
+        {'$match': {'_paid_by': {'$size': 0}}},
+        {'$lookup': {'from': archive_name('payments'), 'localField': id_field, 'foreignField': payment_field,
+                     'pipeline': referenced_by, 'as': '_paid_by'}},
+        {'$match': {'_paid_by': {'$size': 0}}},
+        {'$unset': '_paid_by'},
+    ]
+
+
+class _Repairer:
+    """Buffers ids and applies payment_status updates with one update_many per batch."""
+
+    def __init__(self, db, batch_size):
+        self.db = db
+        self.batch_size = batch_size
+        self.pending = {}
+        self.repaired = 0
+
+    def add(self, kind, status, ids):
+        bucket = self.pending.setdefault((kind, status), [])
+        bucket.extend(ids)
+        if len(bucket) >= self.batch_size:
+            self.flush(kind, status)
+
+    def flush(self, kind=None, status=None):
+        keys = [(kind, status)] if kind else list(self.pending)
+        for key in keys:
+            ids = self.pending.pop(key, [])
+            if not ids:
+                continue
+            item_kind, new_status = key
+            collection, id_field, payment_field = ITEM_KINDS[item_kind]
+            if new_status == 'unpaid':
+                # Re-check orphans on the primary: the report may have read a lagging secondary
+                ids = set(ids) - set(self.db.payments.distinct(
+                    payment_field, {payment_field: {'$in': ids}, 'status': 'success'}))
+                ids = list(ids)
+            if ids:
+                result = self.db[collection].update_many(
+                    {id_field: {'$in': ids}}, {'$set': {'payment_status': new_status}})
+                self.repaired += result.modified_count
+
+
+def reconcile_payments(since=None, batch_size=1000, repair=False, repair_orphans=False, sink=None):
+    """
+    Streams every finding to `sink(kind, doc)` and returns counts per kind.
+    `repair` marks referenced-but-unpaid items paid; `repair_orphans` marks
+    orphaned paid items unpaid. Amount drift is only reported.
+    """
+    reader = analytics_db()
+    repairer = _Repairer(mongo.db, batch_size) if (repair or repair_orphans) else None
+    counts = {'payments_checked': 0, 'unpaid_items': 0, 'missing_items': 0,
+              'amount_drift': 0, 'orphaned_paid': 0, 'repaired': 0}
+
+    match = {'status': 'success'}
+    if since:
+        match['created_at'] = {'$gte': since}
+    counts['payments_checked'] = reader.payments.count_documents(match)
+
+    cursor = reader.payments.aggregate(payment_mismatch_pipeline(since), allowDiskUse=True,
+                                       batchSize=batch_size)
+    for row in cursor:
+        unpaid = row['unpaid_bookings'] + row['unpaid_food_orders']
+        missing = row['missing_bookings'] + row['missing_food_orders']
+        counts['unpaid_items'] += len(unpaid)
+        counts['missing_items'] += len(missing)
+        if (not missing and abs(row['item_drift']) > AMOUNT_TOLERANCE) or abs(row['discount_drift']) > AMOUNT_TOLERANCE:
+            counts['amount_drift'] += 1
+        if sink:
+            sink('payment', row)
+        if repair:
+            if row['unpaid_bookings']:
+                repairer.add('booking', 'paid', row['unpaid_bookings'])
+            if row['unpaid_food_orders']:
+                repairer.add('food_order', 'paid', row['unpaid_food_orders'])
+
+    for kind, (collection, id_field, _) in ITEM_KINDS.items():
+        cursor = reader[collection].aggregate(orphaned_paid_pipeline(kind), allowDiskUse=True,
+                                              batchSize=batch_size)
+        for row in cursor:
+            counts['orphaned_paid'] += 1
+            if sink:
+                sink(f'orphaned_{kind}', row)
+            if repair_orphans:
+                repairer.add(kind, 'unpaid', [row[id_field]])
+
+    if repairer:
+        repairer.flush()
+        counts['repaired'] = repairer.repaired
+    return counts
+
+
+@click.command('reconcile-payments')
+@click.option('--since', default=None, help='Only payments created on/after this date (YYYY-MM-DD).')
+@click.option('--batch-size', default=1000, show_default=True, help='Cursor batch and repair batch size.')
+@click.option('--repair', is_flag=True, help='Mark items referenced by a successful payment as paid.')
+@click.option('--repair-orphans', is_flag=True, help='Mark paid items no payment references as unpaid.')
+@click.option('--report', 'report_file', type=click.File('w'), help='Write every finding as NDJSON.')
+@with_appcontext
+def reconcile_payments_command(since, batch_size, repair, repair_orphans, report_file):
+    """Check payments against booking / food order payment flags and amounts."""
+    if since:
+        since = datetime.datetime.strptime(since, '%Y-%m-%d').replace(tzinfo=datetime.timezone.utc)
+
+    def sink(kind, doc):
+        if report_file:
+            report_file.write(json.dumps({'kind': kind, **doc}, default=json_util.default) + '\n')
+
+    counts = reconcile_payments(since, batch_size, repair, repair_orphans, sink)
+    for name, value in counts.items():
+        click.echo(f'{name:17} {value:>12,}')
@@ -0,0 +1,278 @@
+import datetime
+import random
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from pymongo import MongoClient
+from werkzeug.security import generate_password_hash
+
+from utils.db import mongo
+from utils.promos import DEFAULT_PROMOS
+from utils.properties import DEFAULT_ROOM_TYPES as room_types, DEFAULT_MENU as menu
+
+# --- Synthetic data generator ---
+# Bulk-loads users, bookings, food_orders, payments and reviews with the same
+# document shapes the routes write (auth.register, booking.rooms, food.order,
+# payment.process_payment, main.reviews). Users are generated in chunks; every
+# chunk gets its own RNG derived from (seed, chunk index), so the output is
+# identical no matter how many workers run or in which order chunks finish.
+# Stays, orders, payments and reviews belong to one property (--property,
+# default DEFAULT_PROPERTY) and use the default room/menu catalog.
+
+SEED_PASSWORD = 'bombaat123'
+PAYMENT_METHODS = ['Card', 'UPI', 'Net Banking', 'Wallet']
+REVIEW_TYPES = ['Overall', 'Rooms', 'Food', 'Service']
+REVIEW_COMMENTS = [
+    'Lovely stay, the staff were very helpful.',
+    'Rooms were clean and spacious.',
+    'The masala dosa at breakfast was excellent!',
+    'Great location near the Indiranagar metro.',
+    'Check-in took a while but overall a good experience.',
+    'Room service was slow on the weekend.',
+    'Pool on the terrace is a must-try.',
+    'Good value for money.',
+]
+FIRST_NAMES = ['aarav', 'diya', 'rohan', 'ananya', 'vikram', 'meera', 'arjun', 'kavya',
+               'rahul', 'sneha', 'karthik', 'pooja', 'nikhil', 'divya', 'suresh', 'lakshmi']
+
+# Bengaluru demand: peak Oct-Jan, holiday bump in May, monsoon dip Jun-Sep.
+MONTH_WEIGHTS = {1: 1.4, 2: 1.1, 3: 1.0, 4: 1.1, 5: 1.3, 6: 0.7,
+                 7: 0.6, 8: 0.7, 9: 0.8, 10: 1.3, 11: 1.5, 12: 1.7}
+WEEKEND_BOOST = 1.35
+# Cheaper rooms are booked far more often than suites.
+ROOM_WEIGHTS = {'Standard Single': 30, 'Standard Double': 35, 'Deluxe Double': 20,
+                'Suite': 10, 'Presidential Suite': 5}
+ROOM_MAX_GUESTS = {'Standard Single': 1, 'Standard Double': 2, 'Deluxe Double': 3,
+                   'Suite': 4, 'Presidential Suite': 6}
+STAY_NIGHTS = [1, 2, 3, 4, 5, 7, 10, 14]
+STAY_WEIGHTS = [30, 28, 18, 9, 6, 5, 3, 1]
+
+HISTORY_DAYS = 730
+FUTURE_DAYS = 180
+MAX_BOOKINGS_PER_USER = 250
+
+
+def _checkin_calendar(today):
+    """Candidate check-in dates with cumulative seasonal weights."""
+    dates, cum_weights, total = [], [], 0.0
+    for offset in range(-HISTORY_DAYS, FUTURE_DAYS):
+        day = today + datetime.timedelta(days=offset)
+        weight = MONTH_WEIGHTS[day.month]
+        if day.weekday() >= 4:
+            weight *= WEEKEND_BOOST
+        total += weight
+        dates.append(day)
+        cum_weights.append(total)
+    return dates, cum_weights
+
+
+def _utc(day, rng, start_hour=0, end_hour=23):
+    return datetime.datetime(day.year, day.month, day.day,
+                             rng.randint(start_hour, end_hour), rng.randint(0, 59),
+                             rng.randint(0, 59), tzinfo=datetime.timezone.utc)
+
+
+def _hex(rng, length=32):
+    return uuid.UUID(int=rng.getrandbits(128)).hex[:length]
+
+
+def _bookings_for_user(rng):
+    """Heavy-tailed booking count: most guests book once or never, a few book a lot."""
+    if rng.random() < 0.3:
+        return 0
+    return min(int(rng.paretovariate(1.3)), MAX_BOOKINGS_PER_USER)
+
+
+def generate_chunk(seed, chunk_index, user_start, user_count, today, password_hash, property_code):
+    """
+    Builds every document for users [user_start, user_start + user_count).
+    Returns a dict of collection name -> list of documents.
+    """
+    rng = random.Random(f'{seed}:{chunk_index}')
+    dates, cum_weights = _checkin_calendar(today)
+    room_names = list(ROOM_WEIGHTS)
+    room_cum = []
+    running = 0
+    for name in room_names:
+        running += ROOM_WEIGHTS[name]
+        room_cum.append(running)
+    menu_items = [item for items in menu.values() for item in items]
+    promo_codes = list(DEFAULT_PROMOS)
+
+    docs = {'users': [], 'bookings': [], 'food_orders': [], 'payments': [], 'reviews': []}
+
+    for n in range(user_start, user_start + user_count):
+        username = f'{rng.choice(FIRST_NAMES)}{n}'
+        email = f'{username}@example.com'
+        joined = dates[0] - datetime.timedelta(days=rng.randint(0, 365))
+        user_doc = {
+            'email': email,
+            'username': username,
+            'password': password_hash,
+            'phone': f'9{rng.randint(100000000, 999999999)}',
+            'created_at': _utc(joined, rng),
+        }
+        loyalty_points = 0
+
+        for _ in range(_bookings_for_user(rng)):
+            check_in = rng.choices(dates, cum_weights=cum_weights)[0]
+            nights = rng.choices(STAY_NIGHTS, weights=STAY_WEIGHTS)[0]
+            check_out = check_in + datetime.timedelta(days=nights)
+            room_type = rng.choices(room_names, cum_weights=room_cum)[0]
+            lead_days = rng.randint(0, 60)
+            booked_on = max(check_in - datetime.timedelta(days=lead_days), joined)
+            in_past = check_out <= today
+            cancelled = rng.random() < 0.08
+            if cancelled:
+                paid = rng.random() < 0.1
+            else:
+                paid = rng.random() < (0.95 if in_past else 0.4)
+
+            booking_doc = {
+                'property': property_code,
+                'user_email': email,
+                'booking_id': _hex(rng),
+                'room_type': room_type,
+                'room_number': rng.randint(101, 250),
+                'check_in': check_in.strftime('%Y-%m-%d'),
+                'check_out': check_out.strftime('%Y-%m-%d'),
+                'check_in_day': check_in.toordinal(),
+                'check_out_day': check_out.toordinal(),
+                'guests': rng.randint(1, ROOM_MAX_GUESTS[room_type]),
+                'total_cost': float(nights * room_types[room_type]['price']),
+                'status': 'cancelled' if cancelled else 'active',
+                'payment_status': 'paid' if paid else 'unpaid',
+                'created_at': _utc(booked_on, rng),
+            }
+            docs['bookings'].append(booking_doc)
+
+            food_orders = []
+            if not cancelled and check_in <= today:
+                for _ in range(min(int(rng.expovariate(0.7)), 6)):
+                    items = []
+                    for item in rng.sample(menu_items, rng.randint(1, 4)):
+                        items.append({'name': item['name'], 'price': float(item['price']),
+                                      'quantity': rng.randint(1, 3)})
+                    ordered_on = check_in + datetime.timedelta(days=rng.randint(0, nights - 1))
+                    food_orders.append({
+                        'property': property_code,
+                        'user_email': email,
+                        'order_id': _hex(rng),
+                        'items': items,
+                        'total_cost': round(sum(i['price'] * i['quantity'] for i in items), 2),
+                        'room_number': booking_doc['room_number'],
+                        'payment_status': 'paid' if paid else 'unpaid',
+                        'created_at': _utc(ordered_on, rng, 7, 23),
+                    })
+                docs['food_orders'].extend(food_orders)
+
+            if paid:
+                original = booking_doc['total_cost'] + sum(f['total_cost'] for f in food_orders)
+                promo_code = rng.choice(promo_codes) if rng.random() < 0.25 else ''
+                discount = (original * DEFAULT_PROMOS[promo_code]) / 100 if promo_code else 0
+                amount = original - discount
+                paid_on = check_out if in_past else booked_on
+                docs['payments'].append({
+                    'property': property_code,
+                    'user_email': email,
+                    'payment_id': _hex(rng),
+                    'order_id': f'PAY-{_hex(rng, 8).upper()}',
+                    'amount': amount,
+                    'original_amount': original,
+                    'discount_applied': discount,
+                    'promo_code': promo_code,
+                    'payment_method': rng.choice(PAYMENT_METHODS),
+                    'booking_ids': [booking_doc['booking_id']],
+                    'food_order_ids': [f['order_id'] for f in food_orders],
+                    'status': 'success',
+                    'created_at': _utc(min(paid_on, today), rng),
+                })
+                loyalty_points += int(amount / 100)
+
+                if in_past and rng.random() < 0.15:
+                    docs['reviews'].append({
+                        'property': property_code,
+                        'user_email': email,
+                        'username': username,
+                        'rating': rng.choices([1, 2, 3, 4, 5], weights=[3, 5, 15, 37, 40])[0],
+                        'review_type': rng.choice(REVIEW_TYPES),
+                        'comment': rng.choice(REVIEW_COMMENTS),
+                        'image_file': None,
+                        'created_at': _utc(min(check_out + datetime.timedelta(days=rng.randint(0, 7)), today), rng),
+                    })
+
+        if loyalty_points:
+            user_doc['loyalty_points'] = loyalty_points
+        docs['users'].append(user_doc)
+
+    return docs
+
+
+def _load_chunk(mongo_uri, db_name, seed, chunk_index, user_start, user_count, today,
+                password_hash, batch_size, property_code):
+    """Pool worker: generate one chunk and write it with batched insert_many."""
+    docs = generate_chunk(seed, chunk_index, user_start, user_count, today, password_hash, property_code)
+    client = MongoClient(mongo_uri)
+    try:
+        db = client[db_name]
+        counts = {}
+        for name, collection_docs in docs.items():
+            for i in range(0, len(collection_docs), batch_size):
+                db[name].insert_many(collection_docs[i:i + batch_size], ordered=False)
+            counts[name] = len(collection_docs)
+        return counts
+    finally:
+        client.close()
+
+
+@click.command('seed-data')
+@click.option('--users', default=10000, show_default=True, help='Number of guests to generate.')
+@click.option('--seed', default=42, show_default=True, help='RNG seed; same seed gives the same data.')
+@click.option('--workers', default=4, show_default=True, help='Worker processes.')
+@click.option('--chunk-size', default=5000, show_default=True, help='Users per worker task.')
+@click.option('--batch-size', default=5000, show_default=True, help='Documents per insert_many.')
+@click.option('--today', default=None, help='Anchor date (YYYY-MM-DD) for past/future stays.')
+@click.option('--drop', is_flag=True, help='Drop the five collections before loading.')
+@click.option('--property', 'property_code', default=None, help='Property code (default: DEFAULT_PROPERTY).')
+@with_appcontext
+def seed_data_command(users, seed, workers, chunk_size, batch_size, today, drop, property_code):
+    """Load synthetic guests, bookings, food orders, payments and reviews."""
+    if today:
+        anchor = datetime.datetime.strptime(today, '%Y-%m-%d').date()
+    else:
+        anchor = datetime.date.today()
+
+    db_name = mongo.db.name
+    if drop:
+        for name in ('users', 'bookings', 'food_orders', 'payments', 'reviews'):
+            mongo.db.drop_collection(name)
+
+    # One hash for every synthetic guest: hashing millions of passwords would
+    # dominate the run, and they can all log in with SEED_PASSWORD.
+    password_hash = generate_password_hash(SEED_PASSWORD)
+    mongo_uri = current_app.config['MONGO_URI']
+    property_code = property_code or current_app.config['DEFAULT_PROPERTY']
+
+    totals = {}
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        for chunk_index, user_start in enumerate(range(0, users, chunk_size)):
+            futures.append(pool.submit(
+                _load_chunk, mongo_uri, db_name, seed, chunk_index, user_start,
+                min(chunk_size, users - user_start), anchor, password_hash, batch_size, property_code
+            ))
+        for future in as_completed(futures):
+            for name, count in future.result().items():
+                totals[name] = totals.get(name, 0) + count
+
+    elapsed = time.perf_counter() - started
+    total_docs = sum(totals.values())
+    for name in sorted(totals):
+        click.echo(f'{name:12} {totals[name]:>12,}')
+    click.echo(f'Loaded {total_docs:,} documents in {elapsed:.1f}s '
+               f'({total_docs / max(elapsed, 1e-9):,.0f} docs/s).')
@@ -0,0 +1,109 @@
+import importlib.util
+import os
+import re
+import subprocess
+import sys
+
+import click
+from flask.cli import with_appcontext
+from jinja2 import FileSystemBytecodeCache
+
+# --- Cold start ---
+# What a fresh worker pays before its first request: importing app.py and
+# running create_app. Heavy libraries that only some requests need are
+# imported on first use -- NumPy (occupancy / pricing) through lazy_import,
+# ReportLab inside download_invoice, eventlet only when the profiler is on.
+# Compiled templates are kept in a FileSystemBytecodeCache (JINJA_CACHE_DIR,
+# default instance/jinja_cache) that every worker on the host shares; run
+# `flask precompile-templates` at build time to fill it so no worker compiles
+# a template. `flask startup-report` measures the boot with
+# `python -X importtime` and fails when it exceeds STARTUP_BUDGET_MS.
+#
+# flask_mail (~10 ms) stays eager: Mail.init_app runs inside create_app.
+# bson is part of pymongo, which the app needs to boot at all.
+
+STARTUP_BUDGET_MS = 500
+BOOT_SNIPPET = ('import time; started = time.perf_counter(); '
+                'from app import create_app; create_app(); '
+                'print(round((time.perf_counter() - started) * 1000, 1))')
+IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def lazy_import(name):
+    """Module whose real import happens on first attribute access (importlib.util.LazyLoader)."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def init_template_cache(app):
+    """Shares compiled templates between workers through a bytecode cache directory."""
+    directory = app.config.get('JINJA_CACHE_DIR') or os.path.join(app.instance_path, 'jinja_cache')
+    os.makedirs(directory, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+
+def parse_importtime(stderr):
+    """[(module, self_us, cumulative_us, depth)] from `python -X importtime` output."""
+    rows = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+    return rows
+
+
+def measure_startup(snippet=BOOT_SNIPPET, cwd=None):
+    """Boots the app in a fresh interpreter; returns (boot ms incl. create_app, importtime rows)."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', snippet],
+                            capture_output=True, text=True, cwd=cwd, env=dict(os.environ))
+    if result.returncode != 0:
+        raise click.ClickException(f'Boot failed:\n{result.stderr[-2000:]}')
+    return float(result.stdout.strip().splitlines()[-1]), parse_importtime(result.stderr)
+
+
+@click.command('precompile-templates')
+@with_appcontext
+def precompile_templates_command():
+    """Compile every template into the Jinja bytecode cache (run at build time)."""
+    from flask import current_app
+    env = current_app.jinja_env
+    names = env.list_templates(filter_func=lambda name: name.endswith('.html'))
+    for name in names:
+        env.get_template(name)
+    click.echo(f'Compiled {len(names)} templates into {env.bytecode_cache.directory}')
+
+
+@click.command('startup-report')
+@click.option('--budget-ms', default=None, type=float,
+              help=f'Fail when booting takes longer (default STARTUP_BUDGET_MS={STARTUP_BUDGET_MS}).')
+@click.option('--top', default=15, show_default=True, help='Slowest top-level imports to list.')
+@with_appcontext
+def startup_report_command(budget_ms, top):
+    """Measure worker boot with `python -X importtime` and check it against the budget."""
+    from flask import current_app
+    if budget_ms is None:
+        budget_ms = current_app.config.get('STARTUP_BUDGET_MS', STARTUP_BUDGET_MS)
+    total_ms, rows = measure_startup(cwd=current_app.root_path)
+
+    # Packages pulled in directly by app.py or its first-level imports
+    shallow = [r for r in rows if r[3] <= 1]
+    shallow.sort(key=lambda r: r[2], reverse=True)
+    click.echo(f"{'module':40} {'cumulative ms':>14}")
+    for module, _, cumulative, depth in shallow[:top]:
+        click.echo(f"{'  ' * depth + module:40} {cumulative / 1000:>14.1f}")
+    for heavy in ('numpy', 'reportlab', 'eventlet'):
+        if any(r[0] == heavy for r in rows):
+            click.echo(f'warning: {heavy} is imported at boot')
+
+    click.echo(f'boot (imports + create_app) {total_ms:.0f} ms, budget {budget_ms:.0f} ms '
+               '(importtime itself adds some overhead)')
+    if total_ms > budget_ms:
+        raise click.ClickException('Startup budget exceeded.')
@@ -0,0 +1,114 @@
+import datetime
+
+import click
+from flask.cli import with_appcontext
+
+from utils.db import mongo
+
+# --- Stay dates as day ordinals ---
+# Bookings keep check_in/check_out as 'YYYY-MM-DD' strings for display, plus
+# check_in_day/check_out_day as integer day ordinals (date.toordinal()). The
+# integers sort and compare natively, so "overlaps [a, b)" is a single index
+# range query and hot loops can use range() instead of strptime.
+#
+# Upgrade step (required): run `flask migrate-booking-dates` before deploying
+# code that reads the ordinals. Nothing falls back to the strings, so a
+# booking without check_in_day/check_out_day is invisible to overlap queries,
+# booked-date calendars and occupancy. A booking whose check_in/check_out
+# string cannot be parsed gets null ordinals instead of failing the run; the
+# command lists them at the end so they can be corrected and migrated with
+# `--restart`.
+
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+MIGRATION_ID = 'booking_day_ordinals'
+# Bookings the migration could not convert (missing or malformed date strings)
+UNCONVERTED = {'$or': [{'check_in_day': None}, {'check_out_day': None}]}
+
+
+def day_string(day):
+    return datetime.date.fromordinal(day).isoformat()
+
+
+def overlap_query(room_type, start_day, end_day, status='active', property_code=None):
+    """Filter for bookings of `room_type` whose stay overlaps [start_day, end_day)."""
+    query = {'property': property_code} if property_code is not None else {}
+    query.update({
+        'room_type': room_type,
+        'check_in_day': {'$lt': end_day},
+        'check_out_day': {'$gt': start_day}
+    })
+    if status is not None:
+        query['status'] = status
+    return query
+
+
+def overlapping_bookings(room_type, start_day, end_day, projection=None, status='active', property_code=None):
+    """Bookings overlapping [start_day, end_day), served by the property/room_type/status/day index."""
+    return mongo.db.bookings.find(overlap_query(room_type, start_day, end_day, status, property_code), projection)
+
+
+# --- Migration: add day ordinals to existing bookings ---
+def _ordinal_expr(field):
+    return {'$add': [
+        {'$toLong': {'$divide': [
+            {'$toLong': {'$dateFromString': {'dateString': f'${field}', 'format': '%Y-%m-%d',
+                                             'onError': None, 'onNull': None}}},
+            86400000
+        ]}},
+        EPOCH_ORDINAL
+    ]}
+
+
+def migrate_booking_days(db, batch_size=5000, restart=False, echo=None):
+    """
+    Adds check_in_day/check_out_day to bookings in _id order, one batch per
+    update_many. The conversion runs server-side (pipeline update), and the
+    last migrated _id is checkpointed so an interrupted run resumes. A date
+    string that does not parse leaves null ordinals rather than failing the
+    batch. Returns (bookings migrated, bookings left without ordinals).
+    """
+    state = db.migrations.find_one({'_id': MIGRATION_ID}) or {}
+    last_id = None if restart else state.get('last_id')
+    migrated = 0
+    while True:
+        id_filter = {'_id': {'$gt': last_id}} if last_id is not None else {}
+        ids = [d['_id'] for d in db.bookings.find(id_filter, {'_id': 1}).sort('_id', 1).limit(batch_size)]
+        if not ids:
+            break
+        result = db.bookings.update_many(
+            {'_id': {'$gte': ids[0], '$lte': ids[-1]}, **UNCONVERTED},
+            [{'$set': {
+                'check_in_day': _ordinal_expr('check_in'),
+                'check_out_day': _ordinal_expr('check_out')
+            }}]
+        )
+        migrated += result.modified_count
+        last_id = ids[-1]
+        db.migrations.update_one({'_id': MIGRATION_ID},
+                                 {'$set': {'last_id': last_id, 'updated_at': datetime.datetime.now(datetime.timezone.utc)}},
+                                 upsert=True)
+        if echo:
+            echo(f'... {migrated:,} bookings migrated (last _id {last_id})')
+    unconverted = db.bookings.count_documents(UNCONVERTED)
+    db.migrations.update_one({'_id': MIGRATION_ID},
+                             {'$set': {'completed_at': datetime.datetime.now(datetime.timezone.utc),
+                                       'unconverted': unconverted}},
+                             upsert=True)
+    return migrated, unconverted
+
+
+@click.command('migrate-booking-dates')
+@click.option('--batch-size', default=5000, show_default=True, help='Bookings per update batch.')
+@click.option('--restart', is_flag=True, help='Ignore the saved checkpoint and start from the first booking.')
+@with_appcontext
+def migrate_booking_dates_command(batch_size, restart):
+    """Add integer day ordinals (check_in_day/check_out_day) to existing bookings."""
+    migrated, unconverted = migrate_booking_days(mongo.db, batch_size, restart, echo=click.echo)
+    click.echo(f'Done: {migrated:,} bookings migrated.')
+    if unconverted:
+        click.echo(f'{unconverted:,} bookings have a missing or malformed check_in/check_out and no day '
+                   'ordinals, so overlap checks and occupancy ignore them. Fix their dates and re-run '
+                   'with --restart. First few:', err=True)
+        for doc in mongo.db.bookings.find(UNCONVERTED, {'booking_id': 1, 'check_in': 1, 'check_out': 1}).limit(20):
+            click.echo(f"  {doc.get('booking_id', doc['_id'])}: {doc.get('check_in')!r} -> {doc.get('check_out')!r}",
+                       err=True)
@@ -0,0 +1,238 @@
+import datetime
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+
+import gridfs
+from flask import Request, Response, current_app, send_file
+from pymongo import ReturnDocument
+from werkzeug.exceptions import NotFound, RequestEntityTooLarge
+
+from utils.db import mongo
+
+# --- Review image store ---
+# Uploads are content-addressed: a blob is named by the SHA-256 of its bytes.
+# The hash is computed while Werkzeug parses the multipart body -- the file
+# part is written into a HashingSpool (UploadRequest below), which hashes each
+# chunk and aborts with 413 as soon as UPLOAD_MAX_BYTES is passed, so an
+# oversized file is never buffered in full. The request's Content-Length is
+# checked against the same cap before parsing starts.
+#
+# A photo that is already stored costs one $inc on its blobs document and no
+# write at all. Blobs live on local disk (UPLOAD_BACKEND=local, one directory
+# per worker host) or in GridFS (UPLOAD_BACKEND=gridfs, shared by every
+# worker and node). Since a name can never point at different bytes, they are
+# served with a one-year immutable Cache-Control and the digest as ETag.
+#
+# The blobs document is the lock for its file. The last release marks the
+# document `deleting` before it removes the file, and only deletes the
+# document afterwards (or clears the mark, if a new reference arrived in the
+# meantime). A store that finds the mark waits for it to go before checking
+# whether the file is there, so it can never skip the put and then watch the
+# file disappear under its new reference.
+
+CHUNK_BYTES = 64 * 1024
+SPOOL_BYTES = 512 * 1024
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+GRIDFS_BUCKET = 'review_images'
+DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+# How long a store waits on a release that is deleting the same blob
+DELETE_WAIT_SECONDS = 5
+
+# Leading bytes -> (extension, mimetype); anything else is rejected
+IMAGE_SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'png', 'image/png'),
+    (b'\xff\xd8\xff', 'jpg', 'image/jpeg'),
+    (b'GIF87a', 'gif', 'image/gif'),
+    (b'GIF89a', 'gif', 'image/gif'),
+]
+MIMETYPES = {ext: mimetype for _, ext, mimetype in IMAGE_SIGNATURES}
+
+
+class UploadRejected(Exception):
+    """An upload that is not stored; str() is shown to the user."""
+
+
+class HashingSpool(tempfile.SpooledTemporaryFile):
+    """Spooled temp file that hashes and size-checks every chunk as it is written."""
+
+    def __init__(self, max_bytes=None):
+        super().__init__(max_size=SPOOL_BYTES)
+        self.max_bytes = max_bytes
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.head = b''
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_bytes and self.size > self.max_bytes:
+            raise RequestEntityTooLarge()
+        if len(self.head) < 16:
+            self.head += bytes(data[:16 - len(self.head)])
+        self.sha256.update(data)
+        return super().write(data)
+
+
+class UploadRequest(Request):
+    """Request whose multipart file parts are written into HashingSpools."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingSpool(current_app.config.get('UPLOAD_MAX_BYTES'))
+
+
+def sniff_image(head):
+    for signature, ext, mimetype in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return ext, mimetype
+    return None, None
+
+
+# --- Backends ---
+class LocalBlobStore:
+    """Blobs under root/ab/cd/<digest>."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest):
+        return os.path.exists(self._path(digest))
+
+    def put(self, digest, stream):
+        path = self._path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp, 'wb') as out:
+            shutil.copyfileobj(stream, out, CHUNK_BYTES)
+        # Atomic: a concurrent upload of the same bytes just replaces it with identical content
+        os.replace(tmp, path)
+
+    def response(self, digest, mimetype):
+        return send_file(self._path(digest), mimetype=mimetype, conditional=False, etag=False)
+
+    def delete(self, digest):
+        try:
+            os.remove(self._path(digest))
+        except FileNotFoundError:
+            pass
+
+
+class GridFSBlobStore:
+    """Blobs in a GridFS bucket, with the digest as the file _id."""
+
+    def __init__(self, db, bucket_name=GRIDFS_BUCKET):
+        self.db = db
+        self.bucket_name = bucket_name
+        self.bucket = gridfs.GridFSBucket(db, bucket_name=bucket_name)
+
+    def exists(self, digest):
+        return self.db[f'{self.bucket_name}.files'].count_documents({'_id': digest}, limit=1) > 0
+
+    def put(self, digest, stream):
+        try:
+            self.bucket.upload_from_stream_with_id(digest, digest, stream)
+        except gridfs.errors.FileExists:
+            pass
+
+    def response(self, digest, mimetype):
+        grid_out = self.bucket.open_download_stream(digest)
+        return Response(iter(lambda: grid_out.read(CHUNK_BYTES), b''), mimetype=mimetype,
+                        headers={'Content-Length': str(grid_out.length)})
+
+    def delete(self, digest):
+        try:
+            self.bucket.delete(digest)
+        except gridfs.errors.NoFile:
+            pass
+
+
+def blob_store():
+    return current_app.extensions['blob_store']
+
+
+# --- Store / release / serve ---
+def store_upload(file_storage):
+    """
+    Stores an uploaded image (already hashed while it was parsed) and takes a
+    reference on it. Returns the blob name '<digest>.<ext>'.
+    """
+    spool = file_storage.stream
+    if not isinstance(spool, HashingSpool):
+        raise UploadRejected('Upload could not be read.')
+    ext, mimetype = sniff_image(spool.head)
+    if ext is None:
+        raise UploadRejected('Please upload a PNG, JPEG or GIF image.')
+    digest = spool.sha256.hexdigest()
+
+    # Take the reference first: once refs > 0, a release can no longer start deleting the file
+    doc = mongo.db.blobs.find_one_and_update(
+        {'_id': digest},
+        {'$inc': {'refs': 1},
+         '$setOnInsert': {'size': spool.size, 'mimetype': mimetype, 'ext': ext,
+                          'created_at': datetime.datetime.now(datetime.timezone.utc)}},
+        upsert=True, return_document=ReturnDocument.AFTER
+    )
+    name = f'{digest}.{ext}'
+    store = blob_store()
+    try:
+        _wait_for_delete(digest, doc)
+        if not store.exists(digest):
+            spool.seek(0)
+            store.put(digest, spool)
+    except Exception:
+        release_blob(name)
+        raise
+    return name
+
+
+def _wait_for_delete(digest, doc):
+    """Waits (briefly) for a release that was already deleting this blob's file."""
+    deadline = time.monotonic() + DELETE_WAIT_SECONDS
+    while doc and doc.get('deleting') and time.monotonic() < deadline:
+        time.sleep(0.05)
+        doc = mongo.db.blobs.find_one({'_id': digest}, {'deleting': 1})
+
+
+def release_blob(name):
+    """Drops one reference; the blob is deleted with its last reference."""
+    digest = name.split('.', 1)[0]
+    mongo.db.blobs.update_one({'_id': digest}, {'$inc': {'refs': -1}})
+    claimed = mongo.db.blobs.find_one_and_update(
+        {'_id': digest, 'refs': {'$lte': 0}, 'deleting': {'$exists': False}},
+        {'$set': {'deleting': datetime.datetime.now(datetime.timezone.utc)}}
+    )
+    if not claimed:
+        return
+    blob_store().delete(digest)
+    if not mongo.db.blobs.delete_one({'_id': digest, 'refs': {'$lte': 0}}).deleted_count:
+        # A store took a reference while we deleted; it puts the file back once this clears
+        mongo.db.blobs.update_one({'_id': digest}, {'$unset': {'deleting': ''}})
+
+
+def blob_response(request, digest, ext):
+    """Immutable response for a blob (304 straight away when the client has it)."""
+    headers = {'Cache-Control': f'public, max-age={IMMUTABLE_MAX_AGE}, immutable', 'ETag': f'"{digest}"'}
+    if digest in request.if_none_match:
+        return Response(status=304, headers=headers)
+    try:
+        response = blob_store().response(digest, MIMETYPES[ext])
+    except (FileNotFoundError, gridfs.errors.NoFile):
+        raise NotFound()
+    response.headers.update(headers)
+    return response
+
+
+def init_uploads(app):
+    """Installs UploadRequest and the configured blob store."""
+    app.request_class = UploadRequest
+    if app.config.get('UPLOAD_BACKEND') == 'gridfs':
+        app.extensions['blob_store'] = GridFSBlobStore(mongo.db)
+    else:
+        root = app.config.get('UPLOAD_DIR') or os.path.join(app.instance_path, 'blobs')
+        app.extensions['blob_store'] = LocalBlobStore(root)
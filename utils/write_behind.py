@@ -0,0 +1,251 @@
+import atexit
+import datetime
+import os
+import threading
+import time
+import uuid
+
+from bson import ObjectId, json_util
+from bson.errors import BSONError, InvalidDocument
+from flask import g, has_request_context, request, session
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from utils.db import mongo
+from utils.metrics import WRITE_BEHIND_BATCH, WRITE_BEHIND_DOCS, WRITE_BEHIND_PENDING
+
+# --- Write-behind buffer for append-only collections ---
+# contacts, reviews and audit_log are only ever appended to, so a request
+# does not have to wait for its insert: add() puts the document in an
+# in-process buffer and returns. A flusher thread (a green thread under the
+# eventlet worker) writes each collection's pending documents with one
+# insert_many when WRITE_BEHIND_MAX_DOCS are waiting or WRITE_BEHIND_MAX_DELAY
+# seconds have passed, so a burst of N submissions costs a handful of round
+# trips instead of N.
+#
+# Durability: every document gets its _id when it is buffered. If a flush
+# fails, the batch is appended to an NDJSON spool file per collection
+# (WRITE_BEHIND_SPOOL_DIR) and replayed on the next successful flush;
+# duplicates from a partly applied batch are skipped by _id. The buffer is
+# flushed at interpreter exit (gunicorn's graceful worker shutdown included).
+# What is lost is at most the last MAX_DELAY seconds on a hard kill.
+# Spool lines that cannot be parsed (a torn append) and documents Mongo can
+# never accept go to <collection>.ndjson.rejected instead of being retried.
+#
+# Readers that must see their own write (the reviews page right after a
+# post) can merge pending(collection) into their results.
+
+DEFAULT_MAX_DOCS = 500
+DEFAULT_MAX_DELAY = 1.0
+DUPLICATE_KEY = 11000
+# A .replay file untouched this long belongs to a replay whose process died
+REPLAY_TAKEOVER_SECONDS = 300
+
+
+class WriteBehindBuffer:
+    """Per-process buffer of documents awaiting insert_many, keyed by collection."""
+
+    def __init__(self, max_docs=DEFAULT_MAX_DOCS, max_delay=DEFAULT_MAX_DELAY, spool_dir=None):
+        self.max_docs = max_docs
+        self.max_delay = max_delay
+        self.spool_dir = spool_dir
+        self._lock = threading.Lock()
+        self._flush_lock = threading.RLock()
+        self._wake = threading.Event()
+        self._pending = {}
+        self._count = 0
+        self._thread = None
+        self._closed = False
+
+    def configure(self, max_docs, max_delay, spool_dir):
+        self.max_docs = max_docs
+        self.max_delay = max_delay
+        self.spool_dir = spool_dir
+
+    def add(self, collection, doc):
+        """Buffers `doc` for `collection` and returns its _id; never touches Mongo."""
+        doc.setdefault('_id', ObjectId())
+        if self._closed:
+            self._write(collection, [doc])
+            return doc['_id']
+        with self._lock:
+            self._pending.setdefault(collection, []).append(doc)
+            self._count += 1
+            full = self._count >= self.max_docs
+            if self._thread is None:
+                # Started on first use, i.e. after the server has forked its workers
+                self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                self._thread.start()
+        WRITE_BEHIND_PENDING.inc()
+        if full:
+            self._wake.set()
+        return doc['_id']
+
+    def pending(self, collection):
+        """Copies of the documents still waiting to be written to `collection`."""
+        with self._lock:
+            return [dict(doc) for doc in self._pending.get(collection, [])]
+
+    def _run(self):
+        try:
+            self.replay_spool()
+        except Exception as e:
+            print(f"Write-behind spool replay failed: {e!r}")
+        while not self._closed:
+            self._wake.wait(self.max_delay)
+            self._wake.clear()
+            # The thread is never restarted, so nothing may escape this loop
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Write-behind flush failed: {e!r}")
+
+    def flush(self):
+        """Writes everything buffered so far (one insert_many per collection)."""
+        with self._flush_lock:
+            with self._lock:
+                batches, self._pending, count = self._pending, {}, self._count
+                self._count = 0
+            WRITE_BEHIND_PENDING.dec(amount=count)
+            written = [self._write(collection, docs) for collection, docs in batches.items()]
+            # Mongo is reachable again: a good moment to drain anything spooled earlier
+            if written and all(written):
+                self.replay_spool()
+
+    def _write(self, collection, docs):
+        """insert_many, spooling the batch on failure. Returns True when it was written."""
+        try:
+            mongo.db[collection].insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            if any(err['code'] != DUPLICATE_KEY for err in e.details['writeErrors']):
+                self._spool(collection, docs, e)
+                return False
+        except InvalidDocument:
+            return self._write_each(collection, docs)
+        except PyMongoError as e:
+            self._spool(collection, docs, e)
+            return False
+        WRITE_BEHIND_BATCH.observe(len(docs), collection)
+        WRITE_BEHIND_DOCS.inc(collection, 'inserted', amount=len(docs))
+        return True
+
+    def _write_each(self, collection, docs):
+        """One document at a time, so a document BSON can't encode doesn't sink its batch."""
+        failed, rejected = [], []
+        for doc in docs:
+            try:
+                mongo.db[collection].insert_one(doc)
+            except InvalidDocument:
+                rejected.append(repr(doc))
+            except PyMongoError as e:
+                if getattr(e, 'code', None) != DUPLICATE_KEY:
+                    failed.append(doc)
+        if rejected:
+            self._reject(collection, rejected, 'cannot be encoded as BSON')
+        if failed:
+            self._spool(collection, failed, 'insert failed')
+        WRITE_BEHIND_DOCS.inc(collection, 'inserted', amount=len(docs) - len(failed) - len(rejected))
+        return not failed
+
+    # --- Spool (durable fallback) ---
+    def _spool_path(self, collection):
+        return os.path.join(self.spool_dir, f'{collection}.ndjson')
+
+    def _reject(self, collection, lines, reason):
+        """Quarantines lines that will never be written, for a human to look at."""
+        WRITE_BEHIND_DOCS.inc(collection, 'rejected', amount=len(lines))
+        print(f"Write-behind rejected {len(lines)} {collection} documents ({reason})")
+        if not self.spool_dir:
+            return
+        os.makedirs(self.spool_dir, exist_ok=True)
+        with open(f'{self._spool_path(collection)}.rejected', 'a', encoding='utf-8') as fh:
+            for line in lines:
+                fh.write(line.rstrip('\n') + '\n')
+
+    def _spool(self, collection, docs, error):
+        WRITE_BEHIND_DOCS.inc(collection, 'spooled', amount=len(docs))
+        if not self.spool_dir:
+            print(f"Write-behind flush to {collection} failed, {len(docs)} documents dropped: {error}")
+            return
+        print(f"Write-behind flush to {collection} failed, spooling {len(docs)} documents: {error}")
+        os.makedirs(self.spool_dir, exist_ok=True)
+        with open(self._spool_path(collection), 'a', encoding='utf-8') as fh:
+            for doc in docs:
+                fh.write(json_util.dumps(doc) + '\n')
+            fh.flush()
+            os.fsync(fh.fileno())
+
+    def replay_spool(self):
+        """Re-inserts spooled documents; a file is removed only once all of it is written."""
+        if not self.spool_dir or not os.path.isdir(self.spool_dir):
+            return
+        with self._flush_lock:
+            for name in sorted(os.listdir(self.spool_dir)):
+                path = os.path.join(self.spool_dir, name)
+                if name.endswith('.replay'):
+                    # Claimed by a replay that never finished (process died): take it
+                    # over, but only once it's old enough that nobody is still reading it
+                    try:
+                        if time.time() - os.path.getmtime(path) < REPLAY_TAKEOVER_SECONDS:
+                            continue
+                    except FileNotFoundError:
+                        continue
+                elif not name.endswith('.ndjson'):
+                    continue
+                # Claim the file first so a failing replay spools into a fresh one;
+                # the rename is atomic, so only one worker wins it
+                collection = name.split('.ndjson', 1)[0]
+                claimed = os.path.join(self.spool_dir, f'{collection}.ndjson.{uuid.uuid4().hex}.replay')
+                try:
+                    os.replace(path, claimed)
+                    os.utime(claimed)
+                    with open(claimed, encoding='utf-8') as fh:
+                        lines = [line for line in fh if line.strip()]
+                except FileNotFoundError:
+                    continue
+                docs, torn = [], []
+                for line in lines:
+                    try:
+                        docs.append(json_util.loads(line))
+                    except (ValueError, BSONError):
+                        torn.append(line)
+                if torn:
+                    self._reject(collection, torn, 'unreadable spool line')
+                if docs:
+                    self._write(collection, docs)
+                try:
+                    os.remove(claimed)
+                except FileNotFoundError:
+                    pass
+
+    def close(self):
+        """Final flush; later add() calls write through synchronously."""
+        self._closed = True
+        self._wake.set()
+        self.flush()
+
+
+write_behind = WriteBehindBuffer()
+
+
+def audit(action, **details):
+    """Appends an audit_log entry (who, what, from where) through the write-behind buffer."""
+    doc = {'action': action, 'at': datetime.datetime.now(datetime.timezone.utc), **details}
+    if has_request_context():
+        doc.setdefault('actor', session.get('user_email'))
+        prop = g.get('property')
+        if prop is not None:
+            doc['property'] = prop.code
+        doc['ip'] = request.remote_addr  # ProxyFix sets it behind a proxy; X-Forwarded-For is client-controlled
+        doc['endpoint'] = request.endpoint
+    write_behind.add('audit_log', doc)
+
+
+def init_write_behind(app):
+    write_behind.configure(
+        int(app.config.get('WRITE_BEHIND_MAX_DOCS') or DEFAULT_MAX_DOCS),
+        float(app.config.get('WRITE_BEHIND_MAX_DELAY') or DEFAULT_MAX_DELAY),
+        app.config.get('WRITE_BEHIND_SPOOL_DIR') or os.path.join(app.instance_path, 'write_behind'),
+    )
+
+
+atexit.register(write_behind.close)